@@ -1,12 +1,40 @@
+import os
 import sys
-from PyQt5.QtCore import Qt, QUrl, QPoint
-from PyQt5.QtWidgets import QApplication, QMainWindow, QTabWidget, QVBoxLayout, QLineEdit, QToolBar, QAction, QHBoxLayout, QLabel, QPushButton, QWidget, QMenu, QShortcut
+import threading
+import time
+
+# Imported before Qt so the startup profile also covers loading the Qt libraries
+from startup import profile_output, startup_profile
+
+from PyQt5.QtCore import Qt, QUrl, QUrlQuery, QPoint, QByteArray, QTimer, QSettings, QStandardPaths
+from PyQt5.QtWidgets import QApplication, QMainWindow, QTabWidget, QVBoxLayout, QLineEdit, QToolBar, QAction, QHBoxLayout, QLabel, QPushButton, QWidget, QMenu, QShortcut, QMessageBox, QFileDialog
 from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtGui import QIcon, QMouseEvent, QPixmap, QKeySequence
+from PyQt5.QtGui import QIcon, QMouseEvent, QPixmap, QKeySequence, QPainter
+from automation import Automation, SocketChannel, StdinChannel, headless_option
+from backforward import BackForwardCache
+from bookmarks import BookmarkStore, BookmarksDialog
+from config import setting, data_path
+from contentblock import ContentBlocker, filter_lists, load_filter_lists
+from downloads import DownloadManager, DownloadsDialog
+from favicons import FaviconCache
+from history import HistoryStore, HistoryDialog, recordable
+from instance import InstanceServer, forward_urls, instance_name, launch_urls
+from lifecycle import LifecycleManager
+from newtab import NEW_TAB_URL, NewTabSchemeHandler, register_scheme
+from omnibox import BOOKMARK_BONUS, FrecencyIndex, Omnibox, frecency
+from profiles import ProfileManager
+from session import SessionStore, TransientSession, decode_bytes
+from tabs import LazyTab, TabManager, TabPage, ViewPool
+from taskmanager import ResourceMonitor, TaskManagerDialog
+from speculate import Prerenderer, Speculator, predicted_url, prediction
+from telemetry import LoadOverlay, PageLoadTelemetry, ms
+from themes import ThemeEngine
+
+startup_profile.mark('qt_imported')
 
 
 class Browser(QMainWindow):
-    def __init__(self):
+    def __init__(self, session=None, urls=()):
         super().__init__()
         self.setWindowTitle("Cwanda")
         self.setGeometry(100, 90, 1200, 700)
@@ -20,23 +48,77 @@ class Browser(QMainWindow):
         self.browser_tabs = QTabWidget()
         self.browser_tabs.setTabsClosable(True)
         self.browser_tabs.tabCloseRequested.connect(self.close_tab)
+        self.browser_tabs.currentChanged.connect(self.current_tab_changed)
 
-        self.setCentralWidget(self.browser_tabs)
+        # Discards least recently used background tabs when over budget
+        self.tab_manager = TabManager(self.browser_tabs,
+                                      max_live_tabs=setting('tabs/max_live_tabs'),
+                                      memory_budget_mb=setting('tabs/memory_budget_mb'))
 
-        self.add_new_tab(QUrl('http://localhost:3000/cwanda.html'), 'New Tab')
+        # Freezes hidden tabs so their timers and scripts stop, and discards them later on
+        self.lifecycle = LifecycleManager(self.tab_manager,
+                                          freeze_after_s=setting('lifecycle/freeze_after_s'),
+                                          discard_after_s=setting('lifecycle/discard_after_s'))
+        self.browser_tabs.tabBar().setContextMenuPolicy(Qt.CustomContextMenu)
+        self.browser_tabs.tabBar().customContextMenuRequested.connect(self.show_tab_menu)
 
-        # Shortcut key to open a new tab
-        QShortcut(QKeySequence('Ctrl+T'), self, lambda: self.add_new_tab(QUrl('http://localhost:3000/cwanda.html'), 'New Tab'))
+        self.setCentralWidget(self.browser_tabs)
 
+        # Per tab CPU, memory and network use, sampled only while the task manager is open
+        self.resource_monitor = ResourceMonitor(self.tab_manager,
+                                                interval_ms=setting('taskmanager/interval_ms'),
+                                                keep=setting('taskmanager/samples'))
+        self.task_manager_dialog = None
+        self.downloads_dialog = None
+
+        # Every tab uses the application's profile, with its disk cache and cookies. The
+        # stores and the pool of prewarmed new tab views are shared by all windows too.
+        QApplication.instance().windows.append(self)
+        self.profiles = QApplication.instance().profiles
+        self.history = QApplication.instance().history
+        self.bookmarks = QApplication.instance().bookmarks
+        self.favicons = QApplication.instance().favicons
+        self.themes = QApplication.instance().themes
+        self.omnibox_index = QApplication.instance().omnibox_index
+        self.view_pool = QApplication.instance().view_pool
+        self.telemetry = QApplication.instance().telemetry
+        self.speculator = QApplication.instance().speculator
+        self.prerenderer = QApplication.instance().prerenderer
+        self.back_forward = QApplication.instance().back_forward
+
+        # Page load timings drawn over the page, shown and hidden with Ctrl+Shift+P
+        self.load_overlay = LoadOverlay(self.telemetry, lambda: self.browser_tabs.currentWidget().url.toString(),
+                                        self.browser_tabs)
+        QShortcut(QKeySequence('Ctrl+Shift+P'), self, self.load_overlay.toggle)
+
+        # The url bar has to exist before the first tab starts loading
         self.create_navigation_bar()
 
-        # Set initial theme to light mode
-        self.is_dark_mode = False
-        self.set_light_mode()
+        self.startup_finished = False
+
+        # Shortcut key to open an incognito tab
+        QShortcut(QKeySequence('Ctrl+Shift+N'), self, self.start_incognito_mode)
+
+        # Bring back the tabs from the last run, or start with a new tab
+        self.session = session if session is not None else QApplication.instance().session().window()
+        if not self.restore_session() and not urls:
+            self.add_new_tab(QUrl(NEW_TAB_URL), 'New Tab')
+        for url in urls:
+            self.add_new_tab(QUrl(url), url)
+
+        # Shortcut key to open a new tab
+        QShortcut(QKeySequence('Ctrl+T'), self, lambda: self.add_new_tab(QUrl(NEW_TAB_URL), 'New Tab'))
+
+        # Shortcut key to open a new window
+        QShortcut(QKeySequence('Ctrl+N'), self, lambda: QApplication.instance().open_window())
 
         # Create a custom title bar
         self.create_title_bar()
 
+        # Start with the theme picked last time, light mode by default
+        self.set_theme(setting('appearance/theme'))
+        startup_profile.mark('window_created')
+
     def create_title_bar(self):
         self.title_bar = QWidget(self)
         self.title_bar.setObjectName("title_bar")
@@ -98,185 +180,501 @@ class Browser(QMainWindow):
 
         # Create actions with icons for the navigation buttons
         back_btn = QAction(QIcon('back_icon.png'), "Back", self)
-        back_btn.triggered.connect(lambda: self.browser_tabs.currentWidget().back())
+        back_btn.triggered.connect(self.go_back)
         self.nav_bar.addAction(back_btn)
 
         # Shortcut for back
-        QShortcut(QKeySequence('Ctrl+left'), self, lambda: self.browser_tabs.currentWidget().back())
+        QShortcut(QKeySequence('Ctrl+left'), self, self.go_back)
 
         forward_btn = QAction(QIcon('forward_icon.png'), "Forward", self)
-        forward_btn.triggered.connect(lambda: self.browser_tabs.currentWidget().forward())
+        forward_btn.triggered.connect(self.go_forward)
         self.nav_bar.addAction(forward_btn)
 
+        # Shortcut for forward
+        QShortcut(QKeySequence('Ctrl+right'), self, self.go_forward)
+
         reload_btn = QAction(QIcon('reload_icon.png'), "Reload", self)
-        reload_btn.triggered.connect(lambda: self.browser_tabs.currentWidget().reload())
+        reload_btn.triggered.connect(lambda: self.current_browser().reload())
         self.nav_bar.addAction(reload_btn)
 
         home_btn = QAction(QIcon('home_icon.png'), "Home", self)
-        home_btn.triggered.connect(lambda: self.browser_tabs.currentWidget().setUrl(QUrl("http://localhost:3000/cwanda.html")))
+        home_btn.triggered.connect(lambda: self.current_browser().setUrl(QUrl(NEW_TAB_URL)))
         self.nav_bar.addAction(home_btn)
 
         self.url_bar = QLineEdit()
         self.url_bar.returnPressed.connect(self.navigate_to_url)
         self.nav_bar.addWidget(self.url_bar)
 
+        # Suggestions from history, bookmarks and open tabs while typing
+        self.omnibox = Omnibox(self.url_bar, self.omnibox_index, self.open_tab_urls,
+                               debounce_ms=setting('omnibox/debounce_ms'))
+        self.omnibox.completer.activated[str].connect(self.open_suggestion)
+        self.omnibox.listeners.append(self.speculate_typed)
+
+        # Filled in while the current page is bookmarked
+        self.bookmark_btn = QAction("☆", self)
+        self.bookmark_btn.setToolTip("Bookmark this page")
+        self.bookmark_btn.triggered.connect(self.toggle_bookmark)
+        self.nav_bar.addAction(self.bookmark_btn)
+        QShortcut(QKeySequence('Ctrl+D'), self, self.toggle_bookmark)
+
         new_tab_btn = QAction(QIcon('new_tab_icon.png'), "New Tab", self)
-        new_tab_btn.triggered.connect(lambda: self.add_new_tab(QUrl('http://localhost:3000/cwanda.html'), 'New Tab'))
+        new_tab_btn.triggered.connect(lambda: self.add_new_tab(QUrl(NEW_TAB_URL), 'New Tab'))
         self.nav_bar.addAction(new_tab_btn)
 
-        # Add settings menu button
+        # Add settings menu button, its entries are added after the first paint
         settings_btn = QAction(QIcon('settings_icon.png'), "Settings", self)
         self.settings_menu = QMenu(self)
+        settings_btn.setMenu(self.settings_menu)
+        self.nav_bar.addAction(settings_btn)
 
+    def create_settings_menu(self):
         # Toggle Mode submenu
         toggle_mode_menu = QMenu("Mode", self)
-        toggle_mode_menu.addAction("White", lambda: self.set_custom_color_mode("#fff"))
-        toggle_mode_menu.addAction("Lavender", lambda: self.set_custom_color_mode("#E6E6FA"))
-        toggle_mode_menu.addAction("Normal", lambda: self.set_custom_color_mode("#3c3c3c"))
-        toggle_mode_menu.addAction("Custom Color", lambda: self.set_custom_color_mode("#252635"))
-        toggle_mode_menu.addAction("Dark", lambda: self.set_custom_color_mode("#333"))
+        toggle_mode_menu.addAction("Light", self.set_light_mode)
+        toggle_mode_menu.addAction("White", lambda: self.choose_theme("White"))
+        toggle_mode_menu.addAction("Lavender", lambda: self.choose_theme("Lavender"))
+        toggle_mode_menu.addAction("Normal", lambda: self.choose_theme("Normal"))
+        toggle_mode_menu.addAction("Custom Color", lambda: self.choose_theme("Custom"))
+        toggle_mode_menu.addAction("Dark", self.set_dark_mode)
 
         self.settings_menu.addMenu(toggle_mode_menu)
+
+        cache_menu = QMenu("Cache", self)
+        cache_menu.addAction("Cache Usage", self.show_cache_stats)
+        cache_menu.addAction("Clear Cache", self.clear_cache)
+        self.settings_menu.addMenu(cache_menu)
+
         self.settings_menu.addAction("History", self.show_history)
         self.settings_menu.addAction("Bookmarks", self.show_bookmarks)
+        self.settings_menu.addAction("Downloads", self.show_downloads)
+        self.settings_menu.addAction("New Window", lambda: QApplication.instance().open_window())
         self.settings_menu.addAction("Incognito", self.start_incognito_mode)
+        self.settings_menu.addAction("Tab Memory", self.show_tab_stats)
+        self.settings_menu.addAction("Task Manager", self.show_task_manager)
+
+        loads_menu = QMenu("Page Loads", self)
+        loads_menu.addAction("Show Timings", self.load_overlay.toggle)
+        loads_menu.addAction("Export JSON", lambda: self.export_load_timings('json'))
+        loads_menu.addAction("Export CSV", lambda: self.export_load_timings('csv'))
+        self.settings_menu.addMenu(loads_menu)
+
+        blocking_menu = QMenu("Content Blocking", self)
+        enabled = blocking_menu.addAction("Block Ads and Trackers", self.toggle_blocking)
+        enabled.setCheckable(True)
+        enabled.setChecked(QApplication.instance().content_blocker.enabled)
+        blocking_menu.addAction("Blocked Requests", self.show_blocking_stats)
+        blocking_menu.addAction("Reload Filter Lists", QApplication.instance().load_filters)
+        self.settings_menu.addMenu(blocking_menu)
+
+        speculate_menu = QMenu("DNS Prefetch", self)
+        enabled = speculate_menu.addAction("Look Up Hosts Ahead", self.toggle_speculation)
+        enabled.setCheckable(True)
+        enabled.setChecked(self.speculator.enabled)
+        speculate_menu.addAction("DNS Prefetch Hits", self.show_speculation_stats)
+        self.settings_menu.addMenu(speculate_menu)
+
+        prerender_menu = QMenu("Prerender", self)
+        enabled = prerender_menu.addAction("Load Likely Page Ahead", self.toggle_prerender)
+        enabled.setCheckable(True)
+        enabled.setChecked(self.prerenderer.enabled)
+        prerender_menu.addAction("Prerender Hits", self.show_prerender_stats)
+        self.settings_menu.addMenu(prerender_menu)
+
+        back_forward_menu = QMenu("Back/Forward", self)
+        enabled = back_forward_menu.addAction("Show Page Snapshots", self.toggle_back_forward)
+        enabled.setCheckable(True)
+        enabled.setChecked(self.back_forward.enabled)
+        back_forward_menu.addAction("Snapshot Hits", self.show_back_forward_stats)
+        self.settings_menu.addMenu(back_forward_menu)
         self.settings_menu.addAction("Help", self.show_help)
 
-        settings_btn.setMenu(self.settings_menu)
-        self.nav_bar.addAction(settings_btn)
-
-    def add_new_tab(self, qurl=None, label="Blank"):
+    def add_new_tab(self, qurl=None, label="Blank", background=False, incognito=False):
         if qurl is None:
             qurl = QUrl("")
 
-        browser = QWebEngineView()
-        browser.setUrl(qurl)
-        browser.urlChanged.connect(self.update_url)
-        browser.titleChanged.connect(lambda title: self.update_tab_title(browser, title))
-        browser.iconChanged.connect(lambda icon: self.update_tab_icon(browser, icon))
+        # The web view is only created once the tab gets selected (see current_tab_changed)
+        tab = LazyTab(qurl, label, self.favicons.icon_for(qurl), incognito=incognito)
+        if incognito:
+            tab.profile = self.profiles.acquire_incognito()
+        i = self.browser_tabs.addTab(tab, tab.icon, self.tab_text(tab, label))
+        # The session leaves incognito tabs out, so count only the others in front of this one
+        self.session.tab_opened(tab, sum(not other.incognito for other in self.tab_manager.tabs()[:i]))
+        if not background:
+            self.browser_tabs.setCurrentIndex(i)
+        return tab
+
+    def restore_session(self):
+        records = self.session.saved_tabs()
+        if not records:
+            return False
+
+        if self.session.geometry:
+            self.restoreGeometry(QByteArray(decode_bytes(self.session.geometry)))
+
+        # Restored tabs stay placeholders, only the active one gets a web view
+        self.browser_tabs.blockSignals(True)
+        for record in records:
+            # Icons come from the favicon cache, so placeholders look right without loading anything
+            tab = LazyTab(QUrl(record['url']), record['title'], self.favicons.icon_for(record['url']))
+            tab.history_state = self.session.history_of(record)
+            tab.pinned = record.get('pinned', False)
+            self.session.attach(tab, record['id'])
+            self.browser_tabs.addTab(tab, tab.icon, self.tab_text(tab, record['title']))
+        active = self.session.active_index()
+        self.browser_tabs.setCurrentIndex(active)
+        self.browser_tabs.blockSignals(False)
+        self.current_tab_changed(active)
+        return True
+
+    def create_view(self, profile=None):
+        return QApplication.instance().create_view(profile)
+
+    def materialize_tab(self, tab):
+        # New tabs take a prewarmed view from the pool when there is one
+        if tab.incognito:
+            prewarmed = None
+        else:
+            prewarmed = self.view_pool.take(tab.url) if tab.history_state is None else None
+        browser = prewarmed if prewarmed is not None else self.create_view(tab.profile)
+        self.connect_view(tab, browser)
+        tab.set_view(browser)
+
+        # A discarded tab gets its back/forward list and scroll position back
+        if prewarmed is not None:
+            self.update_tab_title(tab, browser.title())
+            self.update_tab_icon(tab, browser.icon())
+        elif tab.restore_history():
+            # Coming back to a page isn't visiting it again
+            tab.visited_url = tab.url.adjusted(QUrl.RemoveFragment)
+            self.restore_scroll_position(browser, tab.scroll_position)
+        else:
+            browser.setUrl(tab.url)
+        return browser
+
+    def connect_view(self, tab, browser):
+        browser.urlChanged.connect(lambda q: self.update_url(tab, q))
+        browser.titleChanged.connect(lambda title: self.update_tab_title(tab, title))
+        browser.iconChanged.connect(lambda icon: self.update_tab_icon(tab, icon))
+        browser.loadFinished.connect(lambda ok: self.page_loaded(tab, ok))
+        # Incognito pages leave no timings or navigations behind, and don't prefetch DNS
+        if not tab.incognito:
+            self.telemetry.watch(browser)
+            self.speculator.watch(browser)
+            browser.page().linkHovered.connect(lambda url: self.speculator.hint([url]) if url else None)
+        self.back_forward.watch(tab, browser)
+        browser.page().link_clicked = lambda q: self.follow_prerendered(tab, q)
+
+    def swap_in_prerendered(self, tab, q):
+        # Show the page loaded ahead for q in the tab instead of navigating, if there is one
+        if tab.incognito or not tab.is_materialized():
+            return False
+        view = self.prerenderer.take(q)
+        if view is None:
+            return False
+        tab.replace_view(view)
+        self.connect_view(tab, view)
+        self.update_url(tab, view.url())
+        self.update_tab_title(tab, view.title())
+        self.update_tab_icon(tab, view.icon())
+        self.page_loaded(tab, True)
+        return True
+
+    def follow_prerendered(self, tab, q):
+        # A link clicked in the page; the old view is still inside its navigation request,
+        # so it is swapped out once that has returned. A prerender of another page is wasted.
+        if tab.incognito:
+            return False
+        if not self.prerenderer.matches(q):
+            self.prerenderer.clear()
+            return False
+        QTimer.singleShot(0, lambda: self.open_prerendered(tab, q))
+        return True
+
+    def open_prerendered(self, tab, q):
+        # The tab may have been closed or discarded before the timer fired
+        try:
+            if tab.is_materialized() and not self.swap_in_prerendered(tab, q):
+                tab.view.setUrl(q)
+        except RuntimeError:
+            pass
+
+    def go_back(self):
+        tab = self.browser_tabs.currentWidget()
+        browser = self.current_browser()
+        if not browser.history().canGoBack() and tab.previous_history is not None:
+            # A prerendered page only knows itself, the pages before it are in the list it replaced
+            tab.history_state, tab.previous_history = tab.previous_history, None
+            tab.restore_history()
+            return
+        self.back_forward.go(tab, browser, -1)
+
+    def go_forward(self):
+        self.back_forward.go(self.browser_tabs.currentWidget(), self.current_browser(), 1)
+
+    def restore_scroll_position(self, browser, position):
+        if position.isNull():
+            return
 
-        i = self.browser_tabs.addTab(browser, label)
-        self.browser_tabs.setCurrentIndex(i)
+        def restore(ok):
+            browser.loadFinished.disconnect(restore)
+            browser.page().runJavaScript(f"window.scrollTo({position.x()}, {position.y()});")
+
+        browser.loadFinished.connect(restore)
+
+    def current_tab_changed(self, i):
+        tab = self.browser_tabs.widget(i)
+        if tab is None:
+            return
+        if not tab.is_materialized():
+            self.materialize_tab(tab)
+        self.url_bar.setText(tab.url.toString())
+        self.update_bookmark_button()
+        self.tab_manager.activated(tab)
+        self.lifecycle.activated(tab)
+        self.session.active_changed(tab)
+        if self.load_overlay.isVisible():
+            self.load_overlay.refresh()
+
+    def current_browser(self):
+        tab = self.browser_tabs.currentWidget()
+        if not tab.is_materialized():
+            self.materialize_tab(tab)
+        return tab.view
+
+    def show_tab_menu(self, position):
+        tab = self.browser_tabs.widget(self.browser_tabs.tabBar().tabAt(position))
+        if tab is None:
+            return
+        menu = QMenu(self)
+        menu.addAction("Unpin Tab" if tab.pinned else "Pin Tab", lambda: self.toggle_pinned(tab))
+        menu.exec_(self.browser_tabs.tabBar().mapToGlobal(position))
+
+    def toggle_pinned(self, tab):
+        # Pinned tabs are never frozen or discarded in the background
+        tab.pinned = not tab.pinned
+        self.browser_tabs.setTabText(self.browser_tabs.indexOf(tab), self.tab_text(tab, tab.title))
+        self.session.tab_changed(tab)
+        self.lifecycle.update()
 
     def close_tab(self, i):
         if self.browser_tabs.count() < 2:
             return
+        tab = self.browser_tabs.widget(i)
         self.browser_tabs.removeTab(i)
+        self.session.tab_closed(tab)
+        tab.dispose()
+        if tab.incognito:
+            self.profiles.release_incognito()
+
+    def open_tab_urls(self):
+        return [(tab.url.toString(), tab.title) for tab in self.tab_manager.tabs()
+                if not tab.incognito and recordable(tab.url)]
+
+    def open_suggestion(self, url):
+        self.url_bar.setText(url)
+        self.navigate_to_url()
 
     def navigate_to_url(self):
         url = self.url_bar.text()
         q = QUrl(url)
         if q.scheme() == "":
             q.setScheme("https")
-        self.browser_tabs.currentWidget().setUrl(q)
-
-    def update_url(self, q):
-        self.url_bar.setText(q.toString())
-
-    def set_custom_color_mode(self, color):
-        custom_style = f"""
-        QMainWindow {{
-            background-color: {color};
-            color: #ffffff;
-        }}
-        QToolBar {{
-            background-color: {color};
-            border: none;
-        }}
-        QLineEdit {{
-            background-color: #555555;
-            color: #ffffff;
-            border: 1px solid #444444;
-        }}
-        QTabWidget::pane {{
-            border: 1px solid #444444;
-        }}
-        QTabBar::tab {{
-            background: #3c3c3c;
-            color: #ffffff;
-        }}
-        QTabBar::tab:selected {{
-            background: #555555;
-        }}
-        QAction {{
-            color: #ffffff;
-        }}
-        QWidget#title_bar {{
-            background-color: {color};
-        }}
-        QLabel {{
-            color: #ffffff;
-        }}
-        QPushButton {{
-            background-color: {color};
-            color: #ffffff;
-            border: none;
-        }}
-        QPushButton:hover {{
-            background-color: #555555;
-        }}
-        """
-        self.setStyleSheet(custom_style)
+        if not self.swap_in_prerendered(self.browser_tabs.currentWidget(), q):
+            self.current_browser().setUrl(q)
+
+    def speculate_typed(self, text, suggestions):
+        # Omnibox listener, after the debounced query: the hosts of what is typed and of the likeliest
+        # suggestions are looked up, and the top suggestion loaded ahead when it is the likely pick
+        if self.browser_tabs.currentWidget().incognito:
+            return
+        if self.speculator.enabled:
+            urls = [url for url, title, score in suggestions[:setting('speculate/suggestions')]]
+            typed = predicted_url(text)
+            if typed is not None:
+                urls.insert(0, typed)
+            self.speculator.hint(urls)
+        self.prerenderer.hint(*prediction(suggestions))
+
+    def page_loaded(self, tab, ok):
+        startup_profile.mark('start_page_loaded')
+        self.session.tab_changed(tab)
+        if ok and not tab.incognito and recordable(tab.url):
+            # One visit per document loaded: redirects, fragment changes and reloads of the
+            # same page don't count again
+            url = tab.url.toString()
+            document = tab.url.adjusted(QUrl.RemoveFragment)
+            if document != tab.visited_url:
+                tab.visited_url = document
+                self.history.add_visit(url, tab.title)
+                points = frecency(1, time.time())
+            else:
+                self.history.set_title(url, tab.title)
+                points = 0
+            self.omnibox_index.add(url, tab.title, points=points)
+
+    def update_url(self, tab, q):
+        tab.url = q
+        self.session.tab_changed(tab)
+        if tab is self.browser_tabs.currentWidget():
+            self.url_bar.setText(q.toString())
+            self.update_bookmark_button()
+
+    def set_theme(self, name):
+        self.theme = self.themes.get(name)
+        self.is_dark_mode = self.theme.dark
+        self.themes.apply(self.theme, self.nav_bar, self.browser_tabs.tabBar(), self.title_bar, self)
+
+    def choose_theme(self, name):
+        # Picked from the menu, so it is also the theme of the other windows and the next start
+        for window in QApplication.instance().windows:
+            window.set_theme(name)
+        QSettings().setValue('appearance/theme', self.theme.name)
 
     def set_dark_mode(self):
-        self.set_custom_color_mode("#2e2e2e")
+        self.choose_theme('Dark')
 
     def set_light_mode(self):
-        light_style = """
-        QMainWindow {
-            background-color: #f0f0f0;
-            color: #000000;
-        }
-        QToolBar {
-            background-color: #e0e0e0;
-            border: none;
-        }
-        QLineEdit {
-            color: #000000;
-            border: 1px solid #cccccc;  
-        }
-        QTabWidget::pane {
-            background: red;
-            border: 1px solid #cccccc;
-        }
-        QTabBar::tab {
-            background: #f0f0f0;
-            color: #000000;
-        }
-        QTabBar::tab:selected {
-            background: #d0d0d0;
-        }
-        QAction {
-            color: #000000;
-        }
-        QWidget#title_bar {
-            background-color: #f0f0f0;
-        }
-        QLabel {
-            color: #000000;
-        }
-        QPushButton {
-            background-color: #f0f0f0;
-            color: #000000;
-            border: none;
-        }
-        QPushButton:hover {
-            background-color: #e0e0e0;
-        }
-        """
-        self.setStyleSheet(light_style)
+        self.choose_theme('light')
 
     def show_help(self):
         pass
 
     def show_history(self):
-        pass
+        self.history_dialog = HistoryDialog(self.history, lambda q: self.add_new_tab(q, 'New Tab'),
+                                            self.favicons.icon_for, self)
+        self.history_dialog.show()
 
     def show_bookmarks(self):
-        pass
+        self.bookmarks_dialog = BookmarksDialog(self.bookmarks, lambda q: self.add_new_tab(q, 'New Tab'),
+                                                self.favicons.icon_for, self)
+        self.bookmarks_dialog.show()
+
+    def toggle_bookmark(self):
+        tab = self.browser_tabs.currentWidget()
+        if tab is None or tab.url.isEmpty():
+            return
+        if self.bookmarks.contains(tab.url.toString()):
+            self.bookmarks.remove(tab.url.toString())
+        else:
+            self.bookmarks.add(tab.url.toString(), tab.title)
+        self.update_bookmark_button()
+
+    def update_bookmark_button(self):
+        # Bookmarks are read after the first paint, until then the star stays empty
+        if not self.bookmarks.loaded:
+            return
+        tab = self.browser_tabs.currentWidget()
+        bookmarked = tab is not None and self.bookmarks.contains(tab.url.toString())
+        self.bookmark_btn.setText("★" if bookmarked else "☆")
 
     def start_incognito_mode(self):
-        pass
+        self.add_new_tab(QUrl(NEW_TAB_URL), 'New Tab', incognito=True)
+
+    def show_tab_stats(self):
+        stats = self.tab_manager.stats()
+        pool = self.view_pool.stats()
+        lifecycle = self.lifecycle.stats()
+        QMessageBox.information(self, "Tab Memory",
+                                f"Live tabs: {stats['live_tabs']} of {stats['total_tabs']}\n"
+                                f"Renderer memory: {stats['memory_usage'] / 1048576:.1f} MB\n"
+                                f"Discarded tabs: {stats['evictions']}\n"
+                                f"Frozen in the background: {lifecycle['frozen']}, "
+                                f"sleeping: {lifecycle['discarded']}\n"
+                                f"Reclaimed: {stats['reclaimed_bytes'] / 1048576:.1f} MB\n"
+                                f"New tab pool: {pool['hits']} hits, {pool['misses']} misses "
+                                f"({pool['ready']} of {pool['size']} ready)")
+
+    def show_task_manager(self):
+        if self.task_manager_dialog is None:
+            self.task_manager_dialog = TaskManagerDialog(self.resource_monitor, self, self)
+        self.task_manager_dialog.show()
+        self.task_manager_dialog.raise_()
+
+    def show_downloads(self):
+        if self.downloads_dialog is None:
+            self.downloads_dialog = DownloadsDialog(QApplication.instance().downloads, self)
+        self.downloads_dialog.show()
+        self.downloads_dialog.raise_()
+
+    def export_load_timings(self, kind):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Page Load Timings", f"cwanda-loads.{kind}",
+                                              f"{kind.upper()} files (*.{kind})")
+        if path:
+            export = self.telemetry.export_json if kind == 'json' else self.telemetry.export_csv
+            export(path)
+
+    def toggle_blocking(self, enabled):
+        QApplication.instance().content_blocker.enabled = enabled
+        QSettings().setValue('blocking/enabled', enabled)
+
+    def show_blocking_stats(self):
+        stats = QApplication.instance().content_blocker.stats()
+        match_us = f"{stats['match_us']:.1f}" if stats['match_us'] is not None else "-"
+        QMessageBox.information(self, "Content Blocking",
+                                f"Filter lists: {data_path('filters')}\n"
+                                f"Rules: {stats['rules']} ({stats['skipped']} not supported)\n"
+                                f"Blocked: {stats['blocked']} of {stats['checked']} requests\n"
+                                f"Average match time: {match_us} µs")
+
+    def toggle_speculation(self, enabled):
+        self.speculator.enabled = enabled
+        QSettings().setValue('speculate/enabled', enabled)
+
+    def show_speculation_stats(self):
+        stats = self.speculator.stats()
+        percent = lambda value: f"{value * 100:.0f}%" if value is not None else "-"
+        QMessageBox.information(self, "DNS Prefetch",
+                                f"Looked up: {stats['lookups']} hosts, {stats['pending']} still waiting\n"
+                                f"Used: {stats['hits']} ({percent(stats['hit_rate'])}), "
+                                f"expired unused: {stats['wasted']}\n"
+                                f"Skipped at the limit: {stats['limited']}\n"
+                                f"Navigations to a host looked up ahead: {percent(stats['coverage'])}\n"
+                                f"First byte p50: {ms(stats['prefetched_response_start_p50'])} ms prefetched, "
+                                f"{ms(stats['cold_response_start_p50'])} ms not")
+
+    def toggle_prerender(self, enabled):
+        self.prerenderer.enabled = enabled
+        QSettings().setValue('prerender/enabled', enabled)
+        if not enabled:
+            self.prerenderer.clear()
+
+    def show_prerender_stats(self):
+        stats = self.prerenderer.stats()
+        hit_rate = f"{stats['hit_rate'] * 100:.0f}%" if stats['hit_rate'] is not None else "-"
+        load = f"{stats['load_p50_s'] * 1000:.0f}" if stats['load_p50_s'] is not None else "-"
+        QMessageBox.information(self, "Prerender",
+                                f"Loaded ahead: {stats['started']} pages, load p50 {load} ms\n"
+                                f"Used: {stats['hits']} ({hit_rate}), wasted: {stats['wasted']} "
+                                f"({stats['over_memory']} over the memory limit)\n"
+                                f"Now: {stats['current'] or '-'} "
+                                f"({stats['memory_usage'] / 1048576:.1f} MB)")
+
+    def toggle_back_forward(self, enabled):
+        self.back_forward.enabled = enabled
+        QSettings().setValue('backforward/enabled', enabled)
+
+    def show_back_forward_stats(self):
+        tabs = [tab for window in QApplication.instance().windows for tab in window.tab_manager.tabs()]
+        stats = self.back_forward.stats(tabs)
+        hit_rate = f"{stats['hit_rate'] * 100:.0f}%" if stats['hit_rate'] is not None else "-"
+        QMessageBox.information(self, "Back/Forward",
+                                f"Snapshots: {stats['snapshots']} "
+                                f"({stats['memory_usage'] / 1048576:.1f} MB), {stats['evictions']} dropped\n"
+                                f"Shown on back/forward: {stats['hits']} of {stats['hits'] + stats['misses']} "
+                                f"({hit_rate}), in {ms(stats['placeholder_p50_ms'])} ms\n"
+                                f"Page restored p50: {ms(stats['restore_hit_p50_ms'])} ms with a snapshot, "
+                                f"{ms(stats['restore_miss_p50_ms'])} ms without")
+
+    def show_cache_stats(self):
+        stats = self.profiles.cache_stats()
+        QMessageBox.information(self, "Cache",
+                                f"Location: {stats['path']}\n"
+                                f"Used: {stats['used_bytes'] / 1048576:.1f} MB in {stats['files']} files\n"
+                                f"Limit: {stats['max_bytes'] / 1048576:.0f} MB")
+
+    def clear_cache(self):
+        self.profiles.clear_cache()
 
     def toggle_maximize_restore(self):
         if self.isMaximized():
@@ -284,6 +682,50 @@ class Browser(QMainWindow):
         else:
             self.showMaximized()
 
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), self.theme.window_color)
+        painter.end()
+        super().paintEvent(event)
+        if not self.startup_finished:
+            self.startup_finished = True
+            startup_profile.mark('first_paint')
+            QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        # What the window doesn't need to be seen, done once it has been
+        self.create_settings_menu()
+        QApplication.instance().finish_startup()
+        self.update_bookmark_button()
+        startup_profile.mark('deferred_done')
+
+    def moveEvent(self, event):
+        self.session.geometry_changed(bytes(self.saveGeometry()))
+        super().moveEvent(event)
+
+    def resizeEvent(self, event):
+        self.session.geometry_changed(bytes(self.saveGeometry()))
+        super().resizeEvent(event)
+        if self.load_overlay.isVisible():
+            self.load_overlay.place()
+
+    def closeEvent(self, event):
+        self.session.geometry_changed(bytes(self.saveGeometry()))
+        self.session.close()
+        self.resource_monitor.stop()
+        self.lifecycle.timer.stop()
+        self.load_overlay.detach()
+        if self.downloads_dialog is not None:
+            self.downloads_dialog.detach()
+        # Other windows keep running, so this window's views have to go with it
+        self.browser_tabs.blockSignals(True)
+        for tab in self.tab_manager.tabs():
+            tab.dispose()
+            if tab.incognito:
+                self.profiles.release_incognito()
+        QApplication.instance().windows.remove(self)
+        super().closeEvent(event)
+
     def mousePressEvent(self, event: QMouseEvent):
         if event.button() == Qt.LeftButton:
             self.drag_pos = event.globalPos()
@@ -297,20 +739,227 @@ class Browser(QMainWindow):
             self.drag_pos = event.globalPos()
         super().mouseMoveEvent(event)
 
-    def update_tab_title(self, browser, title):
-        index = self.browser_tabs.indexOf(browser)
-        if index != - -1:
-            self.browser_tabs.setTabText(index, title)
-
-    def update_tab_icon(self, browser, icon):
-        index = self.browser_tabs.indexOf(browser)
+    def tab_text(self, tab, title):
+        if tab.pinned:
+            title = "\U0001F4CC " + title
+        return "Incognito - " + title if tab.incognito else title
+
+    def update_tab_title(self, tab, title):
+        tab.title = title
+        self.session.tab_changed(tab)
+        if not tab.incognito and recordable(tab.url):
+            self.history.set_title(tab.url.toString(), title)
+        index = self.browser_tabs.indexOf(tab)
+        if index != -1:
+            self.browser_tabs.setTabText(index, self.tab_text(tab, title))
+
+    def update_tab_icon(self, tab, icon):
+        # Pages report an empty icon while navigating, show the cached one for the new url meanwhile
+        if icon.isNull():
+            icon = self.favicons.icon_for(tab.url)
+        elif not tab.incognito:
+            icon = self.favicons.store(tab.url, icon)
+        tab.icon = icon
+        index = self.browser_tabs.indexOf(tab)
         if index != -1:
             self.browser_tabs.setTabIcon(index, icon)
 
 
+class CwandaApplication(QApplication):
+    # Owns what every browser window shares
+    def __init__(self, argv):
+        register_scheme()
+        super().__init__(argv)
+        startup_profile.mark('qapplication')
+        self.setOrganizationName("Cwanda")
+        self.setApplicationName("Cwanda")
+        self.setStyle("Fusion")
+
+        # Themes are compiled once and shared by all windows
+        self.themes = ThemeEngine()
+
+        # The start page is preloaded into memory once and served as cwanda://newtab/
+        self.newtab_handler = NewTabSchemeHandler(self)
+
+        self.profiles = ProfileManager(self.newtab_handler,
+                                       storage_path=data_path('profile'),
+                                       cache_path=setting('cache/path') or data_path('cache'),
+                                       cache_size_mb=setting('cache/size_mb'),
+                                       parent=self)
+        startup_profile.mark('webengine')
+
+        # Visits are written by a background thread, closing waits for the last batch
+        self.history = HistoryStore(os.path.join(data_path('history'), 'history.db'))
+        self.aboutToQuit.connect(self.history.close)
+
+        # The url bar index is built from history in the background once the first window
+        # is up, visits made before it is ready are queued and applied once it is
+        self.omnibox_index = FrecencyIndex()
+        self.startup_finished = False
+
+        # Read on first use; the start page fetches its tiles from it
+        self.bookmarks = BookmarkStore(data_path('bookmarks'), on_change=self.bookmark_changed)
+        self.newtab_handler.routes['/bookmarks.json'] = lambda url: (b'application/json', self.bookmarks.tiles_json())
+
+        # Icons by origin, remembered across runs so restored tabs and tiles have them at once
+        self.favicons = FaviconCache(data_path('favicons'), memory_size=setting('favicons/memory_icons'))
+        self.aboutToQuit.connect(self.favicons.close)
+        self.newtab_handler.routes['/favicon'] = self.tile_icon
+        startup_profile.mark('stores')
+
+        # Views with the start page already loaded, used by new tabs in any window. Filling
+        # it starts after the first paint so it doesn't compete with the first tab's page.
+        self.view_pool = ViewPool(self.create_view, NEW_TAB_URL, size=setting('pool/size'))
+        self.aboutToQuit.connect(self.view_pool.clear)
+
+        # Timings of every tab's page loads, from all windows
+        self.telemetry = PageLoadTelemetry(keep=setting('telemetry/records'))
+
+        # Downloads from every window, written to disk by a background thread
+        self.downloads = DownloadManager(self.profiles.profile,
+                                         setting('downloads/directory') or QStandardPaths.writableLocation(
+                                             QStandardPaths.DownloadLocation),
+                                         max_active=setting('downloads/max_active'),
+                                         segments=setting('downloads/segments'),
+                                         min_segment_bytes=setting('downloads/segment_min_mb') * 1024 * 1024)
+        self.downloads.on_added = self.download_added
+        self.profiles.download_requested = self.downloads.requested
+        self.aboutToQuit.connect(self.downloads.close)
+
+        # Ads and trackers are blocked for every tab once the filter lists have been loaded,
+        # which happens in the background after the first paint
+        self.content_blocker = ContentBlocker(enabled=setting('blocking/enabled'), parent=self)
+        self.profiles.set_interceptor(self.content_blocker)
+        self.content_blocker.listeners.append(self.downloads.request_seen)
+
+        # Connections opened ahead of navigations in any window, with how often they were used
+        self.speculator = Speculator(self.create_view, max_hosts=setting('speculate/max_hosts'),
+                                     ttl_s=setting('speculate/ttl_s'), debounce_ms=setting('speculate/debounce_ms'),
+                                     enabled=setting('speculate/enabled'))
+        self.telemetry.listeners.append(self.speculator.record)
+        self.aboutToQuit.connect(self.speculator.clear)
+
+        # The one page loaded ahead, taken by the tab of any window that navigates there
+        self.prerenderer = Prerenderer(self.create_view, max_mb=setting('prerender/max_mb'),
+                                       ttl_s=setting('prerender/ttl_s'),
+                                       min_confidence=setting('prerender/min_confidence'),
+                                       debounce_ms=setting('prerender/debounce_ms'),
+                                       enabled=setting('prerender/enabled'))
+        self.aboutToQuit.connect(self.prerenderer.clear)
+
+        # Snapshots kept on each tab, and how often going back or forward found one
+        self.back_forward = BackForwardCache(entries=setting('backforward/entries'),
+                                             max_mb=setting('backforward/max_mb'),
+                                             scale=setting('backforward/scale'),
+                                             enabled=setting('backforward/enabled'))
+
+        self.windows = []
+        self.instance_server = None
+        self.session_store = None
+
+    def create_view(self, profile=None):
+        view = QWebEngineView()
+        view.setPage(TabPage(profile if profile is not None else self.profiles.profile, view))
+        return view
+
+    def session(self):
+        # Opened with the first window that saves its tabs, so headless runs never touch it
+        if self.session_store is None:
+            self.session_store = SessionStore(data_path('session'))
+            self.aboutToQuit.connect(self.session_store.close)
+        return self.session_store
+
+    def open_window(self, urls=(), session=None):
+        # Every window records its tabs in the same session
+        if session is None:
+            session = self.session().window()
+        window = Browser(session, urls)
+        window.setAttribute(Qt.WA_DeleteOnClose)
+        if len(self.windows) > 1 and not session.geometry:
+            window.move(self.windows[-2].pos() + QPoint(30, 30))
+        window.show()
+        window.raise_()
+        window.activateWindow()
+        return window
+
+    def restore_windows(self, urls=()):
+        # A window for each one of the last run, the launch urls open in the first
+        saved = self.session().saved_windows()
+        if not saved:
+            return self.open_window(urls)
+        windows = [self.open_window(urls if n == 0 else (), self.session().window(window_id))
+                   for n, window_id in enumerate(saved)]
+        return windows[0]
+
+    def download_added(self, download):
+        # Shown in the window the download was started from
+        window = self.activeWindow()
+        if window not in self.windows and self.windows:
+            window = self.windows[-1]
+        if window is not None:
+            window.show_downloads()
+
+    def listen(self, name):
+        # Later launches hand their urls over instead of starting another browser
+        self.instance_server = InstanceServer(name, self.open_window, self)
+        self.aboutToQuit.connect(self.instance_server.close)
+
+    def finish_startup(self):
+        if self.startup_finished:
+            return
+        self.startup_finished = True
+        loader = threading.Thread(target=lambda: self.omnibox_index.load(
+            self.history.top_urls(setting('omnibox/max_entries'))), name="omnibox-loader", daemon=True)
+        loader.start()
+        self.load_filters()
+        self.bookmarks.load()
+        self.view_pool.start()
+
+    def load_filters(self):
+        def load():
+            self.content_blocker.engine = load_filter_lists(filter_lists(data_path('filters')),
+                                                            data_path('filters', 'compiled'))
+        threading.Thread(target=load, name="filter-loader", daemon=True).start()
+
+    def tile_icon(self, url):
+        data = self.favicons.png_for(QUrlQuery(url).queryItemValue('url', QUrl.FullyDecoded))
+        return (b'image/png', data) if data is not None else None
+
+    def bookmark_changed(self, kind, url):
+        if kind == 'add':
+            self.omnibox_index.add(url, points=BOOKMARK_BONUS)
+        else:
+            self.omnibox_index.remove_points(url, BOOKMARK_BONUS)
+
+
+def run_headless(channel):
+    # A window on the offscreen platform, driven by JSON-line commands (see automation.py).
+    # It works on the throwaway test data directory and doesn't restore or save a session,
+    # so every run starts from the same state and the user's profile is never touched.
+    os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+    QStandardPaths.setTestModeEnabled(True)
+    app = CwandaApplication(sys.argv)
+    window = app.open_window(session=TransientSession())
+    automation = Automation(window)
+    app.automation_channel = StdinChannel(automation) if channel == '-' else SocketChannel(automation, channel)
+    return app.exec_()
+
+
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    app.setStyle("Fusion")
-    window = Browser()
-    window.show()
+    startup_profile.output = profile_output(sys.argv)
+    if headless_option(sys.argv) is not None:
+        sys.exit(run_headless(headless_option(sys.argv)))
+
+    # With Cwanda already running, its process opens the window: no second QtWebEngine,
+    # profile or set of stores
+    QApplication.setOrganizationName("Cwanda")
+    QApplication.setApplicationName("Cwanda")
+    name = instance_name(data_path())
+    if forward_urls(name, launch_urls(sys.argv)):
+        sys.exit(0)
+
+    app = CwandaApplication(sys.argv)
+    app.listen(name)
+    window = app.restore_windows(launch_urls(sys.argv))
+    startup_profile.mark('window_shown')
     sys.exit(app.exec_())
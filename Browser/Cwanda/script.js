@@ -5,3 +5,67 @@ document.getElementById('searchForm').addEventListener('submit', function(e) {
     var url = 'https://www.google.com/search?q=' + encodeURIComponent(query);
     window.location.href = url;
 });
+
+// Bookmark tiles come from the browser's bookmark store. A prewarmed new tab is loaded
+// before it is shown, so the tiles are fetched again whenever the page becomes visible.
+// XMLHttpRequest rather than fetch, which Qt 5 does not allow on custom schemes.
+function loadTiles() {
+    var request = new XMLHttpRequest();
+    request.open('GET', 'bookmarks.json');
+    request.onload = function() {
+        // Pages from the browser's own scheme may come without a status, anything else has to be a 2xx.
+        // On an error or a broken list the tiles that are already there stay.
+        if (request.status && (request.status < 200 || request.status >= 300)) {
+            return;
+        }
+        var bookmarks;
+        try {
+            bookmarks = JSON.parse(request.responseText);
+        } catch (error) {
+            return;
+        }
+        if (!Array.isArray(bookmarks)) {
+            return;
+        }
+        var container = document.getElementById('bookmarked');
+        var add = document.getElementById('addBookmark');
+        container.querySelectorAll('.bookmark-tile').forEach(function(tile) {
+            tile.remove();
+        });
+        bookmarks.forEach(function(bookmark) {
+            if (!bookmark || typeof bookmark.url !== 'string') {
+                return;
+            }
+            var tile = document.createElement('div');
+            tile.className = 'web bookmark-tile';
+            tile.title = bookmark.url;
+            tile.onclick = function() {
+                window.location = bookmark.url;
+            };
+            var icon = document.createElement('span');
+            icon.className = 'web-icon';
+            icon.textContent = (bookmark.title || bookmark.url.replace(/^\w+:\/\/(www\.)?/, '')).charAt(0).toUpperCase();
+            // The site's icon from the favicon cache replaces the letter once it loads
+            var image = new Image(30, 30);
+            image.onload = function() {
+                icon.textContent = '';
+                icon.appendChild(image);
+            };
+            image.src = 'favicon?url=' + encodeURIComponent(bookmark.url);
+            var name = document.createElement('h3');
+            name.className = 'web-name';
+            name.textContent = bookmark.title || bookmark.url;
+            tile.appendChild(icon);
+            tile.appendChild(name);
+            container.insertBefore(tile, add);
+        });
+    };
+    request.send();
+}
+
+loadTiles();
+document.addEventListener('visibilitychange', function() {
+    if (!document.hidden) {
+        loadTiles();
+    }
+});
@@ -0,0 +1,347 @@
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from PyQt5.QtCore import QSocketNotifier, QTimer, QUrl
+from PyQt5.QtNetwork import QLocalServer
+from PyQt5.QtWidgets import QApplication
+
+from telemetry import NAVIGATION_TIMING_JS
+
+
+READY_JS = "document.readyState === 'complete' && location.href"
+
+# Used by wait, js and timings when the command has no timeout_ms
+DEFAULT_TIMEOUT_MS = 30000
+
+# The fields each command takes: their type and whether they are required
+FIELDS = {
+    'open': {'url': (str, False)},
+    'navigate': {'tab': (int, True), 'url': (str, True)},
+    'wait': {'tab': (int, True), 'timeout_ms': (int, False)},
+    'js': {'tab': (int, True), 'script': (str, True), 'timeout_ms': (int, False)},
+    'timings': {'tab': (int, True), 'timeout_ms': (int, False)},
+    'tabs': {},
+    'close': {'tab': (int, True)},
+    'quit': {},
+}
+
+
+def headless_option(argv):
+    # --headless reads commands from stdin, --headless=name listens on a local socket
+    for arg in argv:
+        if arg == '--headless':
+            return '-'
+        if arg.startswith('--headless='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+class AutomationError(Exception):
+    pass
+
+
+def check_fields(message):
+    # Done before a command runs: a missing or mistyped field raised inside a Qt slot would abort the browser
+    for name, (kind, required) in FIELDS[message['cmd']].items():
+        if name not in message:
+            if required:
+                raise AutomationError(f"{message['cmd']} needs \"{name}\"")
+            continue
+        value = message[name]
+        # JSON true and false come back as bools, which are ints to Python
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise AutomationError(f"\"{name}\" has to be a {'string' if kind is str else 'number'}")
+        if name == 'timeout_ms' and not 0 <= value <= 2 ** 31 - 1:
+            raise AutomationError("\"timeout_ms\" is out of range")
+
+
+class TabLoad:
+    # The navigation an automated tab is on and who is waiting for it to finish
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.load_ms = None
+        self.ok = None
+        self.waiters = []
+        # The tab had been discarded and is loading again only because a command needed it
+        self.revived = False
+
+
+class Automation:
+    # Drives a browser window from JSON lines, one command per line, each answered with one
+    # line carrying the same "id":
+    #   {"id": 1, "cmd": "open", "url": "http://127.0.0.1:8000/"}   -> {"id": 1, "tab": 1}
+    #   {"id": 2, "cmd": "wait", "tab": 1, "timeout_ms": 10000}     -> {"id": 2, "ok": true, "load_ms": 42.1}
+    #   {"id": 3, "cmd": "js", "tab": 1, "script": "document.title"} -> {"id": 3, "value": "..."}
+    # Other commands: navigate (tab, url), timings (tab), tabs, close (tab) and quit. wait, js
+    # and timings take a timeout_ms. Failures, malformed commands included, are answered with
+    # {"id": ..., "ok": false, "error": "..."}. A connection's commands run one after the
+    # other, so "open" then "wait" waits for the page that was opened.
+    def __init__(self, window):
+        self.window = window
+        self.tabs = {}
+        self.loads = {}
+        self.connected = set()
+        self.timers = set()
+        self.next_tab = 1
+        self.commands = {
+            'open': self.open,
+            'navigate': self.navigate,
+            'wait': self.wait,
+            'js': self.js,
+            'timings': self.timings,
+            'tabs': self.list_tabs,
+            'close': self.close,
+            'quit': self.quit,
+        }
+
+    def handle(self, line, reply):
+        # reply is called with the answer, right away or once the page got there
+        try:
+            message = json.loads(line)
+            command = self.commands[message['cmd']]
+        except (ValueError, KeyError, TypeError):
+            reply({'id': None, 'ok': False, 'error': f"not a command: {line.strip()[:200]}"})
+            return
+        answer = lambda result: reply(dict(result, id=message.get('id')))
+        try:
+            check_fields(message)
+            command(message, answer)
+        except AutomationError as error:
+            answer({'ok': False, 'error': str(error)})
+
+    def answer_once(self, message, answer, error):
+        # For answers that come from a page's callback, which may never run (a hung page, a
+        # view that went away): after timeout_ms the command is answered with error instead
+        timer = QTimer()
+        timer.setSingleShot(True)
+        self.timers.add(timer)
+
+        def settle(result):
+            if timer in self.timers:
+                self.timers.discard(timer)
+                timer.stop()
+                answer(result)
+
+        timer.timeout.connect(lambda: settle({'ok': False, 'error': error}))
+        timer.start(message.get('timeout_ms', DEFAULT_TIMEOUT_MS))
+        return settle
+
+    def tab(self, message):
+        tab = self.tabs.get(message.get('tab'))
+        if tab is None:
+            raise AutomationError(f"no tab {message.get('tab')}")
+        # Discarded tabs get their view back by being shown, which loads the page again
+        if not tab.is_materialized():
+            self.window.browser_tabs.setCurrentWidget(tab)
+            self.watch(tab)
+            self.loads[tab].revived = True
+        return tab
+
+    def when_revived(self, tab, action):
+        # Scripts meant for the page, not for the blank view it is reloading into
+        load = self.loads.get(tab)
+        if load is not None and load.revived and load.load_ms is None:
+            load.waiters.append(action)
+        else:
+            action()
+
+    def watch(self, tab):
+        # A new load for the tab, the view's loadFinished ends it
+        self.loads[tab] = TabLoad()
+        if tab.view not in self.connected:
+            self.connected.add(tab.view)
+            tab.view.loadFinished.connect(lambda ok, tab=tab: self.load_finished(tab, ok))
+            tab.view.destroyed.connect(lambda view=tab.view: self.connected.discard(view))
+
+    def load_finished(self, tab, ok):
+        load = self.loads.get(tab)
+        if load is None or load.load_ms is not None:
+            return
+        load.load_ms = round((time.perf_counter() - load.started) * 1000, 1)
+        load.ok = ok
+        for waiter in load.waiters:
+            waiter()
+        load.waiters = []
+
+    def open(self, message, answer):
+        tab = self.window.add_new_tab(QUrl(message.get('url', 'about:blank')), message.get('url', ''))
+        tab_id = self.next_tab
+        self.next_tab += 1
+        self.tabs[tab_id] = tab
+        self.watch(tab)
+        # A start page from the view pool is loaded already and won't report it again
+        tab.view.page().runJavaScript(READY_JS, lambda href, tab=tab: self.probed(tab, href))
+        answer({'tab': tab_id})
+
+    def probed(self, tab, href):
+        if href and QUrl(href) == tab.view.url():
+            self.load_finished(tab, True)
+
+    def navigate(self, message, answer):
+        tab = self.tab(message)
+        self.watch(tab)
+        tab.view.setUrl(QUrl(message['url']))
+        answer({'tab': message['tab']})
+
+    def wait(self, message, answer):
+        tab = self.tab(message)
+        load = self.loads.get(tab)
+        if load is None:
+            raise AutomationError("nothing is loading in this tab")
+
+        timer = QTimer()
+        timer.setSingleShot(True)
+
+        def finished():
+            timer.stop()
+            answer({'ok': load.ok, 'load_ms': load.load_ms})
+
+        def expired():
+            if finished in load.waiters:
+                load.waiters.remove(finished)
+                answer({'ok': False, 'error': "timed out waiting for loadFinished"})
+
+        if load.load_ms is not None:
+            finished()
+            return
+        load.waiters.append(finished)
+        timer.timeout.connect(expired)
+        timer.start(message.get('timeout_ms', DEFAULT_TIMEOUT_MS))
+        # Kept alive by the closures until it fires or is stopped
+        finished.timer = timer
+
+    def js(self, message, answer):
+        tab = self.tab(message)
+        settle = self.answer_once(message, answer, "timed out waiting for the script")
+        self.when_revived(tab, lambda: tab.view.page().runJavaScript(
+            message['script'], lambda value: settle({'value': value})))
+
+    def timings(self, message, answer):
+        tab = self.tab(message)
+        settle = self.answer_once(message, answer, "timed out waiting for the timings")
+
+        def measure():
+            load = self.loads.get(tab)
+            load_ms = load.load_ms if load is not None else None
+            tab.view.page().runJavaScript(NAVIGATION_TIMING_JS, lambda value: settle({'load_ms': load_ms, 'navigation': value}))
+
+        self.when_revived(tab, measure)
+
+    def list_tabs(self, message, answer):
+        answer({'tabs': [{'tab': tab_id, 'url': tab.url.toString(), 'title': tab.title}
+                         for tab_id, tab in self.tabs.items()]})
+
+    def close(self, message, answer):
+        tab = self.tabs.get(message.get('tab'))
+        if tab is None:
+            raise AutomationError(f"no tab {message.get('tab')}")
+        if self.window.browser_tabs.count() < 2:
+            raise AutomationError("the last tab of the window can't be closed")
+        del self.tabs[message['tab']]
+        self.loads.pop(tab, None)
+        self.window.close_tab(self.window.browser_tabs.indexOf(tab))
+        answer({})
+
+    def quit(self, message, answer):
+        answer({})
+        QTimer.singleShot(0, QApplication.instance().quit)
+
+
+class Client:
+    # One connection's commands, each started once the previous one has been answered
+    def __init__(self, automation, write):
+        self.automation = automation
+        self.write = write
+        self.queue = deque()
+        self.busy = False
+        self.on_done = None
+
+    def push(self, line):
+        self.queue.append(line)
+        self.next()
+
+    def done(self, on_done):
+        # Nothing more is coming, on_done runs once what is queued has been answered
+        self.on_done = on_done
+        self.next()
+
+    def next(self):
+        if self.busy:
+            return
+        if not self.queue:
+            if self.on_done is not None:
+                self.on_done()
+                self.on_done = None
+            return
+        self.busy = True
+        self.automation.handle(self.queue.popleft(), self.answered)
+
+    def answered(self, answer):
+        self.write(answer)
+        self.busy = False
+        # From the event loop, a long script of instant answers would otherwise recurse
+        QTimer.singleShot(0, self.next)
+
+
+class StdinChannel:
+    # Commands on stdin, answers on stdout. Read from the event loop, no thread needed.
+    # The end of stdin quits the browser once the commands before it are done.
+    def __init__(self, automation):
+        self.client = Client(automation, self.write)
+        self.buffer = b''
+        self.notifier = QSocketNotifier(sys.stdin.fileno(), QSocketNotifier.Read)
+        self.notifier.activated.connect(self.read)
+
+    def read(self):
+        data = os.read(sys.stdin.fileno(), 65536)
+        if not data:
+            self.notifier.setEnabled(False)
+            self.client.done(QApplication.instance().quit)
+            return
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                self.client.push(line.decode())
+
+    def write(self, answer):
+        sys.stdout.write(json.dumps(answer) + '\n')
+        sys.stdout.flush()
+
+
+class SocketChannel:
+    # Commands from any number of clients on a local socket, each answered on its own
+    # connection
+    def __init__(self, automation, name):
+        self.automation = automation
+        self.server = QLocalServer()
+        QLocalServer.removeServer(name)
+        if not self.server.listen(name):
+            raise AutomationError(f"can't listen on {name}: {self.server.errorString()}")
+        self.server.newConnection.connect(self.accept)
+
+    def accept(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            client = Client(self.automation, lambda answer, socket=socket: self.write(socket, answer))
+            socket.readyRead.connect(lambda socket=socket, client=client: self.read(socket, client))
+            socket.disconnected.connect(socket.deleteLater)
+            self.read(socket, client)
+
+    def read(self, socket, client):
+        while socket.canReadLine():
+            line = bytes(socket.readLine()).decode()
+            if line.strip():
+                client.push(line)
+
+    def write(self, socket, answer):
+        # The client may have gone while its page was loading
+        try:
+            if socket.state() == socket.ConnectedState:
+                socket.write(json.dumps(answer).encode() + b'\n')
+                socket.flush()
+        except RuntimeError:
+            pass
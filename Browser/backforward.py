@@ -0,0 +1,160 @@
+import time
+from collections import deque
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QLabel
+
+from telemetry import percentile
+
+
+# Puts the scroll position back if the engine's own restore left the page at the top
+RESTORE_SCROLL_JS = "if (!window.scrollX && !window.scrollY) window.scrollTo(%s, %s);"
+
+# A back/forward step is given up on after this long if the page never finishes loading,
+# its snapshot taken down and its handler disconnected
+PLACEHOLDER_TIMEOUT_MS = 5000
+
+
+def snapshot_bytes(pixmap):
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class BackForwardCache:
+    # Snapshots of the pages a tab navigated away from, by back/forward list entry, so going
+    # back or forward to one shows its picture at once while the engine restores the page
+    # underneath. A snapshot is the view grabbed when a navigation starts (the old page is
+    # still on screen then), scaled by `scale`, and its scroll position. Each tab keeps at
+    # most `entries` of them within max_mb, least recently taken go first; they live on the
+    # tab and go with its view when it is discarded or closed.
+    def __init__(self, entries=8, max_mb=16, scale=0.5, enabled=True):
+        self.entries = entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.scale = scale
+        self.enabled = enabled
+        self.captures = 0
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        # ms from back/forward to the page having loaded, with a snapshot shown meanwhile and without
+        self.restore_ms = {True: deque(maxlen=500), False: deque(maxlen=500)}
+        # ms from back/forward to the snapshot being on screen
+        self.placeholder_ms = deque(maxlen=500)
+        # view: (loadFinished handler, snapshot label or None) of its step in progress
+        self.pending = {}
+
+    def watch(self, tab, view):
+        view.loadStarted.connect(lambda: self.capture(tab, view))
+
+    def capture(self, tab, view):
+        # A hidden view has nothing on screen to grab
+        if not self.enabled or tab.view is not view or not view.isVisible():
+            return
+        history = view.history()
+        item = history.currentItem()
+        if not item.isValid() or item.url().isEmpty():
+            return
+        pixmap = view.grab()
+        if pixmap.isNull():
+            return
+        if self.scale != 1:
+            pixmap = pixmap.scaled(pixmap.size() * self.scale, Qt.IgnoreAspectRatio, Qt.FastTransformation)
+        key = (history.currentItemIndex(), item.url().toString())
+        tab.snapshots.pop(key, None)
+        tab.snapshots[key] = {'pixmap': pixmap, 'scroll': view.page().scrollPosition(),
+                              'bytes': snapshot_bytes(pixmap)}
+        self.captures += 1
+        self.trim(tab.snapshots)
+
+    def trim(self, snapshots):
+        used = sum(snapshot['bytes'] for snapshot in snapshots.values())
+        while snapshots and (len(snapshots) > self.entries or used > self.max_bytes):
+            key, snapshot = snapshots.popitem(last=False)
+            used -= snapshot['bytes']
+            self.evictions += 1
+
+    def go(self, tab, view, offset):
+        # Back (-1) or forward (1) in the view's history, behind the snapshot of where it goes
+        if not self.enabled:
+            (view.back if offset < 0 else view.forward)()
+            return
+        history = view.history()
+        index = history.currentItemIndex() + offset
+        if not 0 <= index < history.count():
+            return
+        item = history.itemAt(index)
+        # A step still waiting for its page is superseded by this one
+        self.settle(view)
+        snapshot = tab.snapshots.get((index, item.url().toString()))
+        start = time.perf_counter()
+        placeholder = self.show_placeholder(tab, snapshot) if snapshot is not None else None
+        if placeholder is not None:
+            self.placeholder_ms.append((time.perf_counter() - start) * 1000)
+        hit = placeholder is not None
+        self.hits += hit
+        self.misses += not hit
+
+        def finished(ok):
+            self.settle(view)
+            if ok:
+                self.restore_ms[hit].append((time.perf_counter() - start) * 1000)
+            if hit and ok and not snapshot['scroll'].isNull():
+                scroll = snapshot['scroll']
+                view.page().runJavaScript(RESTORE_SCROLL_JS % (scroll.x(), scroll.y()))
+
+        view.loadFinished.connect(finished)
+        self.pending[view] = (finished, placeholder)
+        QTimer.singleShot(PLACEHOLDER_TIMEOUT_MS, lambda: self.settle(view, finished))
+        history.goToItem(item)
+
+    def settle(self, view, handler=None):
+        # Ends the step in progress on the view, if it is still the one `handler` belongs to:
+        # its handler is disconnected and its snapshot taken down
+        pending = self.pending.get(view)
+        if pending is None or (handler is not None and pending[0] is not handler):
+            return
+        del self.pending[view]
+        finished, placeholder = pending
+        try:
+            view.loadFinished.disconnect(finished)
+        except (TypeError, RuntimeError):
+            # Disconnected already, with the rest when the view was disposed
+            pass
+        if placeholder is not None:
+            self.remove_placeholder(placeholder)
+
+    def show_placeholder(self, tab, snapshot):
+        # Over the whole tab, and the mouse goes through it to the page coming up underneath
+        label = QLabel(tab)
+        label.setAttribute(Qt.WA_TransparentForMouseEvents)
+        label.setScaledContents(True)
+        label.setPixmap(snapshot['pixmap'])
+        label.setGeometry(tab.rect())
+        label.show()
+        label.raise_()
+        return label
+
+    def remove_placeholder(self, label):
+        try:
+            label.hide()
+            label.deleteLater()
+        except RuntimeError:
+            # Already gone with its tab
+            pass
+
+    def stats(self, tabs):
+        hit = sorted(self.restore_ms[True])
+        miss = sorted(self.restore_ms[False])
+        shown = sorted(self.placeholder_ms)
+        return {
+            'enabled': self.enabled,
+            'captures': self.captures,
+            'evictions': self.evictions,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses else None,
+            'snapshots': sum(len(tab.snapshots) for tab in tabs),
+            'memory_usage': sum(snapshot['bytes'] for tab in tabs for snapshot in tab.snapshots.values()),
+            'placeholder_p50_ms': percentile(shown, 50),
+            'restore_hit_p50_ms': percentile(hit, 50),
+            'restore_miss_p50_ms': percentile(miss, 50),
+        }
@@ -0,0 +1,1817 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from PyQt5.QtCore import Qt, QPoint, QUrl, QEventLoop, QTimer, QStandardPaths, QT_VERSION_STR, PYQT_VERSION_STR
+from PyQt5.QtGui import QColor, QIcon, QPixmap
+from PyQt5.QtNetwork import QLocalSocket, QNetworkCookie
+from PyQt5.QtTest import QTest
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineView
+
+from Cwanda import Browser, CwandaApplication
+from config import setting
+from contentblock import FilterEngine, load_filter_lists
+from newtab import NEW_TAB_URL
+from tabs import LazyTab
+from procstat import cpu_seconds, rss_bytes
+from bookmarks import BookmarkStore
+from favicons import FaviconCache, encode_png
+from history import HistoryStore
+from instance import instance_name
+from omnibox import DAY, FrecencyIndex
+from session import SessionStore
+from telemetry import PAINT_RETRY_MS, PageLoadTelemetry
+
+
+def wait(ms):
+    # Run the event loop for a while so deleteLater() and page loads get processed
+    loop = QEventLoop()
+    QTimer.singleShot(ms, loop.quit)
+    loop.exec_()
+
+
+def run_js(view, script, timeout=5000):
+    # Synchronous wrapper around runJavaScript for use in scenarios
+    result = []
+    loop = QEventLoop()
+    view.page().runJavaScript(script, lambda value: (result.append(value), loop.quit()))
+    QTimer.singleShot(timeout, loop.quit)
+    loop.exec_()
+    return result[0] if result else None
+
+
+READY_JS = "document.readyState === 'complete' && location.href"
+
+FIRST_PAINT_JS = """(() => {
+    const paint = performance.getEntriesByName('first-contentful-paint')[0];
+    return paint ? performance.timeOrigin + paint.startTime : null;
+})()"""
+
+
+def wait_until_loaded(view, url, timeout=10):
+    # Poll the document, this also works for views that finished loading before we looked
+    start = time.time()
+    while run_js(view, READY_JS) != url and time.time() - start < timeout:
+        wait(1)
+
+
+def download_body(size):
+    # The same pseudo random bytes for a size every time, so downloads can be checked
+    return random.Random(size).randbytes(size)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Answers every path with a small cacheable page, standing in for real sites
+    favicon = b''
+    # Pages under /slow/ answer after this many seconds
+    slow_delay = 0.2
+    # Pages under /heavy/ run a script for this many ms before they show anything, like a
+    # big single page app starting up
+    heavy_ms = 300
+    # Files under /download/<size> (which answers ranges) and /download-whole/<size> (which
+    # doesn't) are sent at this many bytes per second and connection, like a busy server
+    download_rate = 8 * 1024 * 1024
+    bodies = {}
+    # Every path asked for, to see which requests were blocked
+    requested = []
+
+    def do_GET(self):
+        self.requested.append(self.path)
+        if self.path.startswith('/slow/'):
+            time.sleep(self.slow_delay)
+        if self.path.startswith(('/download/', '/download-whole/')):
+            self.send_download(self.path.startswith('/download/'))
+            return
+        if self.path == '/favicon.ico':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(self.favicon)))
+            self.end_headers()
+            self.wfile.write(self.favicon)
+            return
+        body = f"<html><head><title>{self.path}</title></head><body><h1>{self.path}</h1></body></html>".encode()
+        if self.path.startswith('/embed/'):
+            # A page with an ad, a tracker and an image of its own
+            name = self.path[len('/embed/'):]
+            body = (f"<html><head><title>{name}</title><script src='/ads/track-{name}.js'></script></head><body>"
+                    f"<img src='/ads/banner-{name}.png'><img src='/content/photo-{name}.png'></body></html>").encode()
+        if self.path.startswith('/heavy/'):
+            body = (f"<html><head><title>{self.path}</title><script>const end = Date.now() + {self.heavy_ms}; "
+                    f"while (Date.now() < end);</script></head><body><h1>{self.path}</h1></body></html>").encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_download(self, ranges):
+        size = int(self.path.rsplit('/', 1)[1])
+        if size not in self.bodies:
+            self.bodies[size] = download_body(size)
+        body = self.bodies[size]
+        start, end = 0, size - 1
+        requested = self.headers.get('Range', '')
+        if ranges and requested.startswith('bytes='):
+            first, _, last = requested[6:].partition('-')
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        if ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', f'"{size}"')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Disposition', f'attachment; filename="file-{size}.bin"')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        chunk = 64 * 1024
+        try:
+            for offset in range(start, end + 1, chunk):
+                self.wfile.write(body[offset:min(offset + chunk, end + 1)])
+                time.sleep(chunk / self.download_rate)
+        except (BrokenPipeError, ConnectionResetError):
+            # The browser stopped reading, paused or had its range already
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HandshakeHandler(StandInHandler):
+    # Keeps connections open like a real server, and takes a while to start talking on a new
+    # one, standing in for the DNS lookup and TCP and TLS handshakes of a site far away
+    protocol_version = 'HTTP/1.1'
+    handshake_delay = 0.3
+    heads = []
+
+    def setup(self):
+        time.sleep(self.handshake_delay)
+        super().setup()
+
+    def do_HEAD(self):
+        self.heads.append({'url': self.headers.get('Host', '') + self.path,
+                           'private': not any(self.headers.get(name) for name in ('Cookie', 'Referer', 'Origin'))})
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def solid_icon(color):
+    pixmap = QPixmap(16, 16)
+    pixmap.fill(QColor(color))
+    return QIcon(pixmap)
+
+
+def start_server(handler=StandInHandler):
+    StandInHandler.favicon = encode_png(solid_icon('#c0392b'))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def files_containing(token, directories):
+    found = []
+    for directory in directories:
+        for root, dirs, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    with open(path, 'rb') as f:
+                        if token in f.read():
+                            found.append(path)
+                except OSError:
+                    pass
+    return found
+
+
+def close_window(window):
+    # Close from inside the event loop, otherwise the views' deleteLater() never runs
+    QTimer.singleShot(0, window.close)
+    wait(100)
+    window.deleteLater()
+    wait(100)
+
+
+def live_views():
+    return sum(isinstance(widget, QWebEngineView) for widget in QApplication.allWidgets())
+
+
+def tab_churn(window, tabs=500, max_rss_growth_mb=64):
+    # Open and close tabs one by one; closed tabs must not leave views or memory behind
+    pid = os.getpid()
+    warmup = min(50, tabs // 10)
+    baseline_rss = 0
+    peak_views = 0
+
+    for n in range(tabs):
+        window.add_new_tab(QUrl('about:blank'), 'Churn')
+        window.close_tab(window.browser_tabs.currentIndex())
+        if n % 10 == 9:
+            wait(10)
+            peak_views = max(peak_views, live_views())
+        if n == warmup:
+            wait(500)
+            baseline_rss = rss_bytes(pid)
+
+    wait(1000)
+    expected_views = len(window.tab_manager.live_tabs()) + len(window.view_pool.views)
+    rss_growth = rss_bytes(pid) - baseline_rss
+    return {
+        'tabs': tabs,
+        'expected_views': expected_views,
+        'live_views': live_views(),
+        'peak_views': peak_views,
+        'rss_growth_mb': round(rss_growth / 1048576, 1),
+        'ok': live_views() <= expected_views and rss_growth <= max_rss_growth_mb * 1048576,
+    }
+
+
+def session_restore(window, tabs=100, max_ms=1000):
+    # Time from creating a window with a saved session until its event loop is responsive
+    with tempfile.TemporaryDirectory() as directory:
+        session = SessionStore(directory).window()
+        for n in range(tabs):
+            tab = LazyTab(QUrl(f'https://example.com/page/{n}'), f'Page {n}')
+            session.tab_opened(tab, n)
+            if n == tabs // 2:
+                session.active_changed(tab)
+        session.close()
+
+        start = time.perf_counter()
+        store = SessionStore(directory)
+        restored = Browser(session=store.window(store.saved_windows()[0]))
+        restored.show()
+        loop = QEventLoop()
+        QTimer.singleShot(0, loop.quit)
+        loop.exec_()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        restored_count = restored.browser_tabs.count()
+        result = {
+            'tabs': restored_count,
+            'live_tabs': len(restored.tab_manager.live_tabs()),
+            'interactive_ms': round(elapsed_ms, 1),
+        }
+        close_window(restored)
+
+    # Incognito tabs in between must not shift where the saved tabs come back
+    with tempfile.TemporaryDirectory() as directory:
+        mixed = Browser(session=SessionStore(directory).window())
+        expected = []
+        for n in range(12):
+            url = f'https://example.com/mixed/{n}'
+            mixed.add_new_tab(QUrl(url), f'Mixed {n}', background=True, incognito=n % 3 == 1)
+            if n % 3 != 1:
+                expected.append(url)
+        close_window(mixed)
+        store = SessionStore(directory)
+        saved = [record['url'] for record in store.saved_tabs(store.saved_windows()[0])]
+        store.close()
+
+    # A window closed while another one is open is forgotten, the windows still open at the
+    # end come back, including those opened after the first one was closed
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(directory)
+        first = Browser(session=store.window(), urls=['https://example.com/first'])
+        second = Browser(session=store.window(), urls=['https://example.com/second'])
+        close_window(first)
+        third = Browser(session=store.window(), urls=['https://example.com/third'])
+        close_window(second)
+        close_window(third)
+        store = SessionStore(directory)
+        windows_kept = [[record['url'] for record in store.saved_tabs(window_id)]
+                        for window_id in store.saved_windows()]
+        store.close()
+
+    result['mixed_order_kept'] = saved == expected
+    result['windows_kept'] = windows_kept == [['https://example.com/second'], ['https://example.com/third']]
+    result['ok'] = (restored_count == tabs and elapsed_ms < max_ms and result['mixed_order_kept']
+                    and result['windows_kept'])
+    return result
+
+
+def new_tab(window, tabs=20, interval=500, max_load_ms=500, max_paint_ms=1000):
+    # Latency from add_new_tab to the start page being loaded and painted, with views from
+    # the pool against views built on the spot, which is what every new tab did before the pool.
+    # Views can come prewarmed from the pool, so poll the document instead of waiting for loadFinished.
+    def open_tabs():
+        load_ms, paint_ms = [], []
+        for n in range(tabs):
+            start = time.time()
+            tab = window.add_new_tab(QUrl(NEW_TAB_URL), 'New Tab')
+            wait_until_loaded(tab.view, NEW_TAB_URL.toString())
+            if run_js(tab.view, READY_JS) == NEW_TAB_URL.toString():
+                load_ms.append((time.time() - start) * 1000)
+
+            for attempt in range(20):
+                painted_at = run_js(tab.view, FIRST_PAINT_JS)
+                if painted_at:
+                    paint_ms.append(max(0, painted_at - start * 1000))
+                    break
+                wait(16)
+            window.close_tab(window.browser_tabs.currentIndex())
+            # Give the pool the idle time a user would between two new tabs
+            wait(interval)
+        return load_ms, paint_ms
+
+    pool = window.view_pool
+    size = pool.size
+    pool.size = 0
+    pool.clear()
+    cold_load_ms, cold_paint_ms = open_tabs()
+    pool.size = size
+    pool.start()
+    wait(interval)
+
+    hits = pool.hits
+    load_ms, paint_ms = open_tabs()
+    measured = len(load_ms) == tabs and len(paint_ms) == tabs and len(cold_load_ms) == tabs
+    open_to_load_ms = statistics.median(load_ms) if load_ms else None
+    open_to_paint_ms = statistics.median(paint_ms) if paint_ms else None
+    cold_open_to_load_ms = statistics.median(cold_load_ms) if cold_load_ms else None
+    return {
+        'tabs': tabs,
+        'pool_hits': pool.hits - hits,
+        'open_to_load_ms': round(open_to_load_ms, 1) if load_ms else None,
+        'open_to_paint_ms': round(open_to_paint_ms, 1) if paint_ms else None,
+        'cold_open_to_load_ms': round(cold_open_to_load_ms, 1) if cold_load_ms else None,
+        'cold_open_to_paint_ms': round(statistics.median(cold_paint_ms), 1) if cold_paint_ms else None,
+        # Every tab loaded and painted in time, and the pool is no slower than building views
+        'ok': measured and open_to_load_ms <= max_load_ms and open_to_paint_ms <= max_paint_ms
+              and open_to_load_ms <= cold_open_to_load_ms,
+    }
+
+
+def incognito(window, tabs=5):
+    # Incognito pages must leave nothing on disk, and closing the last incognito tab
+    # has to release the off-the-record profile and its renderers
+    server = start_server()
+    token = uuid.uuid4().hex
+    opened = []
+    for n in range(tabs):
+        url = f'{server}/incognito-{token}/{n}'
+        tab = window.add_new_tab(QUrl(url), 'Incognito', incognito=True)
+        wait_until_loaded(tab.view, url)
+        opened.append(tab)
+    renderers = {tab.renderer_pid() for tab in opened}
+
+    for tab in opened:
+        window.close_tab(window.browser_tabs.indexOf(tab))
+    wait(2000)
+
+    directories = [QStandardPaths.writableLocation(QStandardPaths.AppDataLocation),
+                   QStandardPaths.writableLocation(QStandardPaths.CacheLocation)]
+    files = files_containing(token.encode(), directories)
+    alive = [pid for pid in renderers if pid and os.path.exists(f'/proc/{pid}')]
+    return {
+        'tabs': tabs,
+        'files_with_visited_urls': files,
+        'profile_released': window.profiles.incognito is None,
+        'renderers_alive': len(alive),
+        'ok': not files and window.profiles.incognito is None and not alive,
+    }
+
+
+WORDS = ("alpha beta gamma delta report dashboard metrics build deploy status wiki docs search news "
+         "video music shop cart login account settings profile team project issue release notes "
+         "weather maps mail calendar").split()
+
+
+def synthetic_pages(pages, hosts=5000, seed=1):
+    # Distinct (url, title) pairs, spread unevenly over the hosts
+    rng = random.Random(seed)
+    host_names = [f"{rng.choice(['www.', ''])}{rng.choice(WORDS)}{n}.{rng.choice(['com', 'org', 'net', 'io'])}"
+                  for n in range(hosts)]
+    urls = []
+    for n in range(pages):
+        host = host_names[int(rng.paretovariate(1.2)) % hosts]
+        path = '/'.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+        urls.append((f"https://{host}/{path}/{n}", ' '.join(rng.choice(WORDS) for _ in range(4)).title()))
+    return urls
+
+
+def synthetic_history(visits, pages=200000, hosts=5000, seed=1):
+    # Visits over a fixed set of pages, a few of them visited much more often than the rest
+    rng = random.Random(seed)
+    urls = synthetic_pages(pages, hosts, seed)
+    return [urls[min(int(rng.paretovariate(0.3)), rng.randrange(pages))] for n in range(visits)]
+
+
+def distribution(samples):
+    samples = sorted(samples)
+    return {'p50': round(samples[len(samples) // 2], 2), 'p95': round(samples[int(len(samples) * 0.95)], 2),
+            'max': round(samples[-1], 2)}
+
+
+def latency_ms(function, queries, repeat=20):
+    samples = []
+    for query in queries:
+        for n in range(repeat):
+            start = time.perf_counter()
+            function(query)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {'p50': round(samples[len(samples) // 2], 3), 'p99': round(samples[int(len(samples) * 0.99)], 3)}
+
+
+def history(window, visits=1000000, max_query_ms=10):
+    # Insert throughput of the history writer and query latency over the seeded database
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(os.path.join(directory, 'history.db'))
+        seeded = synthetic_history(visits)
+        start = time.perf_counter()
+        for url, title in seeded:
+            store.add_visit(url, title)
+        store.flush()
+        elapsed = time.perf_counter() - start
+
+        prefix = latency_ms(store.prefix, ['a', 'al', 'alp', 'www.b', 'beta12', 'docs3.org/w'])
+        search = latency_ms(store.search, ['alpha', 'report dash', 'wea', 'metrics build deploy', 'zzz'])
+
+        # A batch that fails is dropped and the writer goes on with the next one
+        store.add_visit(None)
+        store.flush()
+        store.add_visit('https://example.com/after-error')
+        survived = store.flush() and bool(store.prefix('example.com/after-error'))
+        store.close()
+
+    return {
+        'visits': visits,
+        'inserts_per_second': round(visits / elapsed),
+        'prefix_ms': prefix,
+        'search_ms': search,
+        'writer_survived_error': survived,
+        'ok': prefix['p99'] < max_query_ms and search['p99'] < max_query_ms and survived,
+    }
+
+
+def omnibox(window, entries=500000, max_keystroke_ms=16):
+    # Url bar suggestions over a large history: index build, each keystroke of typed urls
+    # through the same path the url bar uses, and visits added while the index is live
+    rng = random.Random(2)
+    now = time.time()
+    rows = [(url, title, int(rng.paretovariate(1.0)), now - rng.uniform(0, 200) * DAY)
+            for url, title in synthetic_pages(entries)]
+    index = FrecencyIndex()
+    start = time.perf_counter()
+    index.load(rows)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    typed = ['docs3.org/wiki', 'www.alpha12.com/report', 'mail', 'zzz', 'https://beta7']
+    keystrokes = [text[:n] for text in typed for n in range(1, len(text) + 1)]
+    live_index = window.omnibox.index
+    window.omnibox.index = index
+    keystroke = latency_ms(window.omnibox.suggestions, keystrokes)
+    window.omnibox.index = live_index
+
+    visits = [url for url, title, count, last_visit in rng.sample(rows, 2000)]
+    visits += [f"https://new{n}.example.com/" for n in range(2000)]
+    add = latency_ms(lambda url: index.add(url, points=100), visits, repeat=1)
+
+    return {
+        'entries': len(index),
+        'build_ms': round(build_ms),
+        'keystroke_ms': keystroke,
+        'add_ms': add,
+        'ok': keystroke['p99'] < max_keystroke_ms and add['p99'] < max_keystroke_ms,
+    }
+
+
+def bookmarks(window, count=100000, folders=50, max_lookup_ms=1):
+    # Store: lazy load, lookups on every url change, and edits rewriting only their folder.
+    # Start page: a prewarmed new tab must show a bookmark added after it was loaded.
+    with tempfile.TemporaryDirectory() as directory:
+        store = BookmarkStore(directory)
+        pages = synthetic_pages(count)
+        start = time.perf_counter()
+        for n, (url, title) in enumerate(pages):
+            store.add(url, title, folder=f"Folder {n % folders}", tags=[WORDS[n % len(WORDS)]])
+        add_ms = (time.perf_counter() - start) * 1000 / count
+
+        store = BookmarkStore(directory)
+        start = time.perf_counter()
+        store.load()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        hits = [url.replace('https://', 'HTTPS://', 1) + '/#top' for url, title in pages[:500]]
+        misses = [url + 'x' for url, title in pages[:500]]
+        lookup = latency_ms(store.contains, hits + misses, repeat=5)
+        found = sum(store.contains(url) for url in hits) == len(hits) and not any(map(store.contains, misses))
+
+        before = {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)}
+        time.sleep(0.01)
+        store.remove(pages[7][0])
+        after = {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)}
+        rewritten = [name for name in after if after[name] != before.get(name)]
+
+        # Damaged lines are left out instead of stopping the load
+        kept = sum(len(folder) for folder in store.folders.values())
+        with open(store.folder_path("Folder 3"), 'a', encoding='utf-8') as f:
+            f.write('5\n{"url": "https://example.com/"}\n[1, 2, 3, 4]\n["https://exa\n')
+        store = BookmarkStore(directory)
+        store.load()
+        damaged_skipped = sum(len(folder) for folder in store.folders.values()) == kept
+
+    url = f"https://tile-{uuid.uuid4().hex[:8]}.example.com/"
+    window.bookmarks.add(url, "Tile check")
+    tab = window.add_new_tab(QUrl(NEW_TAB_URL), 'New Tab')
+    wait(300)
+    tile_shown = bool(run_js(tab.view, f"!!document.querySelector('.bookmark-tile[title=\"{url}\"]')"))
+    window.close_tab(window.browser_tabs.currentIndex())
+    window.bookmarks.remove(url)
+
+    return {
+        'bookmarks': count,
+        'add_ms': round(add_ms, 3),
+        'load_ms': round(load_ms),
+        'lookup_ms': lookup,
+        'lookups_correct': found,
+        'files_rewritten_by_remove': rewritten,
+        'prewarmed_tab_shows_new_bookmark': tile_shown,
+        'damaged_lines_skipped': damaged_skipped,
+        'ok': (found and lookup['p99'] < max_lookup_ms and len(rewritten) == 1 and tile_shown
+               and damaged_skipped),
+    }
+
+
+def favicons(window, origins=1000, images=20, memory_icons=16, max_icon_ms=1):
+    # Cache: origins sharing an image share one file, and after a restart icons come back
+    # from disk with the decoded ones bounded. Browser: a site's icon is cached once seen,
+    # and a new placeholder tab for that site shows it before any view exists.
+    with tempfile.TemporaryDirectory() as directory:
+        cache = FaviconCache(directory)
+        icons = [solid_icon(QColor.fromHsv(n * 360 // images, 200, 200)) for n in range(images)]
+        urls = [f"https://site{n}.example.com/page" for n in range(origins)]
+        for n, url in enumerate(urls):
+            cache.store(url, icons[n % images])
+        cache.close()
+        files = len(os.listdir(os.path.join(directory, 'icons')))
+
+        cache = FaviconCache(directory, memory_size=memory_icons)
+        restored = latency_ms(cache.icon_for, urls, repeat=1)
+        missing = sum(cache.icon_for(url).isNull() for url in urls)
+        stats = cache.stats()
+        cache.close()
+
+    server = start_server()
+    tab = window.add_new_tab(QUrl(f'{server}/first'), 'First')
+    start = time.time()
+    while tab.icon.isNull() and time.time() - start < 10:
+        wait(20)
+    window.favicons.flush()
+    placeholder = window.add_new_tab(QUrl(f'{server}/second'), 'Second', background=True)
+    instant = not placeholder.is_materialized() and not placeholder.icon.isNull()
+    window.close_tab(window.browser_tabs.indexOf(placeholder))
+    window.close_tab(window.browser_tabs.indexOf(tab))
+
+    return {
+        'origins': origins,
+        'image_files': files,
+        'missing_after_restart': missing,
+        'icon_for_after_restart_ms': restored,
+        'decoded_in_memory': stats['in_memory'],
+        'placeholder_icon_without_view': instant,
+        'ok': (files == images and not missing and stats['in_memory'] <= memory_icons and instant
+               and restored['p99'] < max_icon_ms),
+    }
+
+
+def startup(window, runs=5, history_urls=200000, timeout=30):
+    # Cold starts of the real script with --profile-startup, against a data directory
+    # holding a large history, median of each phase over a few runs
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cwanda.py')
+    with tempfile.TemporaryDirectory() as directory:
+        # Where QStandardPaths puts Cwanda's AppDataLocation for this XDG_DATA_HOME
+        history_dir = os.path.join(directory, 'Cwanda', 'Cwanda', 'history')
+        os.makedirs(history_dir)
+        store = HistoryStore(os.path.join(history_dir, 'history.db'))
+        for url, title in synthetic_pages(history_urls):
+            store.add_visit(url, title)
+        store.close()
+
+        environment = dict(os.environ, XDG_DATA_HOME=directory)
+        runs_phases = []
+        for n in range(runs + 1):
+            child = subprocess.Popen([sys.executable, script, '--profile-startup'], env=environment,
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            timer = threading.Timer(timeout, child.kill)
+            timer.start()
+            line = child.stdout.readline()
+            timer.cancel()
+            child.kill()
+            child.wait()
+            if line and n:
+                # The first run creates the profile, it is not counted
+                runs_phases.append(json.loads(line))
+
+    phases = {phase: round(statistics.median(run[phase] for run in runs_phases), 1)
+              for phase in (runs_phases[0] if runs_phases else {})}
+    return {
+        'runs': len(runs_phases),
+        'history_urls': history_urls,
+        'phases_ms': phases,
+        'ok': len(runs_phases) == runs,
+    }
+
+
+def themes(window, tabs=50, rounds=5, max_switch_ms=16):
+    # Switching themes with many tabs open, including the repaint it causes
+    server = start_server()
+    opened = [window.add_new_tab(QUrl(f'{server}/theme/{n}'), 'Theme') for n in range(tabs)]
+    wait(2000)
+    names = window.themes.names()
+    samples = []
+    for n in range(rounds):
+        for name in names:
+            start = time.perf_counter()
+            window.set_theme(name)
+            QApplication.processEvents()
+            window.repaint()
+            samples.append((time.perf_counter() - start) * 1000)
+            wait(20)
+    window.set_theme(setting('appearance/theme'))
+    for tab in opened:
+        window.close_tab(window.browser_tabs.indexOf(tab))
+
+    samples.sort()
+    result = {'p50': round(samples[len(samples) // 2], 2), 'max': round(samples[-1], 2)}
+    return {
+        'tabs': tabs,
+        'switches': len(samples),
+        'switch_ms': result,
+        'ok': result['p50'] < max_switch_ms,
+    }
+
+
+# A worker, because timers of background pages are throttled and workers are not
+BUSY_JS = "new Worker(URL.createObjectURL(new Blob(['for (;;) {}'])))"
+
+
+def task_manager(window, tabs=8, samples=10):
+    # One tab of a few keeps its renderer busy; the task manager has to put it on top,
+    # sampling has to stay cheap, and the samples have to come out as CSV
+    server = start_server()
+    # Two sites, so the tabs don't all end up in one renderer
+    origins = [server, server.replace('127.0.0.1', 'localhost')]
+    opened = []
+    for n in range(tabs):
+        url = f'{origins[n % 2]}/task/{n}'
+        tab = window.add_new_tab(QUrl(url), 'Task')
+        wait_until_loaded(tab.view, url)
+        opened.append(tab)
+    busy = opened[3]
+    busy.view.page().runJavaScript(BUSY_JS)
+
+    window.show_task_manager()
+    dialog = window.task_manager_dialog
+    monitor = window.resource_monitor
+    wait(monitor.timer.interval() + 500)
+
+    tab_rows = [row for row in monitor.latest if row['tab'] is not None]
+    top = max(tab_rows, key=lambda row: row['cpu_percent'] or 0)
+    first_row = dialog.rows[dialog.table.item(0, 0).data(Qt.UserRole)]
+    measured = all(row['network_bytes'] for row in tab_rows if row['tab'] in opened)
+
+    cost = []
+    for n in range(samples):
+        start = time.perf_counter()
+        monitor.sample()
+        cost.append((time.perf_counter() - start) * 1000)
+
+    # End the busy renderer from the panel, it is selected as the top row
+    busy_pid = busy.renderer_pid()
+    dialog.table.selectRow(0)
+    dialog.kill_selected()
+    wait(500)
+    killed = cpu_seconds(busy_pid) is None
+
+    victim = opened[0]
+    window.tab_manager.evict(victim)
+    monitor.sample()
+    discarded = all(row['tab'] is not victim for row in monitor.latest)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tasks.csv')
+        exported = monitor.export_csv(path)
+        with open(path, newline='', encoding='utf-8') as f:
+            csv_rows = sum(1 for line in f) - 1
+
+    dialog.close()
+    stopped = not monitor.timer.isActive()
+    for tab in opened:
+        window.close_tab(window.browser_tabs.indexOf(tab))
+
+    return {
+        'tabs': tabs,
+        'busy_tab_cpu_percent': top['cpu_percent'] if top['tab'] is busy else None,
+        'busy_tab_on_top': top['tab'] is busy and first_row['tab'] is busy,
+        'network_measured': measured,
+        'sample_ms': round(statistics.median(cost), 2),
+        'busy_process_ended': killed,
+        'discarded_tab_gone': discarded,
+        'csv_rows': csv_rows,
+        'sampling_stops_when_closed': stopped,
+        'ok': (top['tab'] is busy and first_row['tab'] is busy and measured and killed and discarded
+               and csv_rows == exported and stopped),
+    }
+
+
+# Background work a real page might do, like polling or an animation driven from a worker,
+# which hidden-tab timer throttling doesn't slow down
+HEARTBEAT_JS = ("new Worker(URL.createObjectURL(new Blob(["
+                "'setInterval(() => { let x = 0; for (let i = 0; i < 200000; i++) x += i; }, 20)'])))")
+
+
+def idle_cpu_percent(pids, seconds):
+    # CPU the processes use together while nobody touches the window, in percent of one core
+    before = {pid: cpu_seconds(pid) or 0 for pid in pids}
+    wait(int(seconds * 1000))
+    used = sum((cpu_seconds(pid) or before[pid]) - before[pid] for pid in pids)
+    return round(100 * used / seconds, 1)
+
+
+def lifecycle(window, tabs=30, idle_s=5):
+    # A window of start pages and busy sites, idle with every background tab running,
+    # then with them frozen. Pinned tabs keep running, frozen ones come back when shown,
+    # and discarded ones reload.
+    server = start_server()
+    manager = window.lifecycle
+    saved = (window.tab_manager.max_live_tabs, window.tab_manager.memory_budget, manager.freeze_after,
+             manager.discard_after)
+    # Every tab stays live, this is about what they cost while they are
+    window.tab_manager.max_live_tabs = tabs + 10
+    window.tab_manager.memory_budget = float('inf')
+    manager.freeze_after = manager.discard_after = 0
+
+    opened = []
+    for n in range(tabs):
+        url = NEW_TAB_URL.toString() if n % 2 == 0 else f'{server}/busy/{n}'
+        tab = window.add_new_tab(QUrl(url), 'Lifecycle')
+        wait_until_loaded(tab.view, url)
+        if n % 2:
+            tab.view.page().runJavaScript(HEARTBEAT_JS)
+        opened.append(tab)
+    pinned = opened[0]
+    window.toggle_pinned(pinned)
+    wait(500)
+
+    pids = {tab.renderer_pid() for tab in opened} | {os.getpid()}
+    running = idle_cpu_percent(pids, idle_s)
+
+    manager.freeze_after = 1
+    manager.update()
+    wait(1500)
+    background = [tab for tab in opened if tab is not window.browser_tabs.currentWidget()]
+    frozen = [tab for tab in background if tab.view.page().lifecycleState() == QWebEnginePage.LifecycleState.Frozen]
+    pinned_running = pinned.view.page().lifecycleState() == QWebEnginePage.LifecycleState.Active
+    sleeping = idle_cpu_percent(pids, idle_s)
+
+    # Showing a frozen tab wakes it up
+    woken = opened[2]
+    window.browser_tabs.setCurrentWidget(woken)
+    resumed = (woken.view.page().lifecycleState() == QWebEnginePage.LifecycleState.Active
+               and run_js(woken.view, READY_JS) == NEW_TAB_URL.toString())
+
+    manager.discard_after = 2
+    manager.update()
+    wait(2500)
+    discarded = [tab for tab in opened if tab.view.page().lifecycleState() == QWebEnginePage.LifecycleState.Discarded]
+    reloaded = opened[3]
+    window.browser_tabs.setCurrentWidget(reloaded)
+    wait_until_loaded(reloaded.view, f'{server}/busy/3')
+    reload_ok = run_js(reloaded.view, READY_JS) == f'{server}/busy/3'
+
+    window.toggle_pinned(pinned)
+    for tab in opened:
+        window.close_tab(window.browser_tabs.indexOf(tab))
+    (window.tab_manager.max_live_tabs, window.tab_manager.memory_budget, manager.freeze_after,
+     manager.discard_after) = saved
+
+    return {
+        'tabs': tabs,
+        'idle_cpu_percent_running': running,
+        'idle_cpu_percent_frozen': sleeping,
+        'frozen': len(frozen),
+        'background': len(background),
+        'pinned_kept_running': pinned_running,
+        'frozen_tab_resumed': resumed,
+        'discarded': len(discarded),
+        'discarded_tab_reloaded': reload_ok,
+        'ok': (len(frozen) == len(background) - 1 and pinned_running and resumed and sleeping < running
+               and discarded and reload_ok),
+    }
+
+
+def process_tree(pid):
+    # The process and everything it started, QtWebEngine's zygote and renderers included
+    children = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(parent, []).append(int(name))
+    tree, todo = [], [pid]
+    while todo:
+        current = todo.pop()
+        tree.append(current)
+        todo.extend(children.get(current, []))
+    return tree
+
+
+def window_memory():
+    # The browser and every renderer its windows and the view pool use
+    views = [tab.view for window in QApplication.instance().windows for tab in window.tab_manager.live_tabs()]
+    views += QApplication.instance().view_pool.views
+    pids = {view.page().renderProcessPid() for view in views} | {os.getpid()}
+    return sum(rss_bytes(pid) for pid in pids if pid)
+
+
+def windows(window, runs=3, timeout=30):
+    # Another window in the running browser against another browser process, both until
+    # the start page is up, and a second launch handing its url to the running browser
+    app = QApplication.instance()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cwanda.py')
+    server = start_server()
+
+    in_process, added = [], []
+    for n in range(runs):
+        before = window_memory()
+        start = time.perf_counter()
+        opened = app.open_window()
+        wait_until_loaded(opened.browser_tabs.currentWidget().view, NEW_TAB_URL.toString())
+        in_process.append((time.perf_counter() - start) * 1000)
+        wait(1000)
+        added.append(window_memory() - before)
+        # Windows opened by the application delete themselves once closed
+        QTimer.singleShot(0, opened.close)
+        wait(200)
+
+    with tempfile.TemporaryDirectory() as directory:
+        environment = dict(os.environ, XDG_DATA_HOME=directory)
+        separate, separate_memory = [], []
+        for n in range(runs + 1):
+            start = time.perf_counter()
+            child = subprocess.Popen([sys.executable, script, '--profile-startup'], env=environment,
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            timer = threading.Timer(timeout, child.kill)
+            timer.start()
+            line = child.stdout.readline()
+            timer.cancel()
+            if line and n:
+                # The first run creates the profile, it is not counted
+                separate.append((time.perf_counter() - start) * 1000)
+                wait(1000)
+                separate_memory.append(sum(rss_bytes(pid) for pid in process_tree(child.pid)))
+            child.kill()
+            child.wait()
+
+        # This process stands in for the running browser of that data directory
+        app.listen(instance_name(os.path.join(directory, 'Cwanda', 'Cwanda')))
+        url = f'{server}/forwarded'
+        count = len(app.windows)
+        start = time.perf_counter()
+        child = subprocess.Popen([sys.executable, script, url], env=environment,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while child.poll() is None and time.perf_counter() - start < timeout:
+            wait(5)
+        forwarded = None
+        while len(app.windows) == count and time.perf_counter() - start < timeout:
+            wait(5)
+        if len(app.windows) > count:
+            forwarded = app.windows[-1]
+            wait_until_loaded(forwarded.browser_tabs.currentWidget().view, url)
+        forward_ms = (time.perf_counter() - start) * 1000
+        forwarded_url = forwarded.browser_tabs.currentWidget().url.toString() if forwarded else None
+        app.instance_server.close()
+        if forwarded is not None:
+            QTimer.singleShot(0, forwarded.close)
+            wait(200)
+
+    return {
+        'runs': runs,
+        'new_window_ms': round(statistics.median(in_process), 1),
+        'new_window_memory_mb': round(statistics.median(added) / 1048576, 1),
+        'new_process_ms': round(statistics.median(separate), 1) if separate else None,
+        'new_process_memory_mb': round(statistics.median(separate_memory) / 1048576, 1) if separate else None,
+        'second_launch_exit_code': child.returncode,
+        'forwarded_window_ms': round(forward_ms, 1),
+        'forwarded_url_opened': forwarded_url == url,
+        'ok': (len(separate) == runs and child.returncode == 0 and forwarded_url == url
+               and statistics.median(in_process) < statistics.median(separate)
+               and statistics.median(added) < statistics.median(separate_memory)),
+    }
+
+
+def automation(window, tabs=20, timeout=60):
+    # A headless Cwanda driven over stdin like a CI job would: open tabs against the stand-in
+    # server, wait for each load, read a value and the navigation timings back. Then the
+    # same over a local socket.
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cwanda.py')
+    server = start_server()
+    commands = [{'cmd': 'open', 'url': f'{server}/load/{n}'} for n in range(tabs)]
+    commands += [{'cmd': 'wait', 'tab': n + 1, 'timeout_ms': 10000} for n in range(tabs)]
+    commands += [{'cmd': 'timings', 'tab': n + 1} for n in range(tabs)]
+    commands += [{'cmd': 'js', 'tab': 1, 'script': 'document.title'},
+                 {'cmd': 'navigate', 'tab': 1, 'url': f'{server}/again'},
+                 {'cmd': 'wait', 'tab': 1},
+                 {'cmd': 'close', 'tab': 2},
+                 {'cmd': 'wait', 'tab': 2}]
+    # Malformed commands are refused and the browser goes on to the next one
+    malformed = [{'cmd': 'navigate', 'tab': 1},
+                 {'cmd': 'js', 'tab': 1},
+                 {'cmd': 'js', 'tab': 1, 'script': 5},
+                 {'cmd': 'wait', 'tab': 1, 'timeout_ms': 'soon'},
+                 {'cmd': 'wait', 'tab': 1, 'timeout_ms': -1},
+                 {'cmd': 'timings', 'tab': '1'}]
+    commands += malformed + [{'cmd': 'js', 'tab': 1, 'script': 'document.title', 'timeout_ms': 5000},
+                             {'cmd': 'quit'}]
+    script_input = ''.join(json.dumps(dict(command, id=n)) + '\n' for n, command in enumerate(commands))
+
+    start = time.perf_counter()
+    child = subprocess.run([sys.executable, script, '--headless'], input=script_input, capture_output=True,
+                           text=True, timeout=timeout)
+    total_ms = (time.perf_counter() - start) * 1000
+    answers = {answer['id']: answer for answer in map(json.loads, child.stdout.splitlines())}
+    waits = [answers.get(tabs + n, {}) for n in range(tabs)]
+    timings = [answers.get(2 * tabs + n, {}).get('navigation') or {} for n in range(tabs)]
+    loaded = all(answer.get('ok') for answer in waits)
+    load_ms = [answer['load_ms'] for answer in waits if answer.get('load_ms') is not None]
+    title = answers.get(3 * tabs, {}).get('value')
+    navigated = answers.get(3 * tabs + 2, {}).get('ok')
+    closed_error = 'error' in answers.get(3 * tabs + 4, {})
+    refused = [answers.get(3 * tabs + 5 + n, {}) for n in range(len(malformed))]
+    malformed_refused = all(answer.get('ok') is False and 'error' in answer for answer in refused)
+    after_malformed = answers.get(3 * tabs + 5 + len(malformed), {}).get('value') == '/again'
+
+    # The same browser reachable over a local socket instead
+    name = f'cwanda-automation-{os.getpid()}'
+    socket_child = subprocess.Popen([sys.executable, script, f'--headless={name}'],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket = QLocalSocket()
+    deadline = time.time() + timeout
+    while socket.state() != QLocalSocket.ConnectedState and time.time() < deadline:
+        socket.connectToServer(name)
+        if not socket.waitForConnected(200):
+            time.sleep(0.2)
+    replies = []
+    for n, command in enumerate([{'cmd': 'open', 'url': f'{server}/socket'}, {'cmd': 'wait', 'tab': 1},
+                                 {'cmd': 'quit'}]):
+        socket.write(json.dumps(dict(command, id=n)).encode() + b'\n')
+        socket.flush()
+        while not socket.canReadLine() and socket.waitForReadyRead(timeout * 1000):
+            pass
+        replies.append(json.loads(bytes(socket.readLine()).decode()) if socket.canReadLine() else {})
+    socket_child.wait(timeout)
+    over_socket = replies[1].get('ok') is True and socket_child.returncode == 0
+
+    return {
+        'tabs': tabs,
+        'answers': len(answers),
+        'commands': len(commands),
+        'all_loaded': loaded,
+        'load_ms': {'p50': round(statistics.median(load_ms), 1) if load_ms else None,
+                    'max': max(load_ms) if load_ms else None},
+        'dom_content_loaded_ms_p50': round(statistics.median(t.get('dom_content_loaded', 0) for t in timings), 1),
+        'title_read': title,
+        'navigated': navigated,
+        'closed_tab_refused': closed_error,
+        'malformed_refused': malformed_refused,
+        'answers_after_malformed': after_malformed,
+        'run_ms': round(total_ms, 1),
+        'exit_code': child.returncode,
+        'over_socket': over_socket,
+        'ok': (len(answers) == len(commands) and loaded and title == '/load/0' and navigated is True
+               and closed_error and malformed_refused and after_malformed and child.returncode == 0
+               and over_socket),
+    }
+
+
+def telemetry(window, loads=20, records=5000):
+    # Page loads from a fast and a slow origin: every load gets a record with the page's
+    # own timings, the slow origin comes out on top, and both exports hold every record
+    server = start_server()
+    # Another port is another origin but the same site, so the tab keeps its renderer
+    slow_origin = start_server()
+    store = window.telemetry
+    before = len(store.records)
+    tab = window.add_new_tab(QUrl(f'{server}/fast/start'), 'Telemetry')
+    wait_until_loaded(tab.view, f'{server}/fast/start')
+    for n in range(loads):
+        url = f'{server}/fast/{n}' if n % 2 else f'{slow_origin}/slow/{n}'
+        tab.view.setUrl(QUrl(url))
+        wait_until_loaded(tab.view, url)
+        # Like someone reading the page, don't navigate on before it has painted and the
+        # telemetry has looked again
+        start = time.time()
+        while run_js(tab.view, FIRST_PAINT_JS) is None and time.time() - start < 5:
+            wait(10)
+        wait(PAINT_RETRY_MS + 50)
+
+    added = list(store.records)[before:]
+    timed = all(record['response_start'] is not None and record['first_contentful_paint'] is not None
+                for record in added)
+    summary = store.summary()
+    slowest = store.slowest(1)[0][0]
+    slow = summary.get(slow_origin, {}).get('load_ms', {})
+    fast = summary.get(server, {}).get('load_ms', {})
+
+    window.load_overlay.toggle()
+    overlay_shows = window.load_overlay.isVisible() and slow_origin in window.load_overlay.text()
+    window.load_overlay.toggle()
+
+    with tempfile.TemporaryDirectory() as directory:
+        exported_json = store.export_json(os.path.join(directory, 'loads.json'))
+        with open(os.path.join(directory, 'loads.json'), encoding='utf-8') as f:
+            json_records = len(json.load(f)['records'])
+        exported_csv = store.export_csv(os.path.join(directory, 'loads.csv'))
+        with open(os.path.join(directory, 'loads.csv'), newline='', encoding='utf-8') as f:
+            csv_records = sum(1 for line in f) - 1
+
+    # A full ring buffer, summarising it is what the overlay does on every load
+    full = PageLoadTelemetry(keep=records)
+    for n in range(records * 2):
+        full.add({'time': n, 'url': f'https://site{n % 50}.test/{n}', 'origin': f'https://site{n % 50}.test',
+                  'ok': True, 'load_ms': float(n % 997), 'first_progress_ms': 1.0},
+                 {'response_start': 10.0, 'first_contentful_paint': 50.0})
+    summary_ms = latency_ms(lambda query: full.summary(), [None], repeat=10)
+
+    window.close_tab(window.browser_tabs.indexOf(tab))
+    return {
+        'loads': loads,
+        'records': len(added),
+        'page_timings_read': timed,
+        'slow_origin_load_ms': slow,
+        'fast_origin_load_ms': fast,
+        'slowest_origin_found': slowest == slow_origin,
+        'overlay_shows_slow_origin': overlay_shows,
+        'exported_json': json_records,
+        'exported_csv': csv_records,
+        'ring_buffer_bounded': len(full.records) == records,
+        'summary_ms': summary_ms,
+        'ok': (len(added) == loads + 1 and timed and slowest == slow_origin and overlay_shows
+               and json_records == exported_json == csv_records == exported_csv and len(full.records) == records),
+    }
+
+
+def wait_for_download(download, timeout=60):
+    start = time.time()
+    while download.state not in ('finished', 'failed', 'cancelled') and time.time() - start < timeout:
+        wait(10)
+    return time.time() - start
+
+
+def file_matches(path, size):
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).digest() == hashlib.sha1(download_body(size)).digest()
+
+
+def downloads(window, size_mb=32, small_files=5, max_active=2, max_gap_ms=50):
+    # Downloads from a server sending at most StandInHandler.download_rate per connection:
+    # split into parallel ranges the file comes faster than in one piece, it can be paused
+    # and resumed, the queue keeps to max_active, and the event loop keeps running while
+    # the data goes to disk
+    server = start_server()
+    manager = QApplication.instance().downloads
+    size = size_mb * 1024 * 1024
+    directory = tempfile.TemporaryDirectory()
+    manager.directory = directory.name
+    results = {}
+
+    # The event loop's longest gap while a download runs, the GUI stalls for that long
+    gaps = []
+    last = [time.perf_counter()]
+
+    def tick():
+        now = time.perf_counter()
+        gaps.append((now - last[0]) * 1000)
+        last[0] = now
+
+    ticker = QTimer()
+    ticker.timeout.connect(tick)
+
+    whole = manager.add(f'{server}/download-whole/{size}', 'whole.bin')
+    whole_s = wait_for_download(whole)
+    results['single_connection_s'] = round(whole_s, 2)
+    results['single_connection_ok'] = whole.state == 'finished' and file_matches(whole.path, size)
+
+    ticker.start(10)
+    last[0] = time.perf_counter()
+    split = manager.add(f'{server}/download/{size}', 'split.bin')
+    split_s = wait_for_download(split)
+    ticker.stop()
+    results['segmented_s'] = round(split_s, 2)
+    results['segments'] = len(split.segments)
+    results['segmented_ok'] = split.state == 'finished' and file_matches(split.path, size)
+    results['speedup'] = round(whole_s / split_s, 2) if split_s else None
+    results['event_loop_max_gap_ms'] = round(max(gaps), 1) if gaps else None
+
+    paused = manager.add(f'{server}/download/{size}', 'paused.bin')
+    start = time.time()
+    while paused.received() < size // 4 and time.time() - start < 30:
+        wait(10)
+    manager.pause(paused)
+    received = paused.received()
+    wait(500)
+    results['pause_holds'] = paused.state == 'paused' and paused.received() == received
+    manager.resume(paused)
+    wait_for_download(paused)
+    results['resumed_ok'] = paused.state == 'finished' and file_matches(paused.path, size)
+
+    cancelled = manager.add(f'{server}/download/{size}', 'cancelled.bin')
+    while cancelled.received() == 0 and time.time() - start < 60:
+        wait(10)
+    manager.cancel(cancelled)
+    wait(200)
+    results['cancel_removes_file'] = not os.path.exists(cancelled.part_path) and not os.path.exists(cancelled.path)
+
+    # The queue: only max_active at a time, the rest wait their turn
+    manager.max_active = max_active
+    most_active = [0]
+    count_active = lambda: most_active.__setitem__(0, max(most_active[0], sum(d.active() for d in manager.downloads)))
+    manager.listeners.append(count_active)
+    small = 2 * 1024 * 1024
+    queued = [manager.add(f'{server}/download/{small}', f'small-{n}.bin') for n in range(small_files)]
+    for download in queued:
+        wait_for_download(download)
+    manager.listeners.remove(count_active)
+    manager.max_active = setting('downloads/max_active')
+    results['most_active'] = most_active[0]
+    results['queue_ok'] = (most_active[0] <= max_active
+                           and all(d.state == 'finished' and file_matches(d.path, small) for d in queued))
+
+    # The same file queued twice before either has written anything gets two names
+    twice = [manager.add(f'{server}/download/{small}', 'twice.bin') for n in range(2)]
+    for download in twice:
+        wait_for_download(download)
+    results['same_name_ok'] = (twice[0].path != twice[1].path
+                               and all(d.state == 'finished' and file_matches(d.path, small) for d in twice))
+
+    # Cancelled once all data is in but before the file is renamed: neither file is left
+    late = manager.add(f'{server}/download/{small}', 'late.bin')
+    cancel_when_writing = lambda: late.state == 'writing' and manager.cancel(late)
+    manager.listeners.append(cancel_when_writing)
+    wait_for_download(late)
+    manager.listeners.remove(cancel_when_writing)
+    wait(200)
+    results['cancel_while_writing_ok'] = (late.state == 'cancelled' and not os.path.exists(late.path)
+                                          and not os.path.exists(late.part_path))
+
+    # A failed download doesn't leave its .part file behind
+    broken = manager.add(f'{server}/download/{size}', 'broken.bin')
+    start = time.time()
+    while broken.received() == 0 and time.time() - start < 30:
+        wait(10)
+    manager.fail(broken, "stopped by the benchmark")
+    wait(200)
+    results['fail_removes_part'] = broken.state == 'failed' and not os.path.exists(broken.part_path)
+    manager.cancel(broken)
+
+    # A download started by a page goes through the profile to the manager and opens the panel
+    tab = window.add_new_tab(QUrl(f'{server}/page'), 'Downloads')
+    wait_until_loaded(tab.view, f'{server}/page')
+    count = len(manager.downloads)
+    tab.view.page().download(QUrl(f'{server}/download/{small}'))
+    start = time.time()
+    while len(manager.downloads) == count and time.time() - start < 10:
+        wait(10)
+    from_page = manager.downloads[-1] if len(manager.downloads) > count else None
+    if from_page is not None:
+        wait_for_download(from_page)
+    results['from_page_ok'] = (from_page is not None and from_page.state == 'finished'
+                               and os.path.basename(from_page.path) == f'file-{small}.bin'
+                               and file_matches(from_page.path, small))
+    dialog = window.downloads_dialog
+    results['panel_shown'] = dialog is not None and dialog.isVisible() and dialog.table.rowCount() == len(manager.downloads)
+    if dialog is not None:
+        dialog.hide()
+    window.close_tab(window.browser_tabs.indexOf(tab))
+
+    manager.clear_finished()
+    directory.cleanup()
+    results['ok'] = (results['single_connection_ok'] and results['segmented_ok'] and results['segments'] > 1
+                     and results['speedup'] > 1.5 and results['event_loop_max_gap_ms'] < max_gap_ms
+                     and results['pause_holds'] and results['resumed_ok']
+                     and results['cancel_removes_file'] and results['queue_ok'] and results['same_name_ok']
+                     and results['cancel_while_writing_ok'] and results['fail_removes_part']
+                     and results['from_page_ok'] and results['panel_shown'])
+    return results
+
+
+def synthetic_filters(count, seed=1):
+    # An EasyList sized list with its kinds of filters in about its proportions: ad and
+    # tracker hosts, path patterns with and without options, exceptions, element hiding and
+    # a few regular expressions. Returns the list and urls that some filter blocks.
+    rng = random.Random(seed)
+    lines = ['[Adblock Plus 2.0]', '! Title: Synthetic EasyList']
+    blocked = []
+    for n in range(count):
+        kind = rng.random()
+        word = rng.choice(['ad', 'ads', 'banner', 'track', 'pixel', 'promo', 'sponsor', 'beacon'])
+        if kind < 0.55:
+            host = f'{word}{n}.{rng.choice(["com", "net", "io"])}'
+            lines.append(f'||{host}^' + ('$third-party' if rng.random() < 0.4 else ''))
+            blocked.append(f'https://cdn.{host}/{word}.js')
+        elif kind < 0.75:
+            section = rng.choice(WORDS)
+            lines.append(f'/{word}{n}/{section}*.')
+            blocked.append(f'https://www.example.com/{word}{n}/{section}-x.gif?c={n}')
+        elif kind < 0.80:
+            lines.append(f'-{word}-{n}x90.$image')
+            blocked.append(f'https://img.example.org/s/top-{word}-{n}x90.png')
+        elif kind < 0.85:
+            lines.append(f'||site{n}.com/{word}/*$script,domain=news{n}.com|~sports.news{n}.com')
+        elif kind < 0.90:
+            lines.append(f'@@||cdn{n}.com/{word}{n}/')
+        elif kind < 0.997:
+            lines.append(f'##.{word}-{n}' if rng.random() < 0.5 else f'site{n}.com###{word}')
+        else:
+            lines.append(f'/\\/{word}[0-9]+x{n}\\./')
+    return '\n'.join(lines) + '\n', blocked
+
+
+def clean_urls(count, seed=2):
+    rng = random.Random(seed)
+    return [f'https://{rng.choice(WORDS)}{rng.randrange(1000)}.example/{rng.choice(WORDS)}/{rng.choice(WORDS)}'
+            f'?q={rng.choice(WORDS)}&page={rng.randrange(100)}' for n in range(count)]
+
+
+def content_blocking(window, rules=100000, requests=50000, max_match_us=50):
+    # The compiled filters of an EasyList sized list: compiling, loading them back from the
+    # cache, and how fast requests are matched. And a page whose ad and tracker requests
+    # never reach the server while its own image does.
+    text, blocked = synthetic_filters(rules)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'easylist.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        cache = os.path.join(directory, 'compiled')
+        start = time.perf_counter()
+        compiled = load_filter_lists([path], cache)
+        compile_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        engine = load_filter_lists([path], cache)
+        cached_ms = (time.perf_counter() - start) * 1000
+        cache_bytes = sum(os.path.getsize(os.path.join(cache, name)) for name in os.listdir(cache))
+
+    # What the cache gives back blocks the same as what was compiled
+    rng = random.Random(3)
+    hits = [rng.choice(blocked) for n in range(requests // 5)]
+    misses = clean_urls(requests - len(hits))
+    urls = hits + misses
+    rng.shuffle(urls)
+    page = 'https://www.example.net/article'
+    same = all(engine.match(url, page, 'image') == compiled.match(url, page, 'image') for url in urls[:2000])
+
+    # The first pass also makes the regular expressions of the filters it gets to
+    passes = []
+    for n in range(2):
+        samples = []
+        blocked_count = 0
+        start = time.perf_counter()
+        for url in urls:
+            t = time.perf_counter()
+            if engine.match(url, page, 'image') is not None:
+                blocked_count += 1
+            samples.append((time.perf_counter() - t) * 1e6)
+        passes.append((time.perf_counter() - start, distribution(samples)))
+    missed = sum(engine.match(url, page, 'image') is None for url in hits)
+    false_hits = sum(engine.match(url, page, 'image') is not None for url in misses)
+
+    cases = [
+        ('||ads.example^', 'https://ads.example/x.js', 'https://news.test/', 'script', True),
+        ('||ads.example^', 'https://ads.example.org/x.js', 'https://news.test/', 'script', False),
+        ('||tracker.example^$third-party', 'https://tracker.example/p', 'https://www.tracker.example/', 'image', False),
+        ('||tracker.example^$third-party', 'https://tracker.example/p', 'https://news.test/', 'image', True),
+        ('/banner/*/img^', 'https://news.test/banner/a/img/1.png', 'https://news.test/', 'image', True),
+        ('|https://exact.test/x.js|', 'https://exact.test/x.jsx', 'https://news.test/', 'script', False),
+        ('||cdn.test/ads.js$script,domain=news.test|~sports.news.test', 'https://cdn.test/ads.js',
+         'https://sports.news.test/', 'script', False),
+        ('||cdn.test/ads.js$script,domain=news.test', 'https://cdn.test/ads.js', 'https://news.test/', 'image', False),
+        ('||ads.example^\n@@||ads.example/allowed/', 'https://ads.example/allowed/x.js', 'https://news.test/',
+         'script', False),
+        ('||ads.example^\n@@||trusted.test^$document', 'https://ads.example/x.js', 'https://trusted.test/',
+         'script', False),
+        ('||page.test^', 'https://page.test/', '', 'document', False),
+    ]
+    wrong = []
+    for filters, url, page_url, resource_type, expected in cases:
+        case = FilterEngine()
+        case.add_list(filters)
+        if (case.match(url, page_url, resource_type) is not None) != expected:
+            wrong.append(filters.replace('\n', ' ') + ' ' + url)
+
+    # In the browser: the interceptor on the profile stops the page's ad and tracker requests
+    server = start_server()
+    blocker = QApplication.instance().content_blocker
+    previous = blocker.engine
+    blocker.engine = FilterEngine()
+    blocker.engine.add_list('/ads/banner-\n/ads/track-\n')
+    blocked_before = blocker.blocked
+    token = uuid.uuid4().hex
+    url = f'{server}/embed/{token}'
+    tab = window.add_new_tab(QUrl(url), 'Blocking')
+    wait_until_loaded(tab.view, url)
+    wait(200)
+    seen = [path for path in StandInHandler.requested if token in path]
+    page_blocked = blocker.blocked - blocked_before
+    window.close_tab(window.browser_tabs.indexOf(tab))
+    blocker.engine = previous
+    in_browser = (f'/content/photo-{token}.png' in seen and not any(path.startswith('/ads/') for path in seen)
+                  and page_blocked == 2)
+
+    return {
+        'rules': engine.rules,
+        'skipped': engine.skipped,
+        'compile_ms': round(compile_ms, 1),
+        'cached_load_ms': round(cached_ms, 1),
+        'cache_kb': round(cache_bytes / 1024),
+        'requests': len(urls),
+        'blocked': blocked_count,
+        'missed': missed,
+        'false_hits': false_hits,
+        'matches_per_s': round(len(urls) / passes[1][0]),
+        'first_pass_match_us': passes[0][1],
+        'match_us': passes[1][1],
+        'cache_matches_compiled': same,
+        'wrong_cases': wrong,
+        'requests_seen_by_server': len(seen),
+        'blocked_in_browser': page_blocked,
+        'ok': (not missed and not false_hits and same and not wrong and in_browser
+               and cached_ms < compile_ms and passes[1][1]['p95'] < max_match_us),
+    }
+
+
+def far_server():
+    # A new server is a new origin, so nothing is connected to it yet; named localhost so
+    # it is another site than the 127.0.0.1 pages navigated from
+    return start_server(HandshakeHandler).replace('127.0.0.1', 'localhost')
+
+
+def timed_navigation(window, url, navigate):
+    start = time.perf_counter()
+    navigate()
+    wait_until_loaded(window.current_browser(), url)
+    return (time.perf_counter() - start) * 1000
+
+
+def speculation(window, trials=6, key_delay_ms=40, pause_ms=500, max_hosts=4):
+    # Typing an address, picking a suggestion and following a hovered link, each onto a site
+    # that takes HandshakeHandler.handshake_delay to connect to, going there pause_ms after
+    # the last key or mouse move: with DNS prefetch off and on. Every navigation should go
+    # to a prefetched host, the lookup requests carry no cookie, referrer or origin (the
+    # sites have a cookie), no more than max_hosts hosts are prefetched at once, and
+    # navigations to prefetched hosts get their first byte sooner than the others.
+    speculator = window.speculator
+    enabled, limit = speculator.enabled, speculator.max_hosts
+    speculator.max_hosts = max_hosts
+    start_page = f'{start_server()}/speculation'
+    tab = window.add_new_tab(QUrl(start_page), 'Speculation')
+    view = tab.view
+    wait_until_loaded(view, start_page)
+    hits_before = speculator.hits
+    HandshakeHandler.heads.clear()
+    cookie = QNetworkCookie(b'speculation', b'1')
+    cookie.setDomain('localhost')
+    window.profiles.profile.cookieStore().setCookie(cookie, QUrl('http://localhost'))
+
+    def typed(url):
+        window.url_bar.setFocus()
+        window.url_bar.clear()
+        QTest.keyClicks(window.url_bar, url, delay=key_delay_ms)
+        wait(pause_ms)
+        return timed_navigation(window, url, window.navigate_to_url)
+
+    def suggested(url):
+        # Only the history knows the address, what is typed is too short to be one
+        best = window.omnibox_index.query('local', 1)
+        window.omnibox_index.add(url, 'Speculation', points=(best[0][2] if best else 0) + 1000)
+        window.url_bar.setFocus()
+        window.url_bar.clear()
+        QTest.keyClicks(window.url_bar, 'local', delay=key_delay_ms)
+        wait(pause_ms)
+        return timed_navigation(window, url, lambda: window.open_suggestion(url))
+
+    def hovered(url):
+        run_js(view, f"document.body.innerHTML = `<a href='{url}' style='display: block; height: 100vh'>link</a>`")
+        target = view.focusProxy()
+        QTest.mouseMove(target, QPoint(5, 5))
+        wait(50)
+        QTest.mouseMove(target, QPoint(20, 20))
+        wait(pause_ms)
+        return timed_navigation(window, url, lambda: QTest.mouseClick(target, Qt.LeftButton, pos=QPoint(20, 20)))
+
+    results = {}
+    for name, navigate in (('typed', typed), ('suggested', suggested), ('hovered', hovered)):
+        times = {False: [], True: []}
+        for n in range(trials):
+            for on in (False, True):
+                speculator.enabled = on
+                times[on].append(navigate(f'{far_server()}/{name}-{n}'))
+                # The suggestions popup would take the mouse
+                window.omnibox.completer.popup().hide()
+                view.setUrl(QUrl(start_page))
+                wait_until_loaded(view, start_page)
+        results[name] = {'cold_ms': distribution(times[False]), 'prefetched_ms': distribution(times[True])}
+    hits = speculator.hits - hits_before
+    private = bool(HandshakeHandler.heads) and all(head['private'] for head in HandshakeHandler.heads)
+
+    # Hints for more hosts than allowed only look up max_hosts of them
+    speculator.enabled = True
+    HandshakeHandler.heads.clear()
+    speculator.prefetched.clear()
+    limited = speculator.limited
+    speculator.hint([f'{far_server()}/bound' for n in range(max_hosts * 3)])
+    wait(speculator.debounce.interval() + 500)
+    bounded = len(speculator.prefetched) == max_hosts and len(HandshakeHandler.heads) == max_hosts
+    skipped = speculator.limited - limited
+
+    stats = speculator.stats()
+    speculator.enabled, speculator.max_hosts = enabled, limit
+    speculator.prefetched.clear()
+    window.profiles.profile.cookieStore().deleteCookie(cookie, QUrl('http://localhost'))
+    window.close_tab(window.browser_tabs.indexOf(tab))
+    saved = {name: round(result['cold_ms']['p50'] - result['prefetched_ms']['p50'], 1) for name, result in results.items()}
+    prefetched_p50, cold_p50 = stats['prefetched_response_start_p50'], stats['cold_response_start_p50']
+    sooner = prefetched_p50 is not None and cold_p50 is not None and prefetched_p50 < cold_p50
+    return dict(results, **{
+        'handshake_ms': HandshakeHandler.handshake_delay * 1000,
+        'saved_p50_ms': saved,
+        'hits': hits,
+        'speculative_hosts': len(HandshakeHandler.heads),
+        'skipped_at_limit': skipped,
+        'lookups_private': private,
+        'prefetched_first_byte_sooner': sooner,
+        'stats': stats,
+        'ok': hits == trials * len(results) and private and bounded and skipped == max_hosts * 2 and sooner,
+    })
+
+
+def prerender(window, trials=5, key_delay_ms=40, pause_ms=1000, timeout=5):
+    # Going to a slow page (StandInHandler.slow_delay) that is the only suggestion for what
+    # is typed, from the url bar and by clicking a link to it, with prerendering off and on:
+    # a prerendered page should be there in a fraction of that delay, and going back still
+    # works. Then the limits: a prediction for another page replaces the prerender, a
+    # navigation elsewhere and a renderer over the memory cap drop it. Navigations happen
+    # pause_ms after the last key, time enough for the prerender to load.
+    prerenderer = window.prerenderer
+    enabled, max_bytes = prerenderer.enabled, prerenderer.max_bytes
+    server = start_server()
+    start_page = f'{server}/prerender'
+    tab = window.add_new_tab(QUrl(start_page), 'Prerender')
+    wait_until_loaded(tab.view, start_page)
+    hits_before, wasted_before = prerenderer.hits, prerenderer.wasted
+
+    def typed(url):
+        window.url_bar.setFocus()
+        window.url_bar.clear()
+        QTest.keyClicks(window.url_bar, url.split('://', 1)[1], delay=key_delay_ms)
+        wait(pause_ms)
+        window.omnibox.completer.popup().hide()
+        window.url_bar.setText(url)
+        return timed_navigation(window, url, window.navigate_to_url)
+
+    def clicked(url):
+        view = window.current_browser()
+        run_js(view, f"document.body.innerHTML = `<a href='{url}' style='display: block; height: 100vh'>link</a>`")
+        window.url_bar.setFocus()
+        window.url_bar.clear()
+        QTest.keyClicks(window.url_bar, url.split('://', 1)[1], delay=key_delay_ms)
+        wait(pause_ms)
+        window.omnibox.completer.popup().hide()
+        target = view.focusProxy()
+        return timed_navigation(window, url, lambda: QTest.mouseClick(target, Qt.LeftButton, pos=QPoint(20, 20)))
+
+    results = {}
+    went_back = 0
+    for name, navigate in (('typed', typed), ('clicked', clicked)):
+        times = {False: [], True: []}
+        for n in range(trials):
+            for on in (False, True):
+                prerenderer.enabled = on
+                url = f'{server}/slow/{name}-{int(on)}-{n}'
+                window.omnibox_index.add(url, 'Prerender', points=1000)
+                times[on].append(navigate(url))
+                window.go_back()
+                wait_until_loaded(window.current_browser(), start_page, timeout)
+                went_back += window.current_browser().url().toString() == start_page
+        results[name] = {'cold_ms': distribution(times[False]), 'prerendered_ms': distribution(times[True])}
+    hits = prerenderer.hits - hits_before
+    clean = prerenderer.wasted == wasted_before
+
+    prerenderer.enabled = True
+    wasted = prerenderer.wasted
+    prerenderer.prerender(QUrl(f'{server}/limits/a'))
+    prerenderer.prerender(QUrl(f'{server}/limits/b'))
+    replaced = prerenderer.wasted - wasted == 1 and prerenderer.url == QUrl(f'{server}/limits/b')
+    window.url_bar.setText(f'{server}/limits/c')
+    window.navigate_to_url()
+    wait_until_loaded(window.current_browser(), f'{server}/limits/c', timeout)
+    cancelled = prerenderer.wasted - wasted == 2 and prerenderer.view is None
+
+    prerenderer.max_bytes = 1024 * 1024
+    over_memory = prerenderer.over_memory
+    prerenderer.prerender(QUrl(f'{server}/limits/d'))
+    start = time.time()
+    while prerenderer.view is not None and time.time() - start < timeout:
+        wait(10)
+    capped = prerenderer.over_memory - over_memory == 1
+
+    stats = prerenderer.stats()
+    prerenderer.enabled, prerenderer.max_bytes = enabled, max_bytes
+    prerenderer.clear()
+    window.close_tab(window.browser_tabs.indexOf(tab))
+    saved = {name: round(result['cold_ms']['p50'] - result['prerendered_ms']['p50'], 1)
+             for name, result in results.items()}
+    return dict(results, **{
+        'page_delay_ms': StandInHandler.slow_delay * 1000,
+        'saved_p50_ms': saved,
+        'hits': hits,
+        'went_back': went_back,
+        'replaced_by_new_prediction': replaced,
+        'cancelled_on_mismatch': cancelled,
+        'dropped_over_memory': capped,
+        'stats': stats,
+        'ok': (hits == trials * len(results) and clean and went_back == trials * len(results) * 2 and replaced
+               and cancelled and capped and all(value > StandInHandler.slow_delay * 500 for value in saved.values())),
+    })
+
+
+def back_forward(window, pages=6, trials=3, timeout=10):
+    # Back and forward through heavy pages (StandInHandler.heavy_ms of script before they
+    # show anything) with snapshots off and on: with them every step finds the page's
+    # snapshot and has it on screen at once. Then the bounds: a tab keeps no more than
+    # `entries` snapshots, nor more than max_mb of them.
+    cache = window.back_forward
+    enabled, entries, max_bytes = cache.enabled, cache.entries, cache.max_bytes
+    cache.enabled = True
+    server = start_server()
+    tab = window.add_new_tab(QUrl(f'{server}/heavy/0'), 'Back/Forward')
+    wait_until_loaded(tab.view, f'{server}/heavy/0', timeout)
+    for n in range(1, pages):
+        tab.view.setUrl(QUrl(f'{server}/heavy/{n}'))
+        wait_until_loaded(tab.view, f'{server}/heavy/{n}', timeout)
+
+    results = {}
+    landed = 0
+    steps = trials * 2 * (pages - 1)
+    for on in (False, True):
+        cache.enabled = on
+        hits, shown = cache.hits, len(cache.placeholder_ms)
+        restore_ms = []
+        for trial in range(trials):
+            for offset, step in ((-1, window.go_back), (1, window.go_forward)):
+                for n in range(pages - 1):
+                    history = tab.view.history()
+                    url = history.itemAt(history.currentItemIndex() + offset).url().toString()
+                    restore_ms.append(timed_navigation(window, url, step))
+                    landed += tab.view.url().toString() == url
+        results['snapshots' if on else 'engine_only'] = {
+            'restore_ms': distribution(restore_ms),
+            'hits': cache.hits - hits,
+            'placeholder_ms': distribution(list(cache.placeholder_ms)[shown:]) if on else None,
+        }
+
+    # Another round of pages with room for fewer snapshots than that
+    cache.enabled = True
+    cache.entries = 3
+    for n in range(pages, pages * 2):
+        tab.view.setUrl(QUrl(f'{server}/heavy/{n}'))
+        wait_until_loaded(tab.view, f'{server}/heavy/{n}', timeout)
+    within_entries = len(tab.snapshots) <= 3
+    one = next(iter(tab.snapshots.values()))['bytes'] if tab.snapshots else 0
+    cache.entries = entries
+    cache.max_bytes = one * 2
+    tab.view.setUrl(QUrl(f'{server}/heavy/last'))
+    wait_until_loaded(tab.view, f'{server}/heavy/last', timeout)
+    within_memory = sum(snapshot['bytes'] for snapshot in tab.snapshots.values()) <= one * 2
+
+    stats = cache.stats([tab])
+    cache.enabled, cache.max_bytes = enabled, max_bytes
+    window.close_tab(window.browser_tabs.indexOf(tab))
+    return dict(results, **{
+        'heavy_ms': StandInHandler.heavy_ms,
+        'snapshot_mb': round(one / 1048576, 2),
+        'within_entries': within_entries,
+        'within_memory': within_memory,
+        'stats': stats,
+        'ok': (landed == steps * 2 and results['snapshots']['hits'] == steps
+               and results['snapshots']['placeholder_ms']['p95'] < StandInHandler.heavy_ms / 10
+               and within_entries and within_memory and one > 0),
+    })
+
+
+def wait_for_paint(view, since, timeout=5):
+    # Milliseconds from `since` (time.time()) to the page's first contentful paint
+    start = time.time()
+    while time.time() - start < timeout:
+        painted_at = run_js(view, FIRST_PAINT_JS)
+        if painted_at:
+            return max(0, painted_at - since * 1000)
+        wait(5)
+    return None
+
+
+def tab_operations(window, tabs=20, switches=100, navigations=10, theme_rounds=3):
+    # The everyday operations against the stand-in server: opening tabs, switching between
+    # them, navigating from the url bar, switching themes and closing tabs, with what the
+    # open tabs cost in memory
+    server = start_server()
+    memory_before = window_memory()
+
+    start = time.perf_counter()
+    opened = [window.add_new_tab(QUrl(f'{server}/tab/{n}'), 'Tab') for n in range(tabs)]
+    open_ms = (time.perf_counter() - start) * 1000
+    for n, tab in enumerate(opened):
+        if tab.is_materialized():
+            wait_until_loaded(tab.view, f'{server}/tab/{n}')
+    loaded_ms = (time.perf_counter() - start) * 1000
+
+    # Between tabs that still have their view, switching to a discarded one is a page load
+    live = [tab for tab in opened if tab.is_materialized()]
+    switch_ms = []
+    for n in range(switches):
+        start = time.perf_counter()
+        window.browser_tabs.setCurrentWidget(live[n % len(live)])
+        QApplication.processEvents()
+        window.repaint()
+        switch_ms.append((time.perf_counter() - start) * 1000)
+
+    navigate_ms = []
+    for n in range(navigations):
+        url = f'{server}/navigate/{n}'
+        window.url_bar.setText(url)
+        start = time.time()
+        window.navigate_to_url()
+        view = window.browser_tabs.currentWidget().view
+        wait_until_loaded(view, url)
+        painted = wait_for_paint(view, start)
+        if painted is not None:
+            navigate_ms.append(painted)
+
+    theme_ms = []
+    for n in range(theme_rounds):
+        for name in window.themes.names():
+            start = time.perf_counter()
+            window.set_theme(name)
+            QApplication.processEvents()
+            window.repaint()
+            theme_ms.append((time.perf_counter() - start) * 1000)
+    window.set_theme(setting('appearance/theme'))
+
+    wait(1000)
+    memory_open = window_memory()
+
+    close_ms = []
+    for tab in opened:
+        start = time.perf_counter()
+        window.close_tab(window.browser_tabs.indexOf(tab))
+        QApplication.processEvents()
+        close_ms.append((time.perf_counter() - start) * 1000)
+    wait(1000)
+    memory_closed = window_memory()
+
+    return {
+        'tabs': tabs,
+        'open_tabs_ms': round(open_ms, 1),
+        'open_until_loaded_ms': round(loaded_ms, 1),
+        'switch_ms': distribution(switch_ms),
+        'navigate_to_paint_ms': distribution(navigate_ms) if navigate_ms else None,
+        'theme_switch_ms': distribution(theme_ms),
+        'close_ms': distribution(close_ms),
+        'rss_growth_mb': round((memory_open - memory_before) / 1048576, 1),
+        'rss_after_close_mb': round((memory_closed - memory_before) / 1048576, 1),
+        'ok': len(navigate_ms) == navigations,
+    }
+
+
+SCENARIOS = {
+    'tab-operations': tab_operations,
+    'tab-churn': tab_churn,
+    'session-restore': session_restore,
+    'new-tab': new_tab,
+    'incognito': incognito,
+    'history': history,
+    'omnibox': omnibox,
+    'bookmarks': bookmarks,
+    'favicons': favicons,
+    'startup': startup,
+    'themes': themes,
+    'task-manager': task_manager,
+    'lifecycle': lifecycle,
+    'windows': windows,
+    'automation': automation,
+    'telemetry': telemetry,
+    'downloads': downloads,
+    'content-blocking': content_blocking,
+    'speculation': speculation,
+    'prerender': prerender,
+    'back-forward': back_forward,
+}
+
+
+def measurements(results, path=()):
+    # Every timing and memory figure in the results, lower is better for all of them
+    for key, value in results.items():
+        name = path + (key,)
+        if isinstance(value, dict):
+            yield from measurements(value, name)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                any(part.endswith(('_ms', '_mb')) for part in name):
+            yield '.'.join(name), value
+
+
+def compare(results, baseline, tolerance, min_delta):
+    # Figures that got worse than the baseline by more than tolerance (a fraction) and by
+    # more than min_delta (ms or MB), so noise on tiny numbers isn't reported
+    before = dict(measurements(baseline))
+    regressions = []
+    for name, value in measurements(results):
+        old = before.get(name)
+        if old is None:
+            continue
+        if value - old > min_delta and value > old * (1 + tolerance):
+            regressions.append({'measurement': name, 'baseline': old, 'current': value,
+                                'change_percent': round(100 * (value - old) / old, 1) if old else None})
+    return regressions
+
+
+def environment():
+    return {
+        'python': sys.version.split()[0],
+        'qt': QT_VERSION_STR,
+        'pyqt': PYQT_VERSION_STR,
+        'cpus': os.cpu_count(),
+        'platform': os.environ.get('QT_QPA_PLATFORM'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cwanda checks and benchmarks, run offscreen")
+    parser.add_argument('scenarios', nargs='*', help="scenarios to run, all by default: " + ", ".join(SCENARIOS))
+    parser.add_argument('--output', help="also write the results to this JSON file, e.g. to keep as a baseline")
+    parser.add_argument('--baseline', help="results of an earlier run to compare against, regressions fail the run")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="how much slower or bigger than the baseline counts as a regression (default 0.25)")
+    parser.add_argument('--min-delta', type=float, default=2.0,
+                        help="differences below this many ms or MB are never regressions (default 2)")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenario: " + ", ".join(unknown))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    # Every run starts from an empty profile, session, history and settings, away from the
+    # real ones, so runs can be compared with each other
+    data = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+    for variable in ('XDG_DATA_HOME', 'XDG_CONFIG_HOME', 'XDG_CACHE_HOME'):
+        os.environ[variable] = os.path.join(data.name, variable.lower())
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = CwandaApplication(sys.argv[:1])
+
+    window = Browser()
+    window.show()
+    wait(1000)
+
+    results = {name: SCENARIOS[name](window) for name in args.scenarios or SCENARIOS}
+    report = {'environment': environment(), 'results': results}
+    if baseline is not None:
+        report['regressions'] = compare(results, baseline, args.tolerance, args.min_delta)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    close_window(window)
+    data.cleanup()
+    passed = all(result['ok'] for result in results.values()) and not report.get('regressions')
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+import json
+import os
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+from PyQt5.QtCore import Qt, QUrl
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QTreeWidget,
+                             QTreeWidgetItem, QInputDialog)
+
+
+BOOKMARKS_BAR = "Bookmarks bar"
+
+# What the start page showed before bookmarks were stored
+DEFAULT_BOOKMARKS = [("https://www.youtube.com/", "YouTube")]
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    # The same page spelled differently (host case, default port, trailing slash,
+    # fragment) has to hit the same index entry
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((scheme, host, path, parts.query, ''))
+
+
+class BookmarkStore:
+    # Bookmarks in folders, each folder in its own file with one compact JSON line per
+    # bookmark. Adding a bookmark appends a line; removing or editing one rewrites only
+    # the folder it is in. Nothing is read until first use, after which a hash index on
+    # the normalized url answers "is this bookmarked" without looking at the folders.
+    def __init__(self, directory, on_change=None):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'folders.json')
+        self.on_change = on_change
+
+        self.loaded = False
+        self.folders = {}
+        self.folder_ids = {}
+        self.next_id = 1
+        self.index = {}
+        self.dirty = set()
+
+    def folder_path(self, name):
+        return os.path.join(self.directory, f"folder-{self.folder_ids[name]}.jsonl")
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.manifest_path):
+            self.add_folder(BOOKMARKS_BAR)
+            for url, title in DEFAULT_BOOKMARKS:
+                self.add(url, title)
+            return
+
+        with open(self.manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.next_id = manifest['next_id']
+        for folder_id, name in manifest['folders']:
+            self.folder_ids[name] = folder_id
+            self.folders[name] = []
+            path = self.folder_path(name)
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = None
+                    # A torn append or a damaged line, the folder gets rewritten without it
+                    if not (isinstance(entry, list) and len(entry) == 4 and isinstance(entry[0], str)):
+                        self.dirty.add(name)
+                        continue
+                    url, title, tags, added = entry
+                    self.insert(name, {'url': url, 'title': title, 'tags': tags, 'added': added})
+        self.flush()
+
+    def save_manifest(self):
+        manifest = {'next_id': self.next_id,
+                    'folders': [[self.folder_ids[name], name] for name in self.folders]}
+        self.write_file(self.manifest_path, json.dumps(manifest))
+
+    def write_file(self, path, text):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def insert(self, folder, bookmark):
+        self.folders[folder].append(bookmark)
+        self.index.setdefault(normalize_url(bookmark['url']), []).append((folder, bookmark))
+        self.changed('add', bookmark['url'])
+
+    def unindex(self, bookmark):
+        key = normalize_url(bookmark['url'])
+        entries = [entry for entry in self.index.get(key, []) if entry[1] is not bookmark]
+        if entries:
+            self.index[key] = entries
+        else:
+            self.index.pop(key, None)
+        self.changed('remove', bookmark['url'])
+
+    def changed(self, *args):
+        if self.on_change is not None:
+            self.on_change(*args)
+
+    def add_folder(self, name):
+        self.load()
+        if name not in self.folders:
+            self.folder_ids[name] = self.next_id
+            self.next_id += 1
+            self.folders[name] = []
+            self.save_manifest()
+        return name
+
+    def remove_folder(self, name):
+        self.load()
+        if name not in self.folders:
+            return
+        for bookmark in self.folders.pop(name):
+            self.unindex(bookmark)
+        self.dirty.discard(name)
+        self.save_manifest()
+        path = os.path.join(self.directory, f"folder-{self.folder_ids.pop(name)}.jsonl")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def add(self, url, title='', folder=BOOKMARKS_BAR, tags=()):
+        self.load()
+        self.add_folder(folder)
+        bookmark = {'url': url, 'title': title, 'tags': sorted(set(tags)), 'added': time.time()}
+        self.insert(folder, bookmark)
+        with open(self.folder_path(folder), 'a', encoding='utf-8') as f:
+            f.write(json.dumps([url, title, bookmark['tags'], bookmark['added']]) + '\n')
+        return bookmark
+
+    def remove(self, url, folder=None):
+        # Removes the url from one folder, or from every folder it is in
+        self.load()
+        for name, bookmark in list(self.index.get(normalize_url(url), [])):
+            if folder is None or name == folder:
+                self.folders[name] = [other for other in self.folders[name] if other is not bookmark]
+                self.unindex(bookmark)
+                self.dirty.add(name)
+        self.flush()
+
+    def set_tags(self, bookmark, folder, tags):
+        self.load()
+        bookmark['tags'] = sorted(set(tags))
+        self.dirty.add(folder)
+        self.flush()
+
+    def set_title(self, bookmark, folder, title):
+        self.load()
+        bookmark['title'] = title
+        self.dirty.add(folder)
+        self.flush()
+
+    def contains(self, url):
+        self.load()
+        return normalize_url(url) in self.index
+
+    def find(self, url):
+        self.load()
+        return self.index.get(normalize_url(url), [])
+
+    def folder(self, name=BOOKMARKS_BAR):
+        self.load()
+        return list(self.folders.get(name, []))
+
+    def folder_names(self):
+        self.load()
+        return list(self.folders)
+
+    def tagged(self, tag):
+        self.load()
+        return [(name, bookmark) for name, bookmarks in self.folders.items()
+                for bookmark in bookmarks if tag in bookmark['tags']]
+
+    def tiles_json(self):
+        # The start page's tiles, fetched from cwanda://newtab/bookmarks.json
+        return json.dumps([{'url': bookmark['url'], 'title': bookmark['title']}
+                           for bookmark in self.folder(BOOKMARKS_BAR)]).encode()
+
+    def flush(self):
+        for name in self.dirty:
+            if name in self.folders:
+                lines = [json.dumps([b['url'], b['title'], b['tags'], b['added']]) + '\n'
+                         for b in self.folders[name]]
+                self.write_file(self.folder_path(name), ''.join(lines))
+        self.dirty.clear()
+
+
+class BookmarksDialog(QDialog):
+    def __init__(self, bookmarks, open_url, icon_for=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Bookmarks")
+        self.resize(700, 500)
+        self.bookmarks = bookmarks
+        self.open_url = open_url
+        self.icon_for = icon_for
+
+        layout = QVBoxLayout(self)
+        self.search_bar = QLineEdit()
+        self.search_bar.setPlaceholderText("Filter by title, url or tag")
+        self.search_bar.textChanged.connect(self.refresh)
+        layout.addWidget(self.search_bar)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["Title", "Url", "Tags"])
+        self.tree.itemActivated.connect(self.item_activated)
+        layout.addWidget(self.tree)
+
+        buttons = QHBoxLayout()
+        for label, action in (("New Folder", self.new_folder), ("Edit Tags", self.edit_tags),
+                              ("Delete", self.delete_selected)):
+            button = QPushButton(label)
+            button.clicked.connect(action)
+            buttons.addWidget(button)
+        layout.addLayout(buttons)
+
+        self.refresh()
+
+    def refresh(self):
+        text = self.search_bar.text().lower()
+        self.tree.clear()
+        for name in self.bookmarks.folder_names():
+            folder_item = QTreeWidgetItem([name])
+            folder_item.setData(0, Qt.UserRole, (name, None))
+            for bookmark in self.bookmarks.folder(name):
+                fields = ' '.join([bookmark['title'], bookmark['url']] + bookmark['tags']).lower()
+                if text and text not in fields:
+                    continue
+                item = QTreeWidgetItem([bookmark['title'] or bookmark['url'], bookmark['url'],
+                                        ', '.join(bookmark['tags'])])
+                item.setData(0, Qt.UserRole, (name, bookmark))
+                if self.icon_for is not None:
+                    item.setIcon(0, self.icon_for(bookmark['url']))
+                folder_item.addChild(item)
+            self.tree.addTopLevelItem(folder_item)
+            folder_item.setExpanded(True)
+
+    def selected(self):
+        item = self.tree.currentItem()
+        return item.data(0, Qt.UserRole) if item is not None else (None, None)
+
+    def item_activated(self, item):
+        folder, bookmark = item.data(0, Qt.UserRole)
+        if bookmark is not None:
+            self.open_url(QUrl(bookmark['url']))
+
+    def new_folder(self):
+        name, ok = QInputDialog.getText(self, "New Folder", "Folder name:")
+        if ok and name.strip():
+            self.bookmarks.add_folder(name.strip())
+            self.refresh()
+
+    def edit_tags(self):
+        folder, bookmark = self.selected()
+        if bookmark is None:
+            return
+        text, ok = QInputDialog.getText(self, "Edit Tags", "Tags, separated by commas:",
+                                        text=', '.join(bookmark['tags']))
+        if ok:
+            self.bookmarks.set_tags(bookmark, folder, [tag.strip() for tag in text.split(',') if tag.strip()])
+            self.refresh()
+
+    def delete_selected(self):
+        folder, bookmark = self.selected()
+        if bookmark is not None:
+            self.bookmarks.remove(bookmark['url'], folder)
+        elif folder is not None and folder != BOOKMARKS_BAR:
+            self.bookmarks.remove_folder(folder)
+        self.refresh()
@@ -0,0 +1,71 @@
+import os
+
+from PyQt5.QtCore import QSettings, QStandardPaths
+
+
+# Default values for everything that can be tuned in the Cwanda settings file
+DEFAULTS = {
+    # Background tab discarding
+    'tabs/max_live_tabs': 12,
+    'tabs/memory_budget_mb': 2048,
+    # Background tabs are frozen and later discarded after this many seconds hidden, 0 never does
+    'lifecycle/freeze_after_s': 60,
+    'lifecycle/discard_after_s': 1800,
+    # Prewarmed new tab views
+    'pool/size': 2,
+    # Shared profile, an empty cache path means the default location in the data directory
+    'cache/path': '',
+    'cache/size_mb': 256,
+    # Url bar suggestions
+    'omnibox/debounce_ms': 30,
+    'omnibox/max_entries': 500000,
+    # Decoded favicons kept in memory, the rest are read from disk when needed
+    'favicons/memory_icons': 256,
+    # Window theme, one of the names in themes.THEMES
+    'appearance/theme': 'light',
+    # Task manager sampling
+    'taskmanager/interval_ms': 2000,
+    'taskmanager/samples': 10000,
+    # Page load timings kept for the overlay and export
+    'telemetry/records': 5000,
+    # Downloads, an empty directory means the system's download folder. Files of at least two
+    # segments' size are fetched in that many parallel ranges when the server allows it.
+    'downloads/directory': '',
+    'downloads/max_active': 3,
+    'downloads/segments': 4,
+    'downloads/segment_min_mb': 4,
+    # Requests matching the EasyList style filter lists (*.txt) in the filters data directory are blocked
+    'blocking/enabled': True,
+    # DNS prefetch: hosts looked up ahead for what is typed, the top suggestions and hovered
+    # links, at most max_hosts at a time; unused ones are dropped after ttl_s
+    'speculate/enabled': True,
+    'speculate/max_hosts': 4,
+    'speculate/ttl_s': 10,
+    'speculate/debounce_ms': 100,
+    'speculate/suggestions': 2,
+    # The top url bar suggestion is loaded ahead in a hidden view when its share of the
+    # suggestions' score is at least min_confidence; dropped over max_mb or unused after ttl_s
+    'prerender/enabled': False,
+    'prerender/min_confidence': 0.6,
+    'prerender/max_mb': 300,
+    'prerender/ttl_s': 30,
+    'prerender/debounce_ms': 300,
+    # Pictures of the pages each tab left, shown at once on back/forward while the page
+    # restores: at most `entries` per tab within max_mb, scaled down by `scale`
+    'backforward/enabled': True,
+    'backforward/entries': 8,
+    'backforward/max_mb': 16,
+    'backforward/scale': 0.5,
+}
+
+
+def setting(key):
+    default = DEFAULTS[key]
+    return QSettings().value(key, default, type=type(default))
+
+
+def data_path(*parts):
+    # Directory for Cwanda's own files (session, history, caches), created on first use
+    path = os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
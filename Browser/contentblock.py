@@ -0,0 +1,454 @@
+import glob
+import hashlib
+import marshal
+import os
+import re
+import time
+from collections import deque
+
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInfo, QWebEngineUrlRequestInterceptor
+
+
+# Bumped whenever the compiled form changes, older caches are then compiled again
+FORMAT = 1
+
+TYPES = ['script', 'image', 'stylesheet', 'object', 'xmlhttprequest', 'subdocument', 'ping', 'media',
+         'font', 'websocket', 'other', 'document']
+TYPE_BITS = {name: 1 << n for n, name in enumerate(TYPES)}
+TYPE_ALIASES = {'xhr': 'xmlhttprequest', 'css': 'stylesheet', 'frame': 'subdocument'}
+# Like Adblock Plus, filters without a type option don't block whole pages
+DEFAULT_TYPES = sum(TYPE_BITS.values()) & ~TYPE_BITS['document']
+
+# Options that change nothing for a request blocker
+IGNORED_OPTIONS = {'important', 'collapse', '~collapse'}
+
+RESOURCE_TYPES = {
+    QWebEngineUrlRequestInfo.ResourceTypeMainFrame: 'document',
+    QWebEngineUrlRequestInfo.ResourceTypeSubFrame: 'subdocument',
+    QWebEngineUrlRequestInfo.ResourceTypeStylesheet: 'stylesheet',
+    QWebEngineUrlRequestInfo.ResourceTypeScript: 'script',
+    QWebEngineUrlRequestInfo.ResourceTypeImage: 'image',
+    QWebEngineUrlRequestInfo.ResourceTypeFontResource: 'font',
+    QWebEngineUrlRequestInfo.ResourceTypeObject: 'object',
+    QWebEngineUrlRequestInfo.ResourceTypeMedia: 'media',
+    QWebEngineUrlRequestInfo.ResourceTypeFavicon: 'image',
+    QWebEngineUrlRequestInfo.ResourceTypeXhr: 'xmlhttprequest',
+    QWebEngineUrlRequestInfo.ResourceTypePing: 'ping',
+    QWebEngineUrlRequestInfo.ResourceTypePluginResource: 'object',
+    QWebEngineUrlRequestInfo.ResourceTypeWorker: 'script',
+    QWebEngineUrlRequestInfo.ResourceTypeSharedWorker: 'script',
+    QWebEngineUrlRequestInfo.ResourceTypeServiceWorker: 'script',
+}
+
+TOKEN = re.compile(r'[a-z0-9%]+')
+HOST = re.compile(r'[a-z][a-z0-9+.-]*://(?:[^/?#@]*@)?([^/?#:]*)')
+HOST_RULE = re.compile(r'\|\|([a-z0-9.-]+)\^')
+SEPARATOR = r'(?:[^\w.%-]|$)'
+HOST_ANCHOR = r'^[a-z][a-z0-9+.-]*://(?:[^/?#]*\.)?'
+# Second level labels under which sites register their own names, a stand-in for the
+# public suffix list when telling first and third parties apart
+SHARED_LABELS = {'co', 'com', 'net', 'org', 'gov', 'edu', 'ac', 'ne', 'or', 'go'}
+
+# A filter: (text, match case, type bits, third party, domains, excluded domains), the
+# domain sets None when empty. Its regular expression is made from the text when needed.
+TEXT, MATCH_CASE, TYPE_MASK, THIRD_PARTY, DOMAINS, NOT_DOMAINS = range(6)
+
+
+def host_of(url):
+    # url lower case; the host without port or user
+    match = HOST.match(url)
+    return match.group(1) if match is not None else ''
+
+
+def site_of(host):
+    labels = host.split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SHARED_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def suffixes(host):
+    # 'a.b.com' -> 'a.b.com', 'b.com', 'com'
+    while host:
+        yield host
+        host = host.partition('.')[2]
+
+
+def split_filter(line):
+    # '@@pattern$options' -> (exception, pattern, options)
+    exception = line.startswith('@@')
+    if exception:
+        line = line[2:]
+    pattern, dollar, options = line.rpartition('$') if '$' in line else (line, '', '')
+    # A $ inside a regular expression isn't the start of the options
+    if dollar and pattern.startswith('/') and not pattern.endswith('/'):
+        pattern, options = line, ''
+    return exception, pattern, options
+
+
+def is_regex(pattern):
+    return len(pattern) > 2 and pattern.startswith('/') and pattern.endswith('/')
+
+
+def filter_source(text, match_case):
+    pattern = split_filter(text)[1]
+    if is_regex(pattern):
+        return pattern[1:-1]
+    return pattern_source(pattern if match_case else pattern.lower())
+
+
+def pattern_source(pattern):
+    # Adblock Plus wildcard pattern to a regular expression
+    start = end = ''
+    if pattern.startswith('||'):
+        start, pattern = HOST_ANCHOR, pattern[2:]
+    elif pattern.startswith('|'):
+        start, pattern = '^', pattern[1:]
+    if pattern.endswith('|'):
+        end, pattern = '$', pattern[:-1]
+    body = ''.join('.*' if c == '*' else SEPARATOR if c == '^' else re.escape(c) for c in pattern)
+    return start + body + end
+
+
+def pattern_tokens(pattern):
+    # Tokens of the pattern that are whole tokens of every url it matches: not next to a
+    # wildcard, nor at an unanchored end where the url's token could go on
+    tokens = []
+    anchored_start = pattern.startswith('|')
+    anchored_end = pattern.endswith('|')
+    pattern = pattern.strip('|')
+    for match in TOKEN.finditer(pattern):
+        before = pattern[match.start() - 1] if match.start() else ('|' if anchored_start else '*')
+        after = pattern[match.end()] if match.end() < len(pattern) else ('|' if anchored_end else '*')
+        if before != '*' and after != '*' and len(match.group()) > 1:
+            tokens.append(match.group())
+    return tokens
+
+
+def regex_literals(source):
+    # Runs of characters every match of the regular expression contains, [] when it has
+    # alternatives at the top. Groups and classes end a run, so do optional characters.
+    runs = [[]]
+    depth = 0
+    i = 0
+    while i < len(source):
+        c = source[i]
+        if c == '\\' and i + 1 < len(source):
+            escaped = source[i + 1]
+            i += 2
+            if depth == 0:
+                if escaped.isalnum():
+                    runs.append([])
+                else:
+                    runs[-1].append(escaped)
+            continue
+        if c == '[':
+            i += 2 if source[i + 1:i + 2] == '^' else 1
+            i += 1 if source[i:i + 1] == ']' else 0
+            while i < len(source) and source[i] != ']':
+                i += 2 if source[i] == '\\' else 1
+            if i >= len(source):
+                return []
+            runs.append([])
+        elif c == '(':
+            depth += 1
+            runs.append([])
+        elif c == ')':
+            depth -= 1
+        elif c == '|':
+            if depth == 0:
+                return []
+        elif c in '*?{':
+            if depth == 0 and runs[-1] and (c != '{' or source[i + 1:i + 2] == '0'):
+                runs[-1].pop()
+            if c == '{':
+                i = source.find('}', i)
+                if i < 0:
+                    return []
+            runs.append([])
+        elif c in '+.^$':
+            runs.append([])
+        elif depth == 0:
+            runs[-1].append(c)
+        i += 1
+    return [''.join(run).lower() for run in runs if run]
+
+
+def bounded_tokens(runs):
+    # Tokens with a non-token character of the same run on both sides
+    tokens = []
+    for run in runs:
+        for match in TOKEN.finditer(run):
+            if match.start() > 0 and match.end() < len(run) and len(match.group()) > 1:
+                tokens.append(match.group())
+    return tokens
+
+
+def parse_options(text):
+    # None when the filter uses something this blocker can't do, like redirects or popups
+    types = 0
+    not_types = 0
+    third_party = None
+    match_case = False
+    domains = set()
+    not_domains = set()
+    for option in text.split(','):
+        option = option.strip().lower()
+        name = option.lstrip('~')
+        name = TYPE_ALIASES.get(name, name)
+        if name in TYPE_BITS:
+            if option.startswith('~'):
+                not_types |= TYPE_BITS[name]
+            else:
+                types |= TYPE_BITS[name]
+        elif option in ('third-party', '3p', '~first-party'):
+            third_party = True
+        elif option in ('~third-party', '1p', 'first-party'):
+            third_party = False
+        elif option == 'match-case':
+            match_case = True
+        elif option.startswith('domain='):
+            for domain in option[7:].split('|'):
+                if domain.startswith('~'):
+                    not_domains.add(domain[1:])
+                elif domain:
+                    domains.add(domain)
+        elif option not in IGNORED_OPTIONS:
+            return None
+    mask = (types or DEFAULT_TYPES) & ~not_types
+    if not mask:
+        return None
+    return mask, third_party, match_case, frozenset(domains) or None, frozenset(not_domains) or None
+
+
+class FilterIndex:
+    # Filters of one kind (blocking or exceptions). Plain `||host^` filters are a set of
+    # hosts and those with options a dict by host, both looked up with each suffix of the
+    # request's host. The rest are bucketed by one of their tokens, the one with the fewest
+    # filters so far, and a request only tests the buckets of the tokens in its url. Filters
+    # without a usable token are bucketed by three characters they require instead, and
+    # only those without even that are tried for every request.
+    def __init__(self, state=None):
+        self.host_set, self.hosts, self.tokens, self.grams, self.generic = \
+            state if state is not None else (set(), {}, {}, {}, [])
+        self.gram_keys = set(self.grams)
+
+    def state(self):
+        return self.host_set, self.hosts, self.tokens, self.grams, self.generic
+
+    def add(self, pattern, options, text):
+        # False for a regular expression Python can't compile
+        mask, third_party, match_case, domains, not_domains = options
+        entry = (text, match_case, mask, third_party, domains, not_domains)
+        host = HOST_RULE.fullmatch(pattern.lower())
+        if host is not None:
+            if entry[1:] == (False, DEFAULT_TYPES, None, None, None):
+                self.host_set.add(host.group(1))
+            else:
+                self.hosts.setdefault(host.group(1), []).append(entry)
+            return True
+        if is_regex(pattern):
+            try:
+                re.compile(pattern[1:-1])
+            except re.error:
+                return False
+            literals = regex_literals(pattern[1:-1])
+            tokens = bounded_tokens(literals)
+        else:
+            literals = [run for run in re.split(r'[*^|]', pattern.lower()) if run]
+            tokens = pattern_tokens(pattern.lower())
+        if tokens:
+            token = min(tokens, key=lambda token: (len(self.tokens.get(token, ())), -len(token)))
+            self.tokens.setdefault(token, []).append(entry)
+            return True
+        # Without a whole token, any three characters the url has to contain
+        grams = [run[i:i + 3] for run in literals for i in range(len(run) - 2)]
+        if grams:
+            gram = min(grams, key=lambda gram: len(self.grams.get(gram, ())))
+            self.grams.setdefault(gram, []).append(entry)
+            self.gram_keys.add(gram)
+        else:
+            self.generic.append(entry)
+        return True
+
+    def find(self, request, compiled):
+        # The filter matching the request, a host filter from the set as its text alone
+        url, lower, host, tokens, type_bit, third_party, page_host = request
+        for suffix in suffixes(host):
+            if suffix in self.host_set and type_bit & DEFAULT_TYPES:
+                return (f'||{suffix}^',)
+            for entry in self.hosts.get(suffix, ()):
+                if applies(entry, type_bit, third_party, page_host):
+                    return entry
+        for token in tokens:
+            for entry in self.tokens.get(token, ()):
+                if applies(entry, type_bit, third_party, page_host) and matches(entry, url, lower, compiled):
+                    return entry
+        if self.gram_keys:
+            for gram in self.gram_keys.intersection(map(''.join, zip(lower, lower[1:], lower[2:]))):
+                for entry in self.grams.get(gram, ()):
+                    if applies(entry, type_bit, third_party, page_host) and matches(entry, url, lower, compiled):
+                        return entry
+        for entry in self.generic:
+            if applies(entry, type_bit, third_party, page_host) and matches(entry, url, lower, compiled):
+                return entry
+        return None
+
+
+def applies(entry, type_bit, third_party, page_host):
+    if not entry[TYPE_MASK] & type_bit:
+        return False
+    if entry[THIRD_PARTY] is not None and entry[THIRD_PARTY] != third_party:
+        return False
+    if entry[DOMAINS] and not any(suffix in entry[DOMAINS] for suffix in suffixes(page_host)):
+        return False
+    if entry[NOT_DOMAINS] and any(suffix in entry[NOT_DOMAINS] for suffix in suffixes(page_host)):
+        return False
+    return True
+
+
+def matches(entry, url, lower, compiled):
+    # Regular expressions are made the first time a request gets to them
+    regex = compiled.get(entry[TEXT])
+    if regex is None:
+        regex = compiled[entry[TEXT]] = re.compile(filter_source(entry[TEXT], entry[MATCH_CASE]),
+                                                   0 if entry[MATCH_CASE] else re.IGNORECASE)
+    return regex.search(url if entry[MATCH_CASE] else lower) is not None
+
+
+class FilterEngine:
+    # Adblock Plus / EasyList style request filters: `||host^`, wildcard and anchored
+    # patterns, /regular expressions/, @@exceptions, and the type, third-party, domain= and
+    # match-case options. Element hiding rules and filters with options that need more than
+    # blocking a request (redirects, csp, popups) are skipped and counted.
+    def __init__(self, state=None):
+        if state is None:
+            self.block = FilterIndex()
+            self.allow = FilterIndex()
+            self.rules = 0
+            self.skipped = 0
+        else:
+            self.block = FilterIndex(state['block'])
+            self.allow = FilterIndex(state['allow'])
+            self.rules = state['rules']
+            self.skipped = state['skipped']
+        self.compiled = {}
+
+    def add(self, line):
+        line = line.strip()
+        if not line or line.startswith(('!', '[')) or '##' in line or '#@#' in line or '#?#' in line or '#$#' in line:
+            return
+        exception, pattern, options = split_filter(line)
+        index = self.allow if exception else self.block
+        parsed = parse_options(options) if options else (DEFAULT_TYPES, None, False, None, None)
+        if parsed is None or not pattern.strip('*') or not index.add(pattern, parsed, line):
+            self.skipped += 1
+            return
+        self.rules += 1
+
+    def add_list(self, text):
+        for line in text.splitlines():
+            self.add(line)
+
+    def state(self):
+        return {'format': FORMAT, 'block': self.block.state(), 'allow': self.allow.state(),
+                'rules': self.rules, 'skipped': self.skipped}
+
+    def request(self, url, page_url, resource_type):
+        lower = url.lower()
+        host = host_of(lower)
+        page_host = host_of(page_url.lower())
+        third_party = site_of(host) != site_of(page_host) if page_host else False
+        return url, lower, host, set(TOKEN.findall(lower)), TYPE_BITS.get(resource_type, TYPE_BITS['other']), \
+            third_party, page_host
+
+    def match(self, url, page_url='', resource_type='other'):
+        # The blocking filter's text, or None when the request may go ahead
+        request = self.request(url, page_url, resource_type)
+        entry = self.block.find(request, self.compiled)
+        if entry is None:
+            return None
+        if self.allow.find(request, self.compiled) is not None:
+            return None
+        # @@...$document exceptions let everything on those pages through
+        if page_url and self.allow.find(self.request(page_url, '', 'document'), self.compiled) is not None:
+            return None
+        return entry[TEXT]
+
+
+def filter_lists(directory):
+    return sorted(glob.glob(os.path.join(directory, '*.txt')))
+
+
+def load_filter_lists(paths, cache_dir):
+    # Compiled once per set of list contents, later starts read the compiled form back
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+    key = hashlib.sha1(str(FORMAT).encode() + b'\0'.join(contents)).hexdigest()
+    cache_path = os.path.join(cache_dir, key + '.bin')
+    try:
+        # loads() of the whole file, load() reads it a few bytes at a time
+        with open(cache_path, 'rb') as f:
+            state = marshal.loads(f.read())
+        if state.get('format') == FORMAT:
+            return FilterEngine(state)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    engine = FilterEngine()
+    for data in contents:
+        engine.add_list(data.decode('utf-8', 'replace'))
+    os.makedirs(cache_dir, exist_ok=True)
+    for old in glob.glob(os.path.join(cache_dir, '*.bin')):
+        os.remove(old)
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(marshal.dumps(engine.state()))
+    os.replace(temp_path, cache_path)
+    return engine
+
+
+class ContentBlocker(QWebEngineUrlRequestInterceptor):
+    # Installed on the profiles, asks the filter engine about every request a page makes.
+    # Until the engine has been loaded, and while turned off, everything goes through.
+    def __init__(self, enabled=True, parent=None):
+        super().__init__(parent)
+        self.enabled = enabled
+        self.engine = None
+        self.checked = 0
+        self.blocked = 0
+        self.match_seconds = 0.0
+        self.recent = deque(maxlen=100)
+        # Called with every request, blocked or not, whether or not blocking is on
+        self.listeners = []
+
+    def interceptRequest(self, info):
+        for listener in self.listeners:
+            listener(info)
+        engine = self.engine
+        if not self.enabled or engine is None:
+            return
+        url = info.requestUrl()
+        if url.scheme() not in ('http', 'https', 'ws', 'wss'):
+            return
+        resource_type = RESOURCE_TYPES.get(info.resourceType(), 'other')
+        start = time.perf_counter()
+        rule = engine.match(url.toString(), info.firstPartyUrl().toString(), resource_type)
+        self.match_seconds += time.perf_counter() - start
+        self.checked += 1
+        if rule is not None:
+            info.block(True)
+            self.blocked += 1
+            self.recent.append((url.toString(), rule))
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'rules': self.engine.rules if self.engine is not None else 0,
+            'skipped': self.engine.skipped if self.engine is not None else 0,
+            'checked': self.checked,
+            'blocked': self.blocked,
+            'match_us': 1e6 * self.match_seconds / self.checked if self.checked else None,
+        }
@@ -0,0 +1,559 @@
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from PyQt5.QtCore import Qt, QObject, QTimer, QUrl, pyqtSignal
+from PyQt5.QtGui import QDesktopServices
+from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkCookieJar, QNetworkReply, QNetworkRequest
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInfo
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton,
+                             QHeaderView, QAbstractItemView)
+
+
+# Replies stop reading from the socket once this much is buffered and not taken yet
+READ_BUFFER_BYTES = 1024 * 1024
+# Network reads wait while this much is still queued for the disk
+WRITE_BACKLOG_BYTES = 64 * 1024 * 1024
+
+
+def unique_path(directory, name, taken=()):
+    # "file.zip", then "file (1).zip" and so on, also avoiding unfinished downloads: those
+    # with a .part file and those in `taken`, which may not have written anything yet
+    base, extension = os.path.splitext(name or 'download')
+    path = os.path.join(directory, base + extension)
+    n = 1
+    while os.path.exists(path) or os.path.exists(path + '.part') or path in taken:
+        path = os.path.join(directory, f"{base} ({n}){extension}")
+        n += 1
+    return path
+
+
+class DiskWriter(QObject):
+    # Writes downloaded data on its own thread, each chunk at its offset in the .part file,
+    # and renames the file once the download is complete. The GUI thread only queues.
+    # A discarded download is marked right away, so a finish queued before it doesn't rename.
+    closed = pyqtSignal(object, str)
+
+    def __init__(self):
+        super().__init__()
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.backlog = 0
+        self.discarded = set()
+        self.thread = threading.Thread(target=self.write_loop, name="download-writer", daemon=True)
+        self.thread.start()
+
+    def open(self, download, size, truncate):
+        self.pending.put(('open', download, (size, truncate)))
+
+    def write(self, download, offset, data):
+        with self.lock:
+            self.backlog += len(data)
+        self.pending.put(('write', download, (offset, data)))
+
+    def finish(self, download):
+        self.pending.put(('finish', download, None))
+
+    def discard(self, download):
+        with self.lock:
+            self.discarded.add(download)
+        self.pending.put(('discard', download, None))
+
+    def write_loop(self):
+        files = {}
+        failed = set()
+        # Renamed but the GUI thread may not know yet, a discard then removes the file
+        renamed = set()
+        while True:
+            op = self.pending.get()
+            if op is None:
+                break
+            kind, download, value = op
+            try:
+                if kind == 'write':
+                    with self.lock:
+                        self.backlog -= len(value[1])
+                    if download not in failed:
+                        os.pwrite(files[download], value[1], value[0])
+                elif kind == 'open':
+                    failed.discard(download)
+                    if download not in files:
+                        files[download] = os.open(download.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+                    size, truncate = value
+                    if truncate:
+                        os.ftruncate(files[download], 0)
+                    if size:
+                        # Reserving the space up front keeps the segments from fragmenting the file
+                        os.ftruncate(files[download], size)
+                elif kind == 'finish':
+                    with self.lock:
+                        discarded = download in self.discarded
+                    if download not in failed and not discarded:
+                        os.close(files.pop(download))
+                        os.replace(download.part_path, download.path)
+                        renamed.add(download)
+                        self.closed.emit(download, '')
+                elif kind == 'discard':
+                    fd = files.pop(download, None)
+                    if fd is not None:
+                        os.close(fd)
+                    if os.path.exists(download.part_path):
+                        os.remove(download.part_path)
+                    if download in renamed and os.path.exists(download.path):
+                        os.remove(download.path)
+                    renamed.discard(download)
+                    with self.lock:
+                        self.discarded.discard(download)
+            except (OSError, KeyError) as error:
+                failed.add(download)
+                fd = files.pop(download, None)
+                if fd is not None:
+                    os.close(fd)
+                self.closed.emit(download, str(error))
+        for fd in files.values():
+            os.close(fd)
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+
+class Segment:
+    # A byte range of a download and the request fetching it, end is inclusive and None
+    # while the size is unknown
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.received = 0
+        self.reply = None
+
+    def remaining(self):
+        return None if self.end is None else self.end - self.start + 1 - self.received
+
+    def done(self):
+        return self.end is not None and self.remaining() <= 0
+
+
+class Download:
+    def __init__(self, url, path):
+        self.url = QUrl(url)
+        self.path = path
+        self.part_path = path + '.part'
+        self.state = 'queued'
+        self.error = ''
+        self.total = None
+        self.segments = []
+        # Whether the server answered with a range, only then can the transfer be split and resumed
+        self.ranges = False
+        self.validator = None
+        self.started = None
+        self.finished = None
+        # The page that started it, which can hand it back to QtWebEngine
+        self.page = None
+
+    def name(self):
+        return os.path.basename(self.path)
+
+    def received(self):
+        return sum(segment.received for segment in self.segments)
+
+    def active(self):
+        return self.state in ('connecting', 'downloading')
+
+
+class DownloadManager:
+    # Downloads from every tab. A queue of which at most max_active run at a time; each one
+    # starts with a request for the whole file that also asks for a range. If the server
+    # answers with one and the file is big enough, the rest is split into up to `segments`
+    # ranges fetched in parallel, otherwise that first request simply carries the whole file.
+    # Ranged downloads can be paused and resumed where they stopped. Requests carry the
+    # browser profile's cookies and user agent, and the data is written by a DiskWriter.
+    # Only what a plain GET fetches again is taken over: results of form posts and downloads
+    # asking for a login stay with QtWebEngine, which has the request body and credentials.
+    def __init__(self, profile, directory, max_active=3, segments=4, min_segment_bytes=4 * 1024 * 1024):
+        self.profile = profile
+        self.directory = directory
+        self.max_active = max_active
+        self.segments = segments
+        self.min_segment_bytes = min_segment_bytes
+        self.downloads = []
+        self.listeners = []
+        self.on_added = None
+        # Urls pages asked for with a form post, and urls handed back to QtWebEngine
+        self.posted = deque(maxlen=64)
+        self.handed_back = set()
+
+        self.network = QNetworkAccessManager()
+        self.network.setRedirectPolicy(QNetworkRequest.NoLessSafeRedirectPolicy)
+        # Mirror the profile's cookies, downloads behind a login need them
+        self.cookies = QNetworkCookieJar()
+        self.network.setCookieJar(self.cookies)
+        store = profile.cookieStore()
+        store.cookieAdded.connect(self.cookies.insertCookie)
+        store.cookieRemoved.connect(self.cookies.deleteCookie)
+        store.loadAllCookies()
+
+        self.writer = DiskWriter()
+        self.writer.closed.connect(self.written)
+
+    def request_seen(self, info):
+        # From the profiles' request interceptor, for every request
+        if (info.requestMethod() not in (b'GET', b'HEAD') and info.resourceType() in
+                (QWebEngineUrlRequestInfo.ResourceTypeMainFrame, QWebEngineUrlRequestInfo.ResourceTypeSubFrame)):
+            self.posted.append(info.requestUrl())
+
+    def requested(self, item):
+        # QWebEngineProfile.downloadRequested. Plain http(s) downloads are taken over, the rest
+        # (data: and blob: urls, incognito tabs, form posts, urls carrying a login and downloads
+        # handed back) is left to QtWebEngine in the same directory.
+        url = item.url()
+        name = item.downloadFileName() or url.fileName()
+        off_the_record = item.page() is not None and item.page().profile().isOffTheRecord()
+        handed_back = url in self.handed_back
+        self.handed_back.discard(url)
+        if (url.scheme() in ('http', 'https') and not off_the_record and not handed_back
+                and url not in self.posted and not url.userInfo()):
+            item.cancel()
+            self.add(url, name, item.page())
+            return
+        path = unique_path(self.directory, name, self.taken_paths())
+        item.setDownloadDirectory(os.path.dirname(path))
+        item.setDownloadFileName(os.path.basename(path))
+        item.accept()
+
+    def add(self, url, name=None, page=None):
+        os.makedirs(self.directory, exist_ok=True)
+        download = Download(url, unique_path(self.directory, name or QUrl(url).fileName(), self.taken_paths()))
+        if page is not None:
+            download.page = page
+            page.destroyed.connect(lambda: setattr(download, 'page', None))
+        self.downloads.append(download)
+        if self.on_added is not None:
+            self.on_added(download)
+        self.schedule()
+        return download
+
+    def schedule(self):
+        running = sum(download.active() for download in self.downloads)
+        for download in self.downloads:
+            if running >= self.max_active:
+                break
+            if download.state == 'queued':
+                self.start(download)
+                running += 1
+        self.changed()
+
+    def start(self, download):
+        download.started = download.started or time.monotonic()
+        if download.ranges and download.segments:
+            # Resuming: every unfinished range goes on from where it stopped
+            download.state = 'downloading'
+            self.writer.open(download, download.total, truncate=False)
+            for segment in download.segments:
+                if not segment.done():
+                    self.fetch(download, segment)
+            return
+        download.state = 'connecting'
+        download.segments = [Segment(0, None)]
+        self.fetch(download, download.segments[0])
+
+    def fetch(self, download, segment):
+        request = QNetworkRequest(download.url)
+        request.setRawHeader(b'User-Agent', self.profile.httpUserAgent().encode())
+        start = segment.start + segment.received
+        end = '' if segment.end is None else str(segment.end)
+        request.setRawHeader(b'Range', f"bytes={start}-{end}".encode())
+        if download.validator:
+            request.setRawHeader(b'If-Range', download.validator)
+        reply = self.network.get(request)
+        reply.setReadBufferSize(READ_BUFFER_BYTES)
+        segment.reply = reply
+        reply.metaDataChanged.connect(lambda: self.headers(download, segment, reply))
+        reply.readyRead.connect(lambda: self.read(download, segment, reply))
+        reply.finished.connect(lambda: self.reply_finished(download, segment, reply))
+
+    def headers(self, download, segment, reply):
+        if segment.reply is not reply or reply.attribute(QNetworkRequest.RedirectionTargetAttribute):
+            return
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if download.state == 'downloading':
+            # A resumed or split range has to come back as that range
+            if status != 206:
+                self.fail(download, f"the server no longer sends parts of the file (HTTP {status})")
+            return
+        if download.state == 'connecting' and status in (401, 407) and download.page is not None:
+            self.hand_back(download)
+            return
+        if download.state != 'connecting' or status not in (200, 206):
+            return
+
+        content_range = bytes(reply.rawHeader(b'Content-Range')).decode()
+        total = content_range.rpartition('/')[2]
+        download.state = 'downloading'
+        if status == 206 and total.isdigit():
+            download.ranges = True
+            download.total = int(total)
+            download.validator = bytes(reply.rawHeader(b'ETag') or reply.rawHeader(b'Last-Modified')) or None
+            self.writer.open(download, download.total, truncate=True)
+            self.split(download)
+        else:
+            length = reply.header(QNetworkRequest.ContentLengthHeader)
+            download.total = int(length) if length is not None else None
+            self.writer.open(download, download.total, truncate=True)
+        self.changed()
+
+    def split(self, download):
+        # The first request keeps the first range, the others get a request each
+        count = max(1, min(self.segments, download.total // self.min_segment_bytes))
+        size = math.ceil(download.total / count) if download.total else 0
+        first = download.segments[0]
+        first.end = max(0, min(download.total, size) - 1)
+        for n in range(1, count):
+            segment = Segment(n * size, min(download.total, (n + 1) * size) - 1)
+            download.segments.append(segment)
+            self.fetch(download, segment)
+
+    def read(self, download, segment, reply):
+        if segment.reply is not reply or download.state != 'downloading':
+            return
+        if self.writer.backlog > WRITE_BACKLOG_BYTES:
+            # The disk is behind, leave the data in the reply for now
+            QTimer.singleShot(20, lambda: self.read(download, segment, reply))
+            return
+        data = bytes(reply.readAll())
+        remaining = segment.remaining()
+        if remaining is not None:
+            data = data[:remaining]
+        if data:
+            self.writer.write(download, segment.start + segment.received, data)
+            segment.received += len(data)
+        if segment.done():
+            # The first request asked for everything, it stops at its range
+            segment.reply = None
+            reply.abort()
+            reply.deleteLater()
+            self.segment_done(download)
+
+    def reply_finished(self, download, segment, reply):
+        if segment.reply is not reply:
+            return
+        if self.writer.backlog > WRITE_BACKLOG_BYTES:
+            QTimer.singleShot(20, lambda: self.reply_finished(download, segment, reply))
+            return
+        self.read(download, segment, reply)
+        if segment.reply is not reply:
+            return
+        segment.reply = None
+        reply.deleteLater()
+        if reply.error() != QNetworkReply.NoError:
+            self.fail(download, reply.errorString())
+            return
+        if segment.end is None:
+            # Without a known size the file ends where the stream does
+            segment.end = segment.received - 1
+            download.total = segment.received
+        if not segment.done() and segment.received < (download.total or 0):
+            self.fail(download, "the connection closed before the download was complete")
+            return
+        self.segment_done(download)
+
+    def segment_done(self, download):
+        if download.state == 'downloading' and all(segment.done() for segment in download.segments):
+            download.state = 'writing'
+            self.writer.finish(download)
+            self.changed()
+
+    def written(self, download, error):
+        # From the writer: the file is complete and in place, or writing it failed
+        if download.state not in ('writing', 'downloading', 'connecting'):
+            return
+        if error:
+            self.fail(download, error)
+            return
+        download.state = 'finished'
+        download.finished = time.monotonic()
+        self.schedule()
+
+    def stop_requests(self, download):
+        for segment in download.segments:
+            reply, segment.reply = segment.reply, None
+            if reply is not None:
+                reply.abort()
+                reply.deleteLater()
+
+    def hand_back(self, download):
+        # The server wants a login this manager can't give, the page downloads it again itself
+        self.stop_requests(download)
+        self.downloads.remove(download)
+        self.handed_back.add(download.url)
+        download.page.download(download.url, download.name())
+        self.changed()
+
+    def fail(self, download, error):
+        # What was written is thrown away, a retry starts over
+        self.stop_requests(download)
+        download.state = 'failed'
+        download.error = error
+        download.segments = []
+        self.writer.discard(download)
+        self.schedule()
+
+    def pause(self, download):
+        if not download.active() and download.state != 'queued':
+            return
+        self.stop_requests(download)
+        if not download.ranges:
+            # Without ranges there is nothing to resume from, it starts over
+            download.segments = []
+        download.state = 'paused'
+        self.schedule()
+
+    def resume(self, download):
+        if download.state in ('paused', 'failed'):
+            download.state = 'queued'
+            download.error = ''
+            if not download.ranges:
+                download.segments = []
+            self.schedule()
+
+    def taken_paths(self):
+        # The .part file only appears once the response headers are in, until then the
+        # name is only held here
+        return {download.path for download in self.downloads if download.state not in ('finished', 'cancelled')}
+
+    def cancel(self, download):
+        if download.state in ('finished', 'cancelled'):
+            return
+        self.stop_requests(download)
+        download.state = 'cancelled'
+        self.writer.discard(download)
+        self.schedule()
+
+    def clear_finished(self):
+        self.downloads = [download for download in self.downloads
+                          if download.state not in ('finished', 'cancelled')]
+        self.changed()
+
+    def changed(self):
+        for listener in self.listeners:
+            listener()
+
+    def close(self):
+        for download in self.downloads:
+            self.stop_requests(download)
+        self.writer.close()
+
+
+def size_text(size):
+    if size is None:
+        return "?"
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class DownloadsDialog(QDialog):
+    COLUMNS = ["File", "Progress", "Size", "Speed", "Status"]
+
+    def __init__(self, manager, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Downloads")
+        self.resize(750, 350)
+        self.manager = manager
+        self.rates = {}
+
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        for label, action in (("Pause", self.pause_selected), ("Resume", self.resume_selected),
+                              ("Cancel", self.cancel_selected), ("Open Folder", self.open_folder),
+                              ("Clear Finished", manager.clear_finished)):
+            button = QPushButton(label)
+            button.clicked.connect(action)
+            buttons.addWidget(button)
+        layout.addLayout(buttons)
+
+        # Progress is redrawn twice a second while the panel is open
+        self.timer = QTimer(self)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.refresh)
+        self.listener = lambda: self.refresh() if self.isVisible() else None
+        manager.listeners.append(self.listener)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def detach(self):
+        self.manager.listeners.remove(self.listener)
+
+    def speed(self, download):
+        # Bytes per second since the last refresh
+        now = time.monotonic()
+        received = download.received()
+        last = self.rates.get(download)
+        self.rates[download] = (now, received)
+        if last is None or now <= last[0] or not download.active():
+            return None
+        return (received - last[1]) / (now - last[0])
+
+    def refresh(self):
+        selected = self.selected()
+        downloads = self.manager.downloads
+        self.table.setRowCount(len(downloads))
+        for i, download in enumerate(downloads):
+            received = download.received()
+            progress = f"{100 * received / download.total:.0f}%" if download.total else size_text(received)
+            speed = self.speed(download)
+            status = download.state
+            if download.state == 'downloading' and len(download.segments) > 1:
+                status += f" ({sum(segment.reply is not None for segment in download.segments)} parts)"
+            if download.error:
+                status += f": {download.error}"
+            items = [download.name(), progress, size_text(download.total),
+                     f"{size_text(speed)}/s" if speed else "", status]
+            for column, text in enumerate(items):
+                item = QTableWidgetItem(text)
+                item.setData(Qt.UserRole, i)
+                self.table.setItem(i, column, item)
+            if download is selected:
+                self.table.selectRow(i)
+
+    def selected(self):
+        items = self.table.selectedItems()
+        if not items:
+            return None
+        index = items[0].data(Qt.UserRole)
+        return self.manager.downloads[index] if index < len(self.manager.downloads) else None
+
+    def pause_selected(self):
+        if self.selected() is not None:
+            self.manager.pause(self.selected())
+
+    def resume_selected(self):
+        if self.selected() is not None:
+            self.manager.resume(self.selected())
+
+    def cancel_selected(self):
+        if self.selected() is not None:
+            self.manager.cancel(self.selected())
+
+    def open_folder(self):
+        QDesktopServices.openUrl(QUrl.fromLocalFile(self.manager.directory))
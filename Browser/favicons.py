@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, QSize, QUrl
+from PyQt5.QtGui import QIcon, QPixmap
+
+
+ICON_SIZE = QSize(32, 32)
+
+
+def origin_of(url):
+    qurl = QUrl(url) if isinstance(url, str) else url
+    if not qurl.host():
+        return None
+    return qurl.adjusted(QUrl.RemoveUserInfo | QUrl.RemovePath | QUrl.RemoveQuery | QUrl.RemoveFragment).toString()
+
+
+def encode_png(icon):
+    pixmap = icon.pixmap(ICON_SIZE)
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    pixmap.save(buffer, 'PNG')
+    buffer.close()
+    return bytes(data)
+
+
+class FaviconCache:
+    # Site icons by origin. Icons are stored once per distinct image, named by the hash of
+    # their PNG, so every origin with the same icon points at the same file and QIcon.
+    # Decoded icons live in a bounded LRU; files and the origin map are written by a
+    # background thread, and what is not written yet is served from memory.
+    def __init__(self, directory, memory_size=256):
+        self.directory = directory
+        self.icon_dir = os.path.join(directory, 'icons')
+        self.map_path = os.path.join(directory, 'origins.json')
+        self.memory_size = memory_size
+        os.makedirs(self.icon_dir, exist_ok=True)
+
+        self.origins = {}
+        if os.path.exists(self.map_path):
+            try:
+                with open(self.map_path, encoding='utf-8') as f:
+                    self.origins = json.load(f)
+            except ValueError:
+                pass
+        self.icons = OrderedDict()
+        self.unwritten = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.prune()
+
+        self.pending = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, name="favicon-writer", daemon=True)
+        self.writer.start()
+
+    def icon_path(self, digest):
+        return os.path.join(self.icon_dir, digest + '.png')
+
+    def icon_for(self, url):
+        # An empty QIcon when the origin has no icon yet
+        digest = self.origins.get(origin_of(url))
+        if digest is None:
+            return QIcon()
+        icon = self.icons.get(digest)
+        if icon is not None:
+            self.icons.move_to_end(digest)
+            self.hits += 1
+            return icon
+
+        self.misses += 1
+        data = self.png_for_digest(digest)
+        if data is None:
+            return QIcon()
+        pixmap = QPixmap()
+        pixmap.loadFromData(data, 'PNG')
+        return self.remember(digest, QIcon(pixmap))
+
+    def png_for(self, url):
+        digest = self.origins.get(origin_of(url))
+        return self.png_for_digest(digest) if digest is not None else None
+
+    def png_for_digest(self, digest):
+        data = self.unwritten.get(digest)
+        if data is not None:
+            return data
+        try:
+            with open(self.icon_path(digest), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def remember(self, digest, icon):
+        self.icons[digest] = icon
+        self.icons.move_to_end(digest)
+        while len(self.icons) > self.memory_size:
+            self.icons.popitem(last=False)
+        return icon
+
+    def store(self, url, icon):
+        # Returns the shared QIcon for the image, so equal icons are only decoded once
+        origin = origin_of(url)
+        if origin is None or icon.isNull():
+            return icon
+        data = encode_png(icon)
+        digest = hashlib.sha1(data).hexdigest()
+        shared = self.icons.get(digest)
+        if shared is None:
+            shared = self.remember(digest, icon)
+            if not os.path.exists(self.icon_path(digest)):
+                self.unwritten[digest] = data
+                self.pending.put(('icon', digest, data))
+        if self.origins.get(origin) != digest:
+            self.origins[origin] = digest
+            self.pending.put(('map', origin, digest))
+        return shared
+
+    def write_loop(self):
+        while True:
+            batch = [self.pending.get()]
+            while True:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            self.write([op for op in batch if op is not None])
+            for op in batch:
+                self.pending.task_done()
+            if stop:
+                break
+
+    def write(self, batch):
+        mapped = False
+        for kind, key, value in batch:
+            if kind == 'icon':
+                temp_path = self.icon_path(key) + '.tmp'
+                with open(temp_path, 'wb') as f:
+                    f.write(value)
+                os.replace(temp_path, self.icon_path(key))
+                self.unwritten.pop(key, None)
+            else:
+                mapped = True
+        if mapped:
+            temp_path = self.map_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(dict(self.origins), f)
+            os.replace(temp_path, self.map_path)
+
+    def prune(self):
+        # Icons no origin points at any more, left over from sites that changed theirs
+        used = set(self.origins.values())
+        for name in os.listdir(self.icon_dir):
+            if name[:-len('.png')] not in used:
+                try:
+                    os.remove(os.path.join(self.icon_dir, name))
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {
+            'origins': len(self.origins),
+            'images': len(set(self.origins.values())),
+            'in_memory': len(self.icons),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def flush(self):
+        self.pending.join()
+
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
@@ -0,0 +1,228 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from PyQt5.QtCore import Qt, QUrl
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLineEdit, QListWidget, QListWidgetItem
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL DEFAULT '',
+    match_key TEXT NOT NULL,
+    visit_count INTEGER NOT NULL DEFAULT 0,
+    last_visit REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS urls_match_key ON urls(match_key);
+CREATE INDEX IF NOT EXISTS urls_last_visit ON urls(last_visit);
+
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY,
+    url_id INTEGER NOT NULL REFERENCES urls(id),
+    visit_time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS visits_url ON visits(url_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS urls_fts USING fts5(url, title, content='urls', content_rowid='id', prefix='2 3');
+
+CREATE TRIGGER IF NOT EXISTS urls_fts_insert AFTER INSERT ON urls BEGIN
+    INSERT INTO urls_fts(rowid, url, title) VALUES (new.id, new.url, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS urls_fts_delete AFTER DELETE ON urls BEGIN
+    INSERT INTO urls_fts(urls_fts, rowid, url, title) VALUES ('delete', old.id, old.url, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS urls_fts_update AFTER UPDATE OF url, title ON urls BEGIN
+    INSERT INTO urls_fts(urls_fts, rowid, url, title) VALUES ('delete', old.id, old.url, old.title);
+    INSERT INTO urls_fts(rowid, url, title) VALUES (new.id, new.url, new.title);
+END;
+"""
+
+UPSERT_URL = """
+INSERT INTO urls (url, title, match_key, visit_count, last_visit) VALUES (?, ?, ?, 1, ?)
+ON CONFLICT(url) DO UPDATE SET
+    visit_count = visit_count + 1,
+    last_visit = excluded.last_visit,
+    title = CASE WHEN excluded.title != '' THEN excluded.title ELSE title END
+"""
+
+INSERT_VISIT = "INSERT INTO visits (url_id, visit_time) SELECT id, ? FROM urls WHERE url = ?"
+
+UPDATE_TITLE = "UPDATE urls SET title = ? WHERE url = ? AND title != ?"
+
+
+def match_key(url):
+    # What people type: no scheme and no leading www.
+    key = url.split('://', 1)[-1].lower()
+    return key[4:] if key.startswith('www.') else key
+
+
+def recordable(qurl):
+    return qurl.scheme() in ('http', 'https', 'file')
+
+
+class HistoryStore:
+    # Visit history in SQLite. Writes are queued and committed in batches by a background
+    # thread so the GUI never waits on the disk; reads use their own connection, which
+    # WAL mode lets run while the writer is busy.
+    def __init__(self, path, batch_size=5000, batch_delay=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+
+        self.reader = sqlite3.connect(path)
+        self.reader.execute("PRAGMA journal_mode=WAL")
+        self.reader.executescript(SCHEMA)
+        self.reader.commit()
+
+        self.pending = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, name="history-writer", daemon=True)
+        self.writer.start()
+
+    def add_visit(self, url, title='', visit_time=None):
+        self.pending.put(('visit', url, title, visit_time or time.time()))
+
+    def set_title(self, url, title):
+        self.pending.put(('title', url, title, None))
+
+    def write_loop(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            # A batch that can't be written (a bad entry, disk full, damaged database) is lost,
+            # the writer carries on with the next one
+            try:
+                self.write(connection, [op for op in batch if op is not None])
+            except Exception:
+                logging.exception("Could not write %d history entries", len(batch))
+            for op in batch:
+                self.pending.task_done()
+            if stop:
+                break
+        connection.close()
+
+    def write(self, connection, batch):
+        # One transaction per batch; titles usually arrive after their visit so they go last
+        visits = [(url, title, match_key(url), visit_time) for kind, url, title, visit_time in batch if kind == 'visit']
+        titles = [(title, url, title) for kind, url, title, visit_time in batch if kind == 'title']
+        with connection:
+            for url, title, key, visit_time in visits:
+                connection.execute(UPSERT_URL, (url, title, key, visit_time))
+            connection.executemany(INSERT_VISIT, [(visit_time, url) for url, title, key, visit_time in visits])
+            connection.executemany(UPDATE_TITLE, titles)
+
+    def flush(self, timeout=30):
+        # Wait until everything queued so far is committed. Returns False when it wasn't
+        # done in time or the writer thread is gone.
+        deadline = time.monotonic() + timeout
+        with self.pending.all_tasks_done:
+            while self.pending.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.writer.is_alive():
+                    return False
+                self.pending.all_tasks_done.wait(min(remaining, 0.1))
+        return True
+
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+        self.reader.close()
+
+    def recent(self, limit=100):
+        return self.reader.execute(
+            "SELECT url, title, visit_count, last_visit FROM urls ORDER BY last_visit DESC LIMIT ?",
+            (limit,)).fetchall()
+
+    def prefix(self, text, limit=10):
+        # Urls starting with what was typed, in key order straight from the match_key index
+        key = match_key(text.strip().lower())
+        if not key:
+            return []
+        return self.reader.execute(
+            "SELECT url, title, visit_count, last_visit FROM urls "
+            "WHERE match_key >= ? AND match_key < ? ORDER BY match_key LIMIT ?",
+            (key, key + '\uffff', limit)).fetchall()
+
+    def search(self, text, limit=50):
+        # Full text search over urls and titles, every word is matched as a prefix.
+        # Ranking every match with bm25 is too slow for common words in a large history,
+        # so take the newest matches (FTS5 walks rowids backwards cheaply) and sort those.
+        words = [word.replace('"', '') for word in text.split()]
+        query = ' '.join(f'"{word}"*' for word in words if word)
+        if not query:
+            return []
+        rows = self.reader.execute(
+            "SELECT urls.url, urls.title, urls.visit_count, urls.last_visit FROM urls_fts "
+            "JOIN urls ON urls.id = urls_fts.rowid WHERE urls_fts MATCH ? ORDER BY urls_fts.rowid DESC LIMIT ?",
+            (query, limit)).fetchall()
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def top_urls(self, limit):
+        # Opens its own connection so it can be called from a loader thread
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(
+                "SELECT url, title, visit_count, last_visit FROM urls ORDER BY visit_count DESC LIMIT ?",
+                (limit,)).fetchall()
+        finally:
+            connection.close()
+
+    def count(self):
+        return self.reader.execute("SELECT count(*) FROM visits").fetchone()[0]
+
+
+class HistoryDialog(QDialog):
+    def __init__(self, history, open_url, icon_for=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("History")
+        self.resize(700, 500)
+        self.history = history
+        self.open_url = open_url
+        self.icon_for = icon_for
+
+        layout = QVBoxLayout(self)
+        self.search_bar = QLineEdit()
+        self.search_bar.setPlaceholderText("Search history")
+        self.search_bar.textChanged.connect(self.refresh)
+        layout.addWidget(self.search_bar)
+
+        self.results = QListWidget()
+        self.results.itemActivated.connect(self.item_activated)
+        layout.addWidget(self.results)
+
+        self.refresh()
+
+    def refresh(self):
+        text = self.search_bar.text()
+        if text:
+            rows = self.history.prefix(text) + self.history.search(text)
+        else:
+            rows = self.history.recent(200)
+
+        self.results.clear()
+        seen = set()
+        for url, title, visit_count, last_visit in rows:
+            if url in seen:
+                continue
+            seen.add(url)
+            when = time.strftime('%Y-%m-%d %H:%M', time.localtime(last_visit))
+            item = QListWidgetItem(f"{title or url}\n{url}  ({when})")
+            item.setData(Qt.UserRole, url)
+            if self.icon_for is not None:
+                item.setIcon(self.icon_for(url))
+            self.results.addItem(item)
+
+    def item_activated(self, item):
+        self.open_url(QUrl(item.data(Qt.UserRole)))
@@ -0,0 +1,62 @@
+import hashlib
+import json
+
+from PyQt5.QtCore import QUrl
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
+
+
+def instance_name(data_dir):
+    # One running Cwanda per data directory, so the name is derived from it
+    return 'cwanda-' + hashlib.sha1(data_dir.encode()).hexdigest()[:16]
+
+
+def launch_urls(argv):
+    # Urls given on the command line. Options and their values (Qt's -platform offscreen)
+    # are skipped, so only arguments that look like an address count.
+    return [QUrl.fromUserInput(arg).toString() for arg in argv[1:]
+            if not arg.startswith('-') and ('.' in arg or ':' in arg)]
+
+
+def forward_urls(name, urls, timeout_ms=500):
+    # Hands the urls to a running Cwanda, which opens them in a new window. False when
+    # nothing is listening and this process has to start the browser itself.
+    # Works before the QApplication exists, so it costs no QtWebEngine startup.
+    socket = QLocalSocket()
+    socket.connectToServer(name)
+    if not socket.waitForConnected(timeout_ms):
+        return False
+    socket.write(json.dumps({'urls': urls}).encode() + b'\n')
+    sent = socket.waitForBytesWritten(timeout_ms)
+    socket.disconnectFromServer()
+    return sent
+
+
+class InstanceServer:
+    # Listens for later launches of Cwanda and passes their urls to open_window
+    def __init__(self, name, open_window, parent=None):
+        self.open_window = open_window
+        self.server = QLocalServer(parent)
+        # Only reached when nothing answered on the name, so a socket left there is
+        # from a run that crashed
+        QLocalServer.removeServer(name)
+        self.server.listen(name)
+        self.server.newConnection.connect(self.accept)
+
+    def accept(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.readyRead.connect(lambda socket=socket: self.read(socket))
+            socket.disconnected.connect(socket.deleteLater)
+            # The launcher writes and leaves at once, the message can already be here
+            self.read(socket)
+
+    def read(self, socket):
+        while socket.canReadLine():
+            try:
+                message = json.loads(bytes(socket.readLine()).decode())
+            except ValueError:
+                continue
+            self.open_window(message.get('urls', []))
+
+    def close(self):
+        self.server.close()
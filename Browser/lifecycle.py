@@ -0,0 +1,102 @@
+import time
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWebEngineWidgets import QWebEnginePage
+
+
+class LifecycleManager:
+    # Puts background tabs to sleep. A tab that has been hidden for freeze_after seconds is
+    # frozen (no timers, scripts or workers run, the page stays in memory), and one hidden
+    # for discard_after seconds is discarded (the renderer lets go of the page, which
+    # reloads when the tab is shown again). Pinned tabs and tabs playing audio are left
+    # alone. A zero delay turns that step off.
+    def __init__(self, tab_manager, freeze_after_s=60, discard_after_s=1800):
+        self.tab_manager = tab_manager
+        self.freeze_after = freeze_after_s
+        self.discard_after = discard_after_s
+        self.current = None
+        self.freezes = 0
+        self.discards = 0
+        self.resumes = 0
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.update)
+
+    def activated(self, tab):
+        now = time.monotonic()
+        if self.current is not None and self.current is not tab:
+            self.current.hidden_since = now
+        self.current = tab
+        tab.hidden_since = None
+        # Qt wakes a page up by itself when it is shown, but only once it is already visible
+        if tab.view is not None and tab.view.page().lifecycleState() != QWebEnginePage.LifecycleState.Active:
+            tab.view.page().setLifecycleState(QWebEnginePage.LifecycleState.Active)
+            self.resumes += 1
+        self.update()
+
+    def exempt(self, tab):
+        return tab.pinned or tab.view.page().recentlyAudible()
+
+    def target_state(self, hidden_for):
+        if self.discard_after and hidden_for >= self.discard_after:
+            return QWebEnginePage.LifecycleState.Discarded
+        if self.freeze_after and hidden_for >= self.freeze_after:
+            return QWebEnginePage.LifecycleState.Frozen
+        return QWebEnginePage.LifecycleState.Active
+
+    def next_step(self, state):
+        # Seconds of hiding after which the tab moves on from state, None when it stays
+        if state == QWebEnginePage.LifecycleState.Active and self.freeze_after:
+            return self.freeze_after
+        if state != QWebEnginePage.LifecycleState.Discarded and self.discard_after:
+            return self.discard_after
+        return None
+
+    def update(self):
+        now = time.monotonic()
+        wake = None
+        for tab in self.tab_manager.live_tabs():
+            if tab is self.current:
+                continue
+            if tab.hidden_since is None:
+                tab.hidden_since = now
+            page = tab.view.page()
+            state = page.lifecycleState()
+            hidden_for = now - tab.hidden_since
+
+            if self.exempt(tab):
+                # Audio can stop, look again after a grace period
+                step = self.freeze_after or self.discard_after
+                if step:
+                    wake = min(wake, step) if wake is not None else step
+                continue
+
+            target = self.target_state(hidden_for)
+            if target > state:
+                page.setLifecycleState(target)
+                if target == QWebEnginePage.LifecycleState.Frozen:
+                    self.freezes += 1
+                else:
+                    self.discards += 1
+                state = target
+
+            step = self.next_step(state)
+            if step is not None:
+                remaining = max(0.0, tab.hidden_since + step - now)
+                wake = min(wake, remaining) if wake is not None else remaining
+
+        if wake is None:
+            self.timer.stop()
+        else:
+            self.timer.start(int(wake * 1000) + 1)
+
+    def stats(self):
+        states = [tab.view.page().lifecycleState() for tab in self.tab_manager.live_tabs()]
+        return {
+            'frozen': states.count(QWebEnginePage.LifecycleState.Frozen),
+            'discarded': states.count(QWebEnginePage.LifecycleState.Discarded),
+            'freezes': self.freezes,
+            'discards': self.discards,
+            'resumes': self.resumes,
+        }
@@ -0,0 +1,56 @@
+import mimetypes
+import os
+
+from PyQt5.QtCore import QBuffer, QUrl
+from PyQt5.QtWebEngineCore import QWebEngineUrlScheme, QWebEngineUrlSchemeHandler, QWebEngineUrlRequestJob
+
+
+SCHEME = b'cwanda'
+NEW_TAB_URL = QUrl('cwanda://newtab/')
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cwanda')
+
+
+def register_scheme():
+    # Custom schemes have to be registered before the QApplication is created
+    scheme = QWebEngineUrlScheme(SCHEME)
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Host)
+    scheme.setFlags(QWebEngineUrlScheme.SecureScheme | QWebEngineUrlScheme.CorsEnabled)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+
+class NewTabSchemeHandler(QWebEngineUrlSchemeHandler):
+    # Serves the start page (Cwanda/cwanda.html and its assets) as cwanda://newtab/
+    # from memory, so opening a tab needs neither a dev server nor disk reads.
+    # Routes are generated on every request from the request url, for data the page
+    # fetches (its bookmark tiles and their icons); they return None for not found.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.assets = {}
+        self.routes = {}
+        self.preload()
+
+    def preload(self):
+        for root, dirs, files in os.walk(ASSET_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                key = '/' + os.path.relpath(path, ASSET_DIR).replace(os.sep, '/')
+                mime = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                with open(path, 'rb') as f:
+                    self.assets[key] = (mime.encode(), f.read())
+        self.assets['/'] = self.assets['/cwanda.html']
+
+    def requestStarted(self, job):
+        url = job.requestUrl()
+        asset = None
+        if url.host() == 'newtab':
+            route = self.routes.get(url.path())
+            asset = route(url) if route is not None else self.assets.get(url.path())
+        if asset is None:
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+
+        mime, data = asset
+        # The job takes the buffer over, parenting it keeps it alive until the reply is read
+        buffer = QBuffer(job)
+        buffer.setData(data)
+        job.reply(mime, buffer)
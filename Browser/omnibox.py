@@ -0,0 +1,194 @@
+import bisect
+import heapq
+import threading
+import time
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
+from PyQt5.QtWidgets import QCompleter
+
+from history import match_key
+
+
+DAY = 24 * 60 * 60
+
+# (age in days, weight) buckets in the spirit of Firefox's frecency
+RECENCY_WEIGHTS = ((4, 100), (14, 70), (31, 50), (90, 30))
+
+BOOKMARK_BONUS = 150
+OPEN_TAB_BONUS = 100
+
+
+def frecency(visit_count, last_visit, now=None):
+    age = ((now or time.time()) - last_visit) / DAY
+    for days, weight in RECENCY_WEIGHTS:
+        if age < days:
+            return visit_count * weight
+    return visit_count * 10
+
+
+class FrecencyIndex:
+    # Urls kept in a sorted array of match keys, so the candidates for a prefix are one
+    # contiguous slice found with bisect. The best entries for every prefix of up to
+    # cache_depth characters are kept precomputed, because those slices are the big ones.
+    def __init__(self, cache_depth=3, cache_size=8):
+        self.cache_depth = cache_depth
+        self.cache_size = cache_size
+        self.keys = []
+        self.entries = {}
+        self.cache = {}
+        self.dirty = set()
+
+        self.lock = threading.Lock()
+        self.ready = False
+        self.backlog = []
+
+    def load(self, rows, now=None):
+        # Bulk build from (url, title, visit_count, last_visit) rows, may run off the GUI thread
+        now = now or time.time()
+        entries = {}
+        for url, title, visit_count, last_visit in rows:
+            key = match_key(url)
+            entry = entries.get(key)
+            score = frecency(visit_count, last_visit, now)
+            if entry is None or score > entry[2]:
+                entries[key] = [url, title, score]
+        keys = sorted(entries)
+
+        cache = {}
+        for key in keys:
+            score = entries[key][2]
+            for depth in range(1, min(self.cache_depth, len(key)) + 1):
+                best = cache.setdefault(key[:depth], [])
+                if len(best) < self.cache_size:
+                    heapq.heappush(best, (score, key))
+                elif score > best[0][0]:
+                    heapq.heapreplace(best, (score, key))
+        cache = {prefix: [key for score, key in sorted(best, reverse=True)] for prefix, best in cache.items()}
+
+        with self.lock:
+            self.entries = entries
+            self.keys = keys
+            self.cache = cache
+            self.ready = True
+            for args in self.backlog:
+                self.update(*args)
+            self.backlog = []
+
+    def add(self, url, title='', points=0):
+        # Raise the score of a url by some points (a visit, a bookmark), adding it if new
+        with self.lock:
+            if not self.ready:
+                self.backlog.append((url, title, points))
+                return
+            self.update(url, title, points)
+
+    def update(self, url, title, points):
+        key = match_key(url)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [url, title, 0]
+            bisect.insort(self.keys, key)
+        elif title:
+            entry[1] = title
+        entry[2] += points
+
+        for depth in range(1, min(self.cache_depth, len(key)) + 1):
+            prefix = key[:depth]
+            if prefix in self.dirty:
+                continue
+            best = self.cache.setdefault(prefix, [])
+            if key in best:
+                best.sort(key=lambda other: self.entries[other][2], reverse=True)
+            elif len(best) < self.cache_size or entry[2] > self.entries[best[-1]][2]:
+                best.append(key)
+                best.sort(key=lambda other: self.entries[other][2], reverse=True)
+                del best[self.cache_size:]
+
+    def remove_points(self, url, points):
+        # Scores going down can't be patched into the cached lists, recompute those lazily
+        with self.lock:
+            if not self.ready:
+                self.backlog.append((url, '', -points))
+                return
+            key = match_key(url)
+            if key in self.entries:
+                self.entries[key][2] -= points
+                for depth in range(1, min(self.cache_depth, len(key)) + 1):
+                    self.dirty.add(key[:depth])
+
+    def query(self, text, limit=8):
+        if not self.ready:
+            return []
+        prefix = match_key(text.strip())
+        if not prefix:
+            return []
+
+        if len(prefix) <= self.cache_depth and limit <= self.cache_size:
+            if prefix in self.dirty:
+                self.cache[prefix] = self.scan(prefix, self.cache_size)
+                self.dirty.discard(prefix)
+            keys = self.cache.get(prefix, [])[:limit]
+        else:
+            keys = self.scan(prefix, limit)
+        return [tuple(self.entries[key]) for key in keys]
+
+    def scan(self, prefix, limit):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\uffff', start)
+        return heapq.nlargest(limit, self.keys[start:end], key=lambda key: self.entries[key][2])
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class Omnibox:
+    # Suggestions for the url bar: the frecency index plus the tabs that are open right now.
+    # Queries are debounced, so fast typing only pays for the last keystroke. Listeners get
+    # (text, suggestions) after each query.
+    def __init__(self, url_bar, index, open_tabs, debounce_ms=30, limit=8):
+        self.url_bar = url_bar
+        self.index = index
+        self.open_tabs = open_tabs
+        self.limit = limit
+        self.listeners = []
+
+        self.model = QStandardItemModel()
+        self.completer = QCompleter(self.model, url_bar)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.completer.setCompletionRole(Qt.UserRole)
+        self.completer.setMaxVisibleItems(limit)
+        url_bar.setCompleter(self.completer)
+
+        self.debounce = QTimer()
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(debounce_ms)
+        self.debounce.timeout.connect(self.refresh)
+        url_bar.textEdited.connect(lambda text: self.debounce.start())
+
+    def suggestions(self, text):
+        key = match_key(text.strip())
+        results = {}
+        for url, title in self.open_tabs():
+            if key and match_key(url).startswith(key):
+                results[url] = (url, title, OPEN_TAB_BONUS)
+        for url, title, score in self.index.query(text, self.limit):
+            if url in results:
+                score += results[url][2]
+            results[url] = (url, title, score)
+        return sorted(results.values(), key=lambda result: result[2], reverse=True)[:self.limit]
+
+    def refresh(self):
+        text = self.url_bar.text()
+        suggestions = self.suggestions(text)
+        self.model.clear()
+        for url, title, score in suggestions:
+            item = QStandardItem(f"{title} - {url}" if title else url)
+            item.setData(url, Qt.UserRole)
+            self.model.appendRow(item)
+        if self.model.rowCount():
+            self.completer.complete()
+        else:
+            self.completer.popup().hide()
+        for listener in self.listeners:
+            listener(text, suggestions)
@@ -0,0 +1,25 @@
+import os
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def rss_bytes(pid):
+    # Resident memory of a process, 0 if it is gone or /proc is not available
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def cpu_seconds(pid):
+    # User plus system CPU time a process has used so far, None if it is gone
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name can contain spaces, the fields we want come after it
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, ValueError, IndexError):
+        return None
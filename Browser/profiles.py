@@ -0,0 +1,86 @@
+import os
+
+from PyQt5.QtWebEngineWidgets import QWebEngineProfile
+
+from newtab import SCHEME
+
+
+def directory_size(path):
+    size = 0
+    files = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except OSError:
+                pass
+    return size, files
+
+
+class ProfileManager:
+    # The QWebEngineProfile shared by every tab: persistent cookies and a disk HTTP cache
+    # at a configurable location and size, so revisited sites come from the cache.
+    def __init__(self, newtab_handler, storage_path, cache_path, cache_size_mb, parent=None):
+        self.newtab_handler = newtab_handler
+        # Downloads of both profiles go to download_requested once it is set
+        self.download_requested = None
+        self.interceptor = None
+
+        self.profile = QWebEngineProfile('Cwanda', parent)
+        self.profile.setPersistentStoragePath(storage_path)
+        self.profile.setCachePath(cache_path)
+        self.profile.setHttpCacheType(QWebEngineProfile.DiskHttpCache)
+        self.profile.setHttpCacheMaximumSize(cache_size_mb * 1024 * 1024)
+        self.profile.setPersistentCookiesPolicy(QWebEngineProfile.ForcePersistentCookies)
+        self.profile.installUrlSchemeHandler(SCHEME, newtab_handler)
+        self.profile.downloadRequested.connect(self.download)
+
+        self.parent = parent
+        self.incognito = None
+        self.incognito_tabs = 0
+
+    def set_interceptor(self, interceptor):
+        # Sees the requests of every tab, incognito ones included
+        self.interceptor = interceptor
+        self.profile.setUrlRequestInterceptor(interceptor)
+        if self.incognito is not None:
+            self.incognito.setUrlRequestInterceptor(interceptor)
+
+    def download(self, item):
+        if self.download_requested is not None:
+            self.download_requested(item)
+
+    def cache_stats(self):
+        used, files = directory_size(self.profile.cachePath())
+        return {
+            'path': self.profile.cachePath(),
+            'max_bytes': self.profile.httpCacheMaximumSize(),
+            'used_bytes': used,
+            'files': files,
+        }
+
+    def clear_cache(self):
+        self.profile.clearHttpCache()
+
+    def acquire_incognito(self):
+        # One off-the-record profile for all incognito tabs, created with the first of them.
+        # A profile without a storage name keeps its cache and cookies in memory only.
+        if self.incognito is None:
+            self.incognito = QWebEngineProfile(self.parent)
+            self.incognito.setHttpCacheType(QWebEngineProfile.MemoryHttpCache)
+            self.incognito.setPersistentCookiesPolicy(QWebEngineProfile.NoPersistentCookies)
+            self.incognito.installUrlSchemeHandler(SCHEME, self.newtab_handler)
+            self.incognito.downloadRequested.connect(self.download)
+            if self.interceptor is not None:
+                self.incognito.setUrlRequestInterceptor(self.interceptor)
+        self.incognito_tabs += 1
+        return self.incognito
+
+    def release_incognito(self):
+        # Called after the tab's view has been disposed; the profile's deleteLater is
+        # queued behind the pages' so it goes away only once nothing uses it
+        self.incognito_tabs -= 1
+        if self.incognito_tabs == 0:
+            self.incognito.deleteLater()
+            self.incognito = None
@@ -0,0 +1,332 @@
+import base64
+import json
+import os
+
+from PyQt5.QtCore import QTimer
+
+
+def encode_bytes(data):
+    return base64.b64encode(data).decode('ascii') if data else None
+
+
+def decode_bytes(text):
+    return base64.b64decode(text) if text else None
+
+
+class SessionStore:
+    # Keeps the open tabs of every window, each window's active tab and geometry on disk.
+    # Incognito tabs are never recorded. Every change is appended to a journal; once the
+    # journal gets long it is folded into a full snapshot that replaces the old one atomically.
+    # A crash loses at most the changes that were still waiting for the flush timer.
+    # Windows get their share through window(); one closed while others are still open is
+    # forgotten, the last one to close keeps its tabs for the next start.
+    def __init__(self, directory, compact_after=500, flush_interval=1000):
+        self.snapshot_path = os.path.join(directory, 'session.json')
+        self.journal_path = os.path.join(directory, 'session.journal')
+        self.compact_after = compact_after
+
+        self.records = {}
+        self.order = []
+        self.windows = {}
+        self.next_id = 1
+        self.next_window = 1
+        self.journal_lines = 0
+
+        self.live_tabs = {}
+        self.dirty = set()
+        self.pending = {}
+        self.open_windows = set()
+
+        clean = self.load()
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        if not clean:
+            self.compact()
+
+        self.flush_timer = QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(flush_interval)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def load(self):
+        # Returns False when the journal ended with a torn write
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            # Snapshots from before there were several windows hold a single one
+            windows = snapshot.get('windows') or [
+                {'id': 1, 'active': snapshot.get('active'), 'geometry': snapshot.get('geometry')}]
+            for window in windows:
+                self.window_state(window['id']).update(active=window['active'], geometry=window['geometry'])
+            for record in snapshot['tabs']:
+                record.setdefault('window', 1)
+                self.records[record['id']] = record
+                self.order.append(record['id'])
+                self.window_state(record['window'])
+            self.next_id = snapshot['next_id']
+
+        if not os.path.exists(self.journal_path):
+            return True
+        with open(self.journal_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    return False
+                self.apply(op)
+                self.journal_lines += 1
+        return True
+
+    def window_state(self, window_id):
+        self.next_window = max(self.next_window, window_id + 1)
+        return self.windows.setdefault(window_id, {'active': None, 'geometry': None})
+
+    def window_order(self, window_id):
+        return [i for i in self.order if self.records[i]['window'] == window_id]
+
+    def apply(self, op):
+        # Operations are idempotent so replaying a journal on top of a newer snapshot is harmless.
+        # Journals from before there were several windows have no window in their operations.
+        kind = op['op']
+        window_id = op.get('window', 1)
+        if kind == 'open':
+            record = {'id': op['id'], 'window': window_id, 'url': op['url'], 'title': op['title'],
+                      'history': None}
+            if op['id'] not in self.records:
+                # The index counts the tabs of that window only
+                siblings = self.window_order(window_id)
+                if op['index'] < len(siblings):
+                    self.order.insert(self.order.index(siblings[op['index']]), op['id'])
+                else:
+                    self.order.append(op['id'])
+            self.records[op['id']] = record
+            self.window_state(window_id)
+            self.next_id = max(self.next_id, op['id'] + 1)
+        elif kind == 'update':
+            if op['id'] in self.records:
+                self.records[op['id']].update(url=op['url'], title=op['title'], history=op['history'],
+                                              pinned=op.get('pinned', False))
+        elif kind == 'close':
+            if op['id'] in self.records:
+                del self.records[op['id']]
+                self.order.remove(op['id'])
+        elif kind == 'active':
+            self.window_state(window_id)['active'] = op['id']
+        elif kind == 'geometry':
+            self.window_state(window_id)['geometry'] = op['data']
+        elif kind == 'close_window':
+            for record_id in self.window_order(window_id):
+                del self.records[record_id]
+                self.order.remove(record_id)
+            self.windows.pop(window_id, None)
+
+    def record(self, op):
+        self.apply(op)
+        self.journal.write(json.dumps(op) + '\n')
+        self.journal.flush()
+        self.journal_lines += 1
+
+    def compact(self):
+        snapshot = {
+            'tabs': [self.records[i] for i in self.order],
+            'windows': [dict(state, id=window_id) for window_id, state in self.windows.items()],
+            'next_id': self.next_id,
+        }
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        self.journal.close()
+        self.journal = open(self.journal_path, 'w', encoding='utf-8')
+        self.journal_lines = 0
+
+    def saved_windows(self):
+        # Windows of the last run that still have tabs, in the order they were first opened
+        return [window_id for window_id in self.windows if self.window_order(window_id)]
+
+    def window(self, window_id=None):
+        # A saved window to bring back, or a new one
+        if window_id is None:
+            window_id = self.next_window
+        self.window_state(window_id)
+        self.open_windows.add(window_id)
+        return SessionWindow(self, window_id)
+
+    def saved_tabs(self, window_id):
+        return [self.records[i] for i in self.window_order(window_id)]
+
+    def active_index(self, window_id):
+        order = self.window_order(window_id)
+        active = self.windows[window_id]['active']
+        return order.index(active) if active in order else 0
+
+    def history_of(self, record):
+        return decode_bytes(record['history'])
+
+    def attach(self, tab, record_id):
+        tab.session_id = record_id
+        self.live_tabs[record_id] = tab
+
+    def tab_opened(self, tab, index, window_id):
+        if tab.incognito:
+            return
+        tab.session_id = self.next_id
+        self.live_tabs[tab.session_id] = tab
+        self.record({'op': 'open', 'id': tab.session_id, 'window': window_id, 'index': index,
+                     'url': tab.url.toString(), 'title': tab.title})
+
+    def tab_closed(self, tab):
+        if tab.incognito:
+            return
+        self.live_tabs.pop(tab.session_id, None)
+        self.dirty.discard(tab.session_id)
+        self.record({'op': 'close', 'id': tab.session_id})
+
+    def tab_changed(self, tab):
+        if tab.incognito:
+            return
+        self.dirty.add(tab.session_id)
+        self.schedule_flush()
+
+    def active_changed(self, tab, window_id):
+        if tab.incognito:
+            return
+        self.pending[('active', window_id)] = tab.session_id
+        self.schedule_flush()
+
+    def geometry_changed(self, geometry, window_id):
+        self.pending[('geometry', window_id)] = encode_bytes(geometry)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        # Tabs of a closing window can still emit changes after close()
+        if self.journal.closed:
+            return
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        self.flush_timer.stop()
+        for record_id in self.dirty:
+            tab = self.live_tabs.get(record_id)
+            if tab is None or record_id not in self.records:
+                continue
+            if tab.is_materialized() and tab.view.history().count():
+                history = tab.save_history()
+            else:
+                history = tab.history_state
+            self.record({'op': 'update', 'id': record_id, 'url': tab.url.toString(),
+                         'title': tab.title, 'history': encode_bytes(history), 'pinned': tab.pinned})
+        self.dirty.clear()
+
+        for (kind, window_id), value in self.pending.items():
+            if window_id not in self.windows or value == self.windows[window_id][kind]:
+                continue
+            if kind == 'active':
+                self.record({'op': 'active', 'window': window_id, 'id': value})
+            else:
+                self.record({'op': 'geometry', 'window': window_id, 'data': value})
+        self.pending.clear()
+
+        if self.journal_lines >= self.compact_after:
+            self.compact()
+
+    def window_closed(self, window_id):
+        if self.journal.closed:
+            return
+        self.open_windows.discard(window_id)
+        if not self.open_windows:
+            self.close()
+            return
+        # Other windows keep running, so this one is gone for good
+        for record_id in self.window_order(window_id):
+            self.live_tabs.pop(record_id, None)
+            self.dirty.discard(record_id)
+        self.pending = {key: value for key, value in self.pending.items() if key[1] != window_id}
+        self.record({'op': 'close_window', 'window': window_id})
+
+    def close(self):
+        if self.journal.closed:
+            return
+        self.flush()
+        self.compact()
+        self.journal.close()
+        self.live_tabs.clear()
+
+
+class SessionWindow:
+    # One window's part of a SessionStore, what Browser records its tabs through
+    def __init__(self, store, window_id):
+        self.store = store
+        self.window_id = window_id
+
+    @property
+    def geometry(self):
+        return self.store.windows[self.window_id]['geometry']
+
+    def saved_tabs(self):
+        return self.store.saved_tabs(self.window_id)
+
+    def active_index(self):
+        return self.store.active_index(self.window_id)
+
+    def history_of(self, record):
+        return self.store.history_of(record)
+
+    def attach(self, tab, record_id):
+        self.store.attach(tab, record_id)
+
+    def tab_opened(self, tab, index):
+        self.store.tab_opened(tab, index, self.window_id)
+
+    def tab_closed(self, tab):
+        self.store.tab_closed(tab)
+
+    def tab_changed(self, tab):
+        self.store.tab_changed(tab)
+
+    def active_changed(self, tab):
+        self.store.active_changed(tab, self.window_id)
+
+    def geometry_changed(self, geometry):
+        self.store.geometry_changed(geometry, self.window_id)
+
+    def close(self):
+        self.store.window_closed(self.window_id)
+
+
+class TransientSession:
+    # Stands in for a SessionWindow where nothing is saved or brought back, like headless runs
+    geometry = None
+
+    def saved_tabs(self):
+        return []
+
+    def active_index(self):
+        return 0
+
+    def history_of(self, record):
+        return None
+
+    def attach(self, tab, record_id):
+        pass
+
+    def tab_opened(self, tab, index):
+        pass
+
+    def tab_closed(self, tab):
+        pass
+
+    def tab_changed(self, tab):
+        pass
+
+    def active_changed(self, tab):
+        pass
+
+    def geometry_changed(self, geometry):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,331 @@
+import json
+import time
+from collections import OrderedDict, deque
+
+from PyQt5.QtCore import QTimer, QUrl
+from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineScript
+
+from favicons import origin_of
+from procstat import rss_bytes
+from tabs import dispose_view
+from telemetry import percentile
+
+
+# A request to the host, run in the speculator's own blank page: no cookies, no referrer
+# and no Origin header, so the site learns nothing about the user or the page they are on.
+# It is made for its DNS lookup, which lands in the profile's host cache. Requests without
+# credentials get their own connections, which navigations don't use, so only the lookup
+# is saved. <link rel=dns-prefetch> and preconnect do nothing in this QtWebEngine. A HEAD for
+# the favicon is cheap for the server and the answer isn't read.
+PREFETCH_JS = ("fetch(%s + '/favicon.ico', {method: 'HEAD', mode: 'no-cors', credentials: 'omit', "
+               "referrerPolicy: 'no-referrer', cache: 'no-store'}).catch(() => null); null")
+
+# Navigations remembered until their timings come in from the telemetry
+RECENT_NAVIGATIONS = 200
+
+
+def predicted_url(text):
+    # Where navigate_to_url would go for what is typed, if it looks like an address
+    text = text.strip()
+    if not text or ' ' in text:
+        return None
+    q = QUrl(text)
+    if q.scheme() not in ('http', 'https'):
+        q = QUrl('https://' + text)
+    host = q.host()
+    if not host or ('.' not in host and host != 'localhost'):
+        return None
+    return q
+
+
+def prediction(suggestions):
+    # The top of (url, title, score) suggestions and how likely it is to be picked: its
+    # share of their total score
+    total = sum(max(score, 0) for url, title, score in suggestions)
+    if not suggestions or total <= 0:
+        return None, 0.0
+    url, title, score = suggestions[0]
+    return url, max(score, 0) / total
+
+
+def same_page(a, b):
+    # Urls that load the same document
+    flags = QUrl.StripTrailingSlash | QUrl.RemoveFragment | QUrl.NormalizePathSegments
+    return a.adjusted(flags) == b.adjusted(flags)
+
+
+class Speculator:
+    # DNS prefetch: host names looked up ahead of a navigation that is likely to come, for
+    # the host being typed, the top omnibox suggestions (the frecency index learned from
+    # history) and hovered links. Hints are debounced, and at most max_hosts hosts are
+    # prefetched at a time; one not navigated to within ttl_s is counted as wasted. The
+    # lookups go out from a hidden blank view of the shared profile, created on the first
+    # hint, so they fill the tabs' host cache; nothing runs in the user's pages.
+    def __init__(self, create_view, max_hosts=4, ttl_s=10, debounce_ms=100, enabled=True):
+        self.create_view = create_view
+        self.max_hosts = max_hosts
+        self.ttl_s = ttl_s
+        self.enabled = enabled
+        self.view = None
+        self.ready = False
+
+        # origin: time its host was looked up
+        self.prefetched = {}
+        self.lookups = 0
+        self.hits = 0
+        self.wasted = 0
+        self.limited = 0
+        self.navigations = 0
+        # url: whether its navigation's host was prefetched, until its timings come in
+        self.recent = OrderedDict()
+        self.response_start = {True: deque(maxlen=500), False: deque(maxlen=500)}
+
+        self.pending = None
+        self.debounce = QTimer()
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(debounce_ms)
+        self.debounce.timeout.connect(self.flush)
+
+    def hint(self, urls):
+        # Replaces the previous hint, only what is still wanted after the pause is looked up
+        if not self.enabled:
+            return
+        self.pending = urls
+        self.debounce.start()
+
+    def flush(self):
+        if self.pending is None:
+            return
+        if not self.ready:
+            # The hint waits for the blank page, which flushes again once it has loaded
+            if self.view is None:
+                self.view = self.create_view()
+                self.view.loadFinished.connect(self.page_loaded)
+                self.view.setUrl(QUrl('about:blank'))
+            return
+        urls, self.pending = self.pending, None
+        for url in urls:
+            self.speculate(url)
+
+    def page_loaded(self, ok):
+        self.ready = True
+        self.flush()
+
+    def speculate(self, url):
+        q = QUrl(url) if isinstance(url, str) else url
+        if not self.enabled or not self.ready or q.scheme() not in ('http', 'https') or not q.host():
+            return False
+        origin = origin_of(q)
+        self.expire()
+        if origin in self.prefetched:
+            return False
+        if len(self.prefetched) >= self.max_hosts:
+            self.limited += 1
+            return False
+        self.view.page().runJavaScript(PREFETCH_JS % json.dumps(origin), QWebEngineScript.ApplicationWorld)
+        self.prefetched[origin] = time.monotonic()
+        self.lookups += 1
+        return True
+
+    def expire(self):
+        now = time.monotonic()
+        for origin, looked_up in list(self.prefetched.items()):
+            if now - looked_up > self.ttl_s:
+                del self.prefetched[origin]
+                self.wasted += 1
+
+    def watch(self, view):
+        # A navigation is counted once it finished, when the view's url is where it went
+        view.loadFinished.connect(lambda ok: self.navigated(view.url()))
+
+    def navigated(self, q):
+        if q.scheme() not in ('http', 'https'):
+            return
+        hit = self.prefetched.pop(origin_of(q), None) is not None
+        self.expire()
+        self.navigations += 1
+        self.hits += hit
+        self.recent[q.toString()] = hit
+        while len(self.recent) > RECENT_NAVIGATIONS:
+            self.recent.popitem(last=False)
+
+    def record(self, record):
+        # Telemetry listener, the time to first byte of navigations with and without a prefetch
+        hit = self.recent.pop(record['url'], None)
+        if hit is not None and record['response_start'] is not None:
+            self.response_start[hit].append(record['response_start'])
+
+    def stats(self):
+        self.expire()
+        prefetched = sorted(self.response_start[True])
+        cold = sorted(self.response_start[False])
+        return {
+            'enabled': self.enabled,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'wasted': self.wasted,
+            'pending': len(self.prefetched),
+            'limited': self.limited,
+            'navigations': self.navigations,
+            # Of the prefetched hosts, how many were navigated to, and of the navigations, how
+            # many went to a prefetched host
+            'hit_rate': self.hits / (self.hits + self.wasted) if self.hits + self.wasted else None,
+            'coverage': self.hits / self.navigations if self.navigations else None,
+            'prefetched_response_start_p50': percentile(prefetched, 50),
+            'cold_response_start_p50': percentile(cold, 50),
+        }
+
+    def clear(self):
+        self.debounce.stop()
+        self.pending = None
+        if self.view is not None:
+            dispose_view(self.view)
+            self.view = None
+            self.ready = False
+
+
+class Prerenderer:
+    # The single likeliest next page loaded ahead into a hidden view, which the tab that
+    # navigates there takes over instead of loading the page itself. There is one
+    # prerender at a time: a prediction for another url replaces it, a navigation
+    # elsewhere cancels it, and so does its renderer going over max_mb or it not being
+    # used within ttl_s. Every prerender that didn't end up in a tab is counted as wasted.
+    # A loaded prerender is frozen, so its scripts don't run until a tab takes it.
+    def __init__(self, create_view, max_mb=300, ttl_s=30, min_confidence=0.6, debounce_ms=300,
+                 enabled=False):
+        self.create_view = create_view
+        self.max_bytes = max_mb * 1024 * 1024
+        self.min_confidence = min_confidence
+        self.enabled = enabled
+
+        self.view = None
+        self.url = None
+        self.ready = False
+        self.started = 0
+        self.hits = 0
+        self.wasted = 0
+        self.over_memory = 0
+        # Seconds from a prerender starting to its page having loaded
+        self.load_s = deque(maxlen=100)
+        self.started_at = 0.0
+
+        self.pending = None
+        self.debounce = QTimer()
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(debounce_ms)
+        self.debounce.timeout.connect(self.flush)
+
+        self.expiry = QTimer()
+        self.expiry.setSingleShot(True)
+        self.expiry.setInterval(ttl_s * 1000)
+        self.expiry.timeout.connect(self.cancel)
+
+        # The renderer grows while the page loads and runs, so it is looked at every second
+        self.memory_check = QTimer()
+        self.memory_check.setInterval(1000)
+        self.memory_check.timeout.connect(self.check_memory)
+
+    def hint(self, url, confidence):
+        # Only a confident prediction starts a prerender, the last one after the pause wins
+        if not self.enabled or url is None or confidence < self.min_confidence:
+            return
+        q = QUrl(url) if isinstance(url, str) else url
+        if q.scheme() not in ('http', 'https'):
+            return
+        self.pending = q
+        self.debounce.start()
+
+    def flush(self):
+        if self.pending is None:
+            return
+        q, self.pending = self.pending, None
+        self.prerender(q)
+
+    def prerender(self, q):
+        if self.url is not None and same_page(self.url, q):
+            return
+        self.cancel()
+        self.view = self.create_view()
+        self.url = q
+        self.ready = False
+        self.started += 1
+        self.started_at = time.monotonic()
+        self.view.loadFinished.connect(self.loaded)
+        self.view.setUrl(q)
+        self.expiry.start()
+        self.memory_check.start()
+
+    def loaded(self, ok):
+        if not ok:
+            self.cancel()
+            return
+        if not self.ready:
+            self.ready = True
+            self.load_s.append(time.monotonic() - self.started_at)
+        self.check_memory()
+        if self.view is not None:
+            self.view.page().setLifecycleState(QWebEnginePage.LifecycleState.Frozen)
+
+    def memory_usage(self):
+        # The renderer can be shared with tabs of the same site, so this errs on the high side
+        pid = self.view.page().renderProcessPid() if self.view is not None else 0
+        return rss_bytes(pid) if pid else 0
+
+    def check_memory(self):
+        if self.view is not None and self.memory_usage() > self.max_bytes:
+            self.over_memory += 1
+            self.cancel()
+
+    def matches(self, q):
+        # The url asked for, or where it redirected to
+        return self.view is not None and (same_page(self.url, q) or same_page(self.view.url(), q))
+
+    def take(self, q):
+        # The view for a navigation to q, or None; a prerender of another page is dropped
+        self.debounce.stop()
+        self.pending = None
+        if self.view is None:
+            return None
+        if not self.matches(q):
+            self.cancel()
+            return None
+        view = self.view
+        view.loadFinished.disconnect(self.loaded)
+        view.page().setLifecycleState(QWebEnginePage.LifecycleState.Active)
+        self.view = None
+        self.url = None
+        self.expiry.stop()
+        self.memory_check.stop()
+        self.hits += 1
+        return view
+
+    def cancel(self):
+        self.expiry.stop()
+        self.memory_check.stop()
+        if self.view is None:
+            return
+        view = self.view
+        self.view = None
+        self.url = None
+        self.wasted += 1
+        dispose_view(view)
+
+    def clear(self):
+        self.debounce.stop()
+        self.pending = None
+        self.cancel()
+
+    def stats(self):
+        load = sorted(self.load_s)
+        return {
+            'enabled': self.enabled,
+            'started': self.started,
+            'hits': self.hits,
+            'wasted': self.wasted,
+            'over_memory': self.over_memory,
+            'current': self.url.toString() if self.url is not None else None,
+            'ready': self.ready and self.view is not None,
+            'memory_usage': self.memory_usage(),
+            'hit_rate': self.hits / (self.hits + self.wasted) if self.hits + self.wasted else None,
+            'load_p50_s': percentile(load, 50),
+        }
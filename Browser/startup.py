@@ -0,0 +1,43 @@
+import json
+import time
+
+
+class StartupProfile:
+    # Milliseconds from the moment Cwanda started importing to each startup phase.
+    # With an output set, the phases are written as JSON once the ones in wait_for are in.
+    def __init__(self, wait_for=('start_page_loaded', 'deferred_done')):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.waiting = set(wait_for)
+        self.output = None
+
+    def mark(self, phase):
+        if phase in self.phases:
+            return
+        self.phases[phase] = round((time.perf_counter() - self.started) * 1000, 1)
+        self.waiting.discard(phase)
+        if not self.waiting and self.output is not None:
+            self.dump()
+
+    def dump(self):
+        text = json.dumps(self.phases)
+        if self.output == '-':
+            print(text, flush=True)
+        else:
+            with open(self.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        self.output = None
+
+
+def profile_output(argv):
+    # --profile-startup prints the phases, --profile-startup=path writes them to a file
+    for arg in argv:
+        if arg == '--profile-startup':
+            return '-'
+        if arg.startswith('--profile-startup='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+# Created on import, which Cwanda.py does before importing Qt
+startup_profile = StartupProfile()
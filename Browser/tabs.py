@@ -0,0 +1,258 @@
+import time
+from collections import OrderedDict
+
+from PyQt5.QtCore import QUrl, QPointF, QByteArray, QDataStream, QIODevice, QTimer
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QWidget, QVBoxLayout
+from PyQt5.QtWebEngineWidgets import QWebEnginePage
+
+from procstat import rss_bytes
+
+
+def dispose_view(view):
+    # Tear a web view down completely so neither the widget nor its renderer outlive the tab.
+    # Disconnecting also drops the lambdas connected in materialize_tab, and the telemetry's,
+    # and what they capture.
+    for signal in (view.urlChanged, view.titleChanged, view.iconChanged, view.loadStarted, view.loadProgress,
+                   view.loadFinished):
+        try:
+            signal.disconnect()
+        except TypeError:
+            pass
+    view.stop()
+    page = view.page()
+    view.hide()
+    page.deleteLater()
+    view.deleteLater()
+
+
+class TabPage(QWebEnginePage):
+    # The page of every web view. link_clicked, when set, is asked about each link clicked
+    # in the main frame and can take the navigation over by returning True.
+    def __init__(self, profile, parent=None):
+        super().__init__(profile, parent)
+        self.link_clicked = None
+
+    def acceptNavigationRequest(self, url, kind, main_frame):
+        if (main_frame and kind == QWebEnginePage.NavigationTypeLinkClicked and self.link_clicked is not None
+                and self.link_clicked(url)):
+            return False
+        return super().acceptNavigationRequest(url, kind, main_frame)
+
+
+class LazyTab(QWidget):
+    # Lightweight page for a tab in browser_tabs. It only keeps the url, title and icon
+    # until the tab is shown for the first time, then hosts the real QWebEngineView.
+    # A discarded tab goes back to this state but also remembers its history and scroll position.
+    def __init__(self, url, title="New Tab", icon=None, incognito=False, parent=None):
+        super().__init__(parent)
+        self.url = QUrl(url)
+        self.title = title
+        self.icon = icon if icon is not None else QIcon()
+        self.incognito = incognito
+        self.profile = None
+        self.view = None
+        self.last_active = 0.0
+        self.session_id = None
+        self.history_state = None
+        # The document last recorded as a visit to history, without its fragment
+        self.visited_url = None
+        # The back/forward list of the view a prerendered page replaced
+        self.previous_history = None
+        # Pictures of pages left, by back/forward list entry (see backforward.py)
+        self.snapshots = OrderedDict()
+        self.scroll_position = QPointF()
+        self.network_bytes = None
+        self.pinned = False
+        self.hidden_since = None
+
+        self.tab_layout = QVBoxLayout(self)
+        self.tab_layout.setContentsMargins(0, 0, 0, 0)
+        self.tab_layout.setSpacing(0)
+
+    def is_materialized(self):
+        return self.view is not None
+
+    def set_view(self, view):
+        self.view = view
+        self.tab_layout.addWidget(view)
+
+    def restore_history(self):
+        # Load the saved back/forward list into the view, this also navigates to the current entry
+        if self.history_state is None:
+            return False
+        data = QByteArray(self.history_state)
+        stream = QDataStream(data, QIODevice.ReadOnly)
+        stream >> self.view.history()
+        self.history_state = None
+        return True
+
+    def save_history(self):
+        data = QByteArray()
+        stream = QDataStream(data, QIODevice.WriteOnly)
+        stream << self.view.history()
+        return bytes(data)
+
+    def renderer_pid(self):
+        if self.view is None:
+            return 0
+        return self.view.page().renderProcessPid()
+
+    def discard(self):
+        # Drop the web view and keep just enough to rebuild it later
+        view = self.view
+        if not view.url().isEmpty():
+            self.url = view.url()
+        # A tab discarded before its first navigation committed has no history to keep
+        if view.history().count():
+            self.history_state = self.save_history()
+        self.scroll_position = view.page().scrollPosition()
+        self.snapshots.clear()
+        self.tab_layout.removeWidget(view)
+        self.view = None
+        dispose_view(view)
+
+    def replace_view(self, view):
+        # A prerendered page takes the view's place. Its own history only has that page, so
+        # the old list is kept for going back past it.
+        old = self.view
+        if old.history().count():
+            self.previous_history = self.save_history()
+        self.tab_layout.removeWidget(old)
+        self.view = None
+        dispose_view(old)
+        self.set_view(view)
+
+    def dispose(self):
+        # Called once the tab has been removed from browser_tabs
+        if self.view is not None:
+            view = self.view
+            self.tab_layout.removeWidget(view)
+            self.view = None
+            dispose_view(view)
+        self.history_state = None
+        self.previous_history = None
+        self.snapshots.clear()
+        self.deleteLater()
+
+
+class TabManager:
+    # Tracks when each tab was last activated and discards the least recently used
+    # background views once the live tab count or renderer memory goes over budget.
+    # Pinned tabs are never discarded.
+    def __init__(self, browser_tabs, max_live_tabs=12, memory_budget_mb=2048):
+        self.browser_tabs = browser_tabs
+        self.max_live_tabs = max_live_tabs
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.evictions = 0
+        self.reclaimed_bytes = 0
+
+    def tabs(self):
+        return [self.browser_tabs.widget(i) for i in range(self.browser_tabs.count())]
+
+    def live_tabs(self):
+        return [tab for tab in self.tabs() if tab.is_materialized()]
+
+    def memory_usage(self):
+        # Tabs from the same site can share a renderer, so count every process once
+        pids = {tab.renderer_pid() for tab in self.live_tabs()}
+        return sum(rss_bytes(pid) for pid in pids if pid)
+
+    def activated(self, tab):
+        tab.last_active = time.monotonic()
+        self.enforce_budget()
+
+    def enforce_budget(self):
+        current = self.browser_tabs.currentWidget()
+        live = self.live_tabs()
+        candidates = sorted((tab for tab in live if tab is not current and not tab.pinned),
+                            key=lambda tab: tab.last_active)
+        usage = self.memory_usage()
+
+        while candidates and (len(live) > self.max_live_tabs or usage > self.memory_budget):
+            tab = candidates.pop(0)
+            live.remove(tab)
+            reclaimed = self.evict(tab, live)
+            usage -= reclaimed
+
+    def evict(self, tab, live=None):
+        if live is None:
+            live = [other for other in self.live_tabs() if other is not tab]
+
+        # Memory only comes back if no other live tab uses the same renderer
+        pid = tab.renderer_pid()
+        shared = any(other.renderer_pid() == pid for other in live)
+        reclaimed = 0 if shared or not pid else rss_bytes(pid)
+
+        tab.discard()
+        self.evictions += 1
+        self.reclaimed_bytes += reclaimed
+        return reclaimed
+
+    def stats(self):
+        return {
+            'live_tabs': len(self.live_tabs()),
+            'total_tabs': self.browser_tabs.count(),
+            'evictions': self.evictions,
+            'reclaimed_bytes': self.reclaimed_bytes,
+            'memory_usage': self.memory_usage(),
+        }
+
+
+class ViewPool:
+    # A few hidden web views with the start page already loaded, so a new tab can take
+    # one instead of building a view and loading the page. Taken views are replaced
+    # one at a time from a zero timer, i.e. whenever the event loop is idle. Nothing is
+    # created until start(). Waiting views are frozen once loaded, so the start page's
+    # scripts don't run until a tab takes one.
+    def __init__(self, create_view, url, size=2):
+        self.create_view = create_view
+        self.url = QUrl(url)
+        self.size = size
+        self.views = []
+        self.hits = 0
+        self.misses = 0
+
+        self.refill_timer = QTimer()
+        self.refill_timer.setSingleShot(True)
+        self.refill_timer.setInterval(0)
+        self.refill_timer.timeout.connect(self.refill)
+
+    def start(self):
+        self.refill_timer.start()
+
+    def take(self, url):
+        if url != self.url:
+            return None
+        if not self.views:
+            self.misses += 1
+            self.refill_timer.start()
+            return None
+        self.hits += 1
+        self.refill_timer.start()
+        view = self.views.pop(0)
+        view.page().setLifecycleState(QWebEnginePage.LifecycleState.Active)
+        return view
+
+    def refill(self):
+        if len(self.views) >= self.size:
+            return
+        view = self.create_view()
+        view.loadFinished.connect(lambda ok: self.freeze(view))
+        view.setUrl(self.url)
+        self.views.append(view)
+        if len(self.views) < self.size:
+            self.refill_timer.start()
+
+    def freeze(self, view):
+        if view in self.views:
+            view.page().setLifecycleState(QWebEnginePage.LifecycleState.Frozen)
+
+    def clear(self):
+        self.refill_timer.stop()
+        for view in self.views:
+            dispose_view(view)
+        self.views = []
+
+    def stats(self):
+        return {'size': self.size, 'ready': len(self.views), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,219 @@
+import csv
+import os
+import signal
+import time
+from collections import deque
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton,
+                             QLabel, QFileDialog, QHeaderView, QAbstractItemView)
+
+from procstat import cpu_seconds, rss_bytes
+
+
+# Bytes the page has transferred, from the Navigation and Resource Timing entries.
+# Cross-origin resources without Timing-Allow-Origin report 0, so this is a lower bound.
+NETWORK_BYTES_JS = """(() => {
+    let total = 0;
+    for (const entry of performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'))) {
+        total += entry.transferSize || 0;
+    }
+    return total;
+})()"""
+
+MIN_CPU_WINDOW = 0.5
+
+CSV_FIELDS = ['time', 'title', 'url', 'pid', 'shared', 'cpu_percent', 'rss_bytes', 'network_bytes']
+
+
+class ResourceMonitor:
+    # Samples what every live tab costs: CPU and memory of its renderer process from /proc,
+    # and the bytes its page loaded. Tabs without a view cost nothing and are left out, so
+    # a tick is one /proc read per process and one script per live tab, and the timer only
+    # runs while someone is looking.
+    def __init__(self, tab_manager, interval_ms=2000, keep=10000):
+        self.tab_manager = tab_manager
+        self.samples = deque(maxlen=keep)
+        self.latest = []
+        self.cpu_times = {}
+        self.listeners = []
+
+        self.timer = QTimer()
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.sample)
+
+    def start(self):
+        self.sample()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def cpu_percent(self, pid, now):
+        # Share of one core since the previous sample, None on the first one. CPU time
+        # is counted in clock ticks, so samples closer together than MIN_CPU_WINDOW
+        # repeat the last figure instead of measuring over a few ticks.
+        used = cpu_seconds(pid)
+        previous = self.cpu_times.get(pid)
+        if used is None:
+            return None
+        if previous is None:
+            self.cpu_times[pid] = (used, now, None)
+            return None
+        if now - previous[1] < MIN_CPU_WINDOW:
+            return previous[2]
+        percent = round(100 * (used - previous[0]) / (now - previous[1]), 1)
+        self.cpu_times[pid] = (used, now, percent)
+        return percent
+
+    def sample(self):
+        now = time.monotonic()
+        live = self.tab_manager.live_tabs()
+        pids = [tab.renderer_pid() for tab in live]
+        usage = {pid: (self.cpu_percent(pid, now), rss_bytes(pid)) for pid in set(pids) | {os.getpid()} if pid}
+
+        rows = [{'tab': None, 'title': "Browser", 'url': '', 'pid': os.getpid(), 'shared': False,
+                 'cpu_percent': usage[os.getpid()][0], 'rss_bytes': usage[os.getpid()][1], 'network_bytes': None}]
+        for tab, pid in zip(live, pids):
+            tab.view.page().runJavaScript(NETWORK_BYTES_JS, lambda value, tab=tab: self.network_measured(tab, value))
+            cpu, rss = usage.get(pid, (None, 0))
+            rows.append({'tab': tab, 'title': tab.title, 'url': tab.url.toString(), 'pid': pid,
+                         'shared': pids.count(pid) > 1, 'cpu_percent': cpu, 'rss_bytes': rss,
+                         'network_bytes': tab.network_bytes})
+
+        # Processes that went away
+        for pid in list(self.cpu_times):
+            if pid not in usage:
+                del self.cpu_times[pid]
+
+        stamp = time.time()
+        for row in rows:
+            self.samples.append(dict({key: row[key] for key in CSV_FIELDS[1:]}, time=stamp))
+        self.latest = rows
+        for listener in self.listeners:
+            listener(rows)
+
+    def network_measured(self, tab, value):
+        if isinstance(value, (int, float)):
+            tab.network_bytes = int(value)
+
+    def export_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.samples)
+        return len(self.samples)
+
+
+class NumberItem(QTableWidgetItem):
+    # Sorts by the number rather than the text shown
+    def __init__(self, value, text):
+        super().__init__(text)
+        self.value = value if value is not None else -1
+
+    def __lt__(self, other):
+        if isinstance(other, NumberItem):
+            return self.value < other.value
+        return super().__lt__(other)
+
+
+class TaskManagerDialog(QDialog):
+    COLUMNS = ["Tab", "Process", "CPU %", "Memory (MB)", "Network (KB)"]
+
+    def __init__(self, monitor, browser, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Task Manager")
+        self.resize(800, 450)
+        self.monitor = monitor
+        self.browser = browser
+        self.rows = []
+
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(2, Qt.DescendingOrder)
+        layout.addWidget(self.table)
+
+        self.status = QLabel()
+        layout.addWidget(self.status)
+
+        buttons = QHBoxLayout()
+        for label, action in (("Discard Tab", self.discard_selected), ("End Process", self.kill_selected),
+                              ("Export CSV", self.export)):
+            button = QPushButton(label)
+            button.clicked.connect(action)
+            buttons.addWidget(button)
+        layout.addLayout(buttons)
+
+        self.monitor.listeners.append(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.monitor.start()
+
+    def hideEvent(self, event):
+        self.monitor.stop()
+        super().hideEvent(event)
+
+    def refresh(self, rows):
+        selected = self.selected()
+        self.table.setSortingEnabled(False)
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            process = f"{row['pid']} (shared)" if row['shared'] else str(row['pid'])
+            cpu = row['cpu_percent']
+            network = row['network_bytes']
+            items = [QTableWidgetItem(row['title'] or row['url']),
+                     NumberItem(row['pid'], process),
+                     NumberItem(cpu, f"{cpu:.1f}" if cpu is not None else "-"),
+                     NumberItem(row['rss_bytes'], f"{row['rss_bytes'] / 1048576:.1f}"),
+                     NumberItem(network, f"{network / 1024:.0f}" if network is not None else "-")]
+            items[0].setData(Qt.UserRole, i)
+            for column, item in enumerate(items):
+                self.table.setItem(i, column, item)
+        self.rows = rows
+        self.table.setSortingEnabled(True)
+
+        # Keep the selection on the same tab across refreshes
+        for i in range(self.table.rowCount()):
+            if selected is not None and rows[self.table.item(i, 0).data(Qt.UserRole)]['tab'] is selected['tab']:
+                self.table.selectRow(i)
+
+    def selected(self):
+        items = self.table.selectedItems()
+        if not items:
+            return None
+        return self.rows[self.table.item(items[0].row(), 0).data(Qt.UserRole)]
+
+    def discard_selected(self):
+        row = self.selected()
+        if row is None or row['tab'] is None or not row['tab'].is_materialized():
+            return
+        if row['tab'] is self.browser.browser_tabs.currentWidget():
+            self.status.setText("The current tab can't be discarded, switch to another tab first.")
+            return
+        reclaimed = self.browser.tab_manager.evict(row['tab'])
+        self.status.setText(f"Discarded {row['title']}, {reclaimed / 1048576:.1f} MB reclaimed.")
+        self.monitor.sample()
+
+    def kill_selected(self):
+        row = self.selected()
+        if row is None or not row['pid'] or row['pid'] == os.getpid():
+            return
+        try:
+            os.kill(row['pid'], signal.SIGTERM)
+        except OSError as error:
+            self.status.setText(f"Could not end process {row['pid']}: {error}")
+            return
+        self.status.setText(f"Ended process {row['pid']}, reload its tabs to bring them back.")
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Samples", "cwanda-tasks.csv", "CSV files (*.csv)")
+        if path:
+            count = self.monitor.export_csv(path)
+            self.status.setText(f"Exported {count} samples to {path}")
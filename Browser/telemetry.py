@@ -0,0 +1,210 @@
+import csv
+import html
+import json
+import math
+import time
+from collections import deque
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QLabel
+
+from favicons import origin_of
+
+
+# Navigation and Paint Timing of the page's current document, in ms from the start of the navigation
+NAVIGATION_TIMING_JS = """(() => {
+    const nav = performance.getEntriesByType('navigation')[0];
+    if (!nav) return null;
+    const paint = name => {
+        const entry = performance.getEntriesByName(name)[0];
+        return entry ? entry.startTime : null;
+    };
+    return {
+        url: location.href,
+        response_start: nav.responseStart,
+        response_end: nav.responseEnd,
+        dom_content_loaded: nav.domContentLoadedEventEnd,
+        load_event_end: nav.loadEventEnd,
+        first_paint: paint('first-paint'),
+        first_contentful_paint: paint('first-contentful-paint'),
+        transfer_size: nav.transferSize,
+    };
+})()"""
+
+PAGE_FIELDS = ['response_start', 'response_end', 'dom_content_loaded', 'load_event_end', 'first_paint',
+               'first_contentful_paint', 'transfer_size']
+
+CSV_FIELDS = ['time', 'url', 'origin', 'ok', 'load_ms', 'first_progress_ms'] + PAGE_FIELDS
+
+# The first paint usually comes after loadFinished, so it is looked for a few more times
+PAINT_RETRIES = 10
+PAINT_RETRY_MS = 100
+
+# What the per-origin summary reports percentiles of
+SUMMARY_FIELDS = ['load_ms', 'response_start', 'first_contentful_paint']
+
+
+def percentile(values, p):
+    # Nearest rank, values sorted
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class PageLoadTelemetry:
+    # One record per navigation of a tab's view: the time from loadStarted to the first
+    # loadProgress and to loadFinished, measured here, and the page's own Navigation and
+    # Paint Timing, read with a script once it finished (and again shortly after, until the
+    # page has painted). The last `keep` records are kept in a ring buffer and summarised
+    # per origin on demand.
+    def __init__(self, keep=5000):
+        self.records = deque(maxlen=keep)
+        self.listeners = []
+
+    def watch(self, view):
+        trace = {}
+
+        def started():
+            trace.clear()
+            trace['started'] = time.perf_counter()
+
+        def progress(percent):
+            if 'started' in trace and 'first_progress' not in trace and percent > 0:
+                trace['first_progress'] = time.perf_counter()
+
+        def finished(ok):
+            if 'started' not in trace:
+                return
+            now = time.perf_counter()
+            record = {
+                'time': time.time(),
+                'url': view.url().toString(),
+                'origin': origin_of(view.url()) or view.url().scheme(),
+                'ok': ok,
+                'load_ms': round((now - trace['started']) * 1000, 1),
+                'first_progress_ms': (round((trace['first_progress'] - trace['started']) * 1000, 1)
+                                      if 'first_progress' in trace else None),
+            }
+            trace.clear()
+            if ok:
+                self.read_timing(view, record, PAINT_RETRIES)
+            else:
+                self.add(record, None)
+
+        view.loadStarted.connect(started)
+        view.loadProgress.connect(progress)
+        view.loadFinished.connect(finished)
+
+    def read_timing(self, view, record, retries, previous=None):
+        def read():
+            try:
+                view.page().runJavaScript(NAVIGATION_TIMING_JS, timing_read)
+            except RuntimeError:
+                # The view went away in the meantime
+                self.add(record, previous)
+
+        def timing_read(timing):
+            if not isinstance(timing, dict) or timing.get('url') != record['url']:
+                # Navigated on already, what was read before is all there is
+                self.add(record, previous if previous is not None else timing)
+            elif timing['first_contentful_paint'] is None and retries:
+                QTimer.singleShot(PAINT_RETRY_MS, lambda: self.read_timing(view, record, retries - 1, timing))
+            else:
+                self.add(record, timing)
+
+        read()
+
+    def add(self, record, timing):
+        for field in PAGE_FIELDS:
+            value = timing.get(field) if isinstance(timing, dict) else None
+            record[field] = round(value, 1) if isinstance(value, float) else value
+        self.records.append(record)
+        for listener in self.listeners:
+            listener(record)
+
+    def summary(self):
+        # {origin: {'count', 'failed', field: {'p50', 'p95', 'p99'}}} over the kept records
+        values = {}
+        for record in self.records:
+            origin = values.setdefault(record['origin'], {'count': 0, 'failed': 0})
+            origin['count'] += 1
+            if not record['ok']:
+                origin['failed'] += 1
+            for field in SUMMARY_FIELDS:
+                if record[field] is not None:
+                    origin.setdefault(field, []).append(record[field])
+
+        for origin in values.values():
+            for field in SUMMARY_FIELDS:
+                samples = sorted(origin.pop(field, []))
+                origin[field] = {f'p{p}': percentile(samples, p) for p in (50, 95, 99)}
+        return values
+
+    def slowest(self, count=10, field='load_ms'):
+        # Origins by their p95, slowest first
+        summary = self.summary()
+        ranked = sorted(summary, key=lambda origin: summary[origin][field]['p95'] or 0, reverse=True)
+        return [(origin, summary[origin]) for origin in ranked[:count]]
+
+    def export_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'records': list(self.records), 'summary': self.summary()}, f, indent=1)
+        return len(self.records)
+
+    def export_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+        return len(self.records)
+
+
+def ms(value):
+    return f"{value:.0f}" if value is not None else "-"
+
+
+class LoadOverlay(QLabel):
+    # Drawn over the corner of the page: the current tab's last load and the origins with
+    # the slowest p95 load times. It ignores the mouse and is only updated while shown.
+    STYLE = "QLabel { background-color: rgba(0, 0, 0, 190); color: #ffffff; padding: 8px; font-family: monospace; }"
+
+    def __init__(self, telemetry, current_url, parent):
+        super().__init__(parent)
+        self.telemetry = telemetry
+        self.current_url = current_url
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setTextFormat(Qt.RichText)
+        self.setStyleSheet(self.STYLE)
+        self.hide()
+        self.listener = lambda record: self.refresh() if self.isVisible() else None
+        telemetry.listeners.append(self.listener)
+
+    def detach(self):
+        # The telemetry outlives the window
+        self.telemetry.listeners.remove(self.listener)
+
+    def toggle(self):
+        self.setVisible(not self.isVisible())
+        if self.isVisible():
+            self.refresh()
+            self.raise_()
+
+    def refresh(self):
+        url = self.current_url()
+        last = next((record for record in reversed(self.telemetry.records) if record['url'] == url), None)
+        rows = []
+        if last is not None:
+            rows.append(f"<b>This page</b>: load {ms(last['load_ms'])} ms, first byte "
+                        f"{ms(last['response_start'])} ms, first paint {ms(last['first_contentful_paint'])} ms")
+        rows.append("<b>Slowest origins</b> (ms, p50 / p95 / p99 load)")
+        for origin, stats in self.telemetry.slowest():
+            load = stats['load_ms']
+            rows.append(f"{html.escape(origin)}: {ms(load['p50'])} / {ms(load['p95'])} / {ms(load['p99'])} "
+                        f"({stats['count']} loads, {stats['failed']} failed)")
+        self.setText('<br>'.join(rows))
+        self.place()
+
+    def place(self):
+        self.adjustSize()
+        parent = self.parentWidget()
+        self.move(parent.width() - self.width() - 12, 40)
@@ -0,0 +1,93 @@
+from PyQt5.QtGui import QColor, QPalette
+
+
+LIGHT = {
+    'window': '#f0f0f0',
+    'toolbar': '#e0e0e0',
+    'text': '#000000',
+    'input': '#ffffff',
+    'input_text': '#000000',
+    'border': '#cccccc',
+    'tab': '#f0f0f0',
+    'tab_selected': '#d0d0d0',
+    'hover': '#e0e0e0',
+}
+
+
+def colored(color):
+    # The colored modes: chrome in one color with light text on dark controls
+    return {
+        'window': color,
+        'toolbar': color,
+        'text': '#ffffff',
+        'input': '#555555',
+        'input_text': '#ffffff',
+        'border': '#444444',
+        'tab': '#3c3c3c',
+        'tab_selected': '#555555',
+        'hover': '#555555',
+    }
+
+
+THEMES = {
+    'light': LIGHT,
+    'White': colored('#fff'),
+    'Lavender': colored('#E6E6FA'),
+    'Normal': colored('#3c3c3c'),
+    'Custom': colored('#252635'),
+    'Dark': colored('#333'),
+}
+
+TOOLBAR_STYLE = """
+QToolBar {{ background-color: {toolbar}; border: none; }}
+QLineEdit {{ background-color: {input}; color: {input_text}; border: 1px solid {border}; }}
+"""
+
+TITLE_BAR_STYLE = """
+QWidget#title_bar {{ background-color: {window}; }}
+QLabel {{ color: {text}; }}
+QPushButton {{ background-color: {window}; color: {text}; border: none; }}
+QPushButton:hover {{ background-color: {hover}; }}
+"""
+
+
+class CompiledTheme:
+    def __init__(self, name, colors):
+        self.name = name
+        self.dark = QColor(colors['window']).lightness() < 128
+        self.toolbar = TOOLBAR_STYLE.format(**colors)
+        self.title_bar = TITLE_BAR_STYLE.format(**colors)
+
+        # The window's own background is painted by the window, a palette or style sheet
+        # set on it would reach every widget of every tab
+        self.window_color = QColor(colors['window'])
+
+        # Fusion draws tabs from the palette: the selected one in Window, the others in Button.
+        # A style sheet on the tab bar would make it measure every tab again on each switch.
+        self.tab_palette = QPalette()
+        self.tab_palette.setColor(QPalette.Window, QColor(colors['tab_selected']))
+        self.tab_palette.setColor(QPalette.Button, QColor(colors['tab']))
+        self.tab_palette.setColor(QPalette.WindowText, QColor(colors['text']))
+        self.tab_palette.setColor(QPalette.ButtonText, QColor(colors['text']))
+
+
+class ThemeEngine:
+    # Every theme is turned into its style sheets and palettes once. Applying one sets them
+    # on the window chrome only (toolbar, tab bar, title bar) instead of on the main window,
+    # where a style sheet would re-polish every widget of every open tab.
+    def __init__(self, themes=THEMES):
+        self.compiled = {name: CompiledTheme(name, colors) for name, colors in themes.items()}
+
+    def names(self):
+        return list(self.compiled)
+
+    def get(self, name):
+        return self.compiled.get(name, self.compiled['light'])
+
+    def apply(self, theme, toolbar, tab_bar, title_bar, window):
+        window.update()
+        tab_bar.setPalette(theme.tab_palette)
+        # Setting an unchanged sheet still re-polishes, so skip those
+        for widget, sheet in ((toolbar, theme.toolbar), (title_bar, theme.title_bar)):
+            if widget.styleSheet() != sheet:
+                widget.setStyleSheet(sheet)